@@ -0,0 +1,223 @@
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import numpy as np
+import pandas as pd
+
+TRAINING_SUFFIXES = ('.csv', '.csv.gz', '.parquet')
+
+# Columns loaded by default; password is high-cardinality and unused
+DEFAULT_COLUMNS = ['utc_time', 'src_host', 'src_port', 'dst_host', 'dst_port', 'logtype', 'node_id', 'username']
+
+INT_COLUMNS = {'src_port': np.int32, 'dst_port': np.int32}
+CATEGORY_COLUMNS = {'src_host', 'dst_host', 'logtype', 'node_id', 'username', 'password'}
+TIME_COLUMNS = {'utc_time'}
+
+# Stand-in for missing or unparseable integers
+MISSING_INT = -1
+
+UTC_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+CHUNK_ROWS = 200_000
+
+
+def list_training_objects(bucket, prefix):
+    """Every CSV, CSV.gz or Parquet object under prefix, following pagination"""
+    s3 = boto3.client('s3')
+    paginator = s3.get_paginator('list_objects_v2')
+    objects = [
+        obj
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for obj in page.get('Contents', [])
+        if obj['Key'].endswith(TRAINING_SUFFIXES)
+    ]
+    if not objects:
+        raise FileNotFoundError(f"No files found in s3://{bucket}/{prefix}")
+    return objects
+
+
+def partition_of(key, prefix):
+    """Input partition a key belongs to: its directory under prefix (e.g.
+    event_date=2025-04-01), or the file name for unpartitioned exports"""
+    relative = key[len(prefix):].lstrip('/')
+    directory, _, name = relative.rpartition('/')
+    return directory or name
+
+
+def list_training_partitions(bucket, prefix):
+    """Training objects under prefix grouped by input partition"""
+    partitions = {}
+    for obj in list_training_objects(bucket, prefix):
+        partitions.setdefault(partition_of(obj['Key'], prefix), []).append(obj)
+    return partitions
+
+
+def download_keys(bucket, prefix, keys, local_dir, max_workers=16):
+    """Download keys in parallel; returns local paths in key order"""
+    s3 = boto3.client('s3')
+    os.makedirs(local_dir, exist_ok=True)
+
+    def download(key):
+        # Partitioned prefixes reuse file names, so keep the key path in the name
+        local_file = os.path.join(local_dir, key[len(prefix):].lstrip('/').replace('/', '__'))
+        s3.download_file(bucket, key, local_file)
+        return local_file
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(download, keys))
+
+
+def download_from_s3(bucket, prefix, local_dir, max_workers=16):
+    """Download every training file under prefix in parallel; returns local paths"""
+    print(f"Attempting to download from s3://{bucket}/{prefix} to {local_dir}")
+    try:
+        keys = [obj['Key'] for obj in list_training_objects(bucket, prefix)]
+        local_files = download_keys(bucket, prefix, keys, local_dir, max_workers)
+        print(f"Successfully downloaded {len(local_files)} files")
+        return local_files
+    except Exception as e:
+        print(f"Error downloading from S3: {str(e)}")
+        raise
+
+
+def count_rows(path):
+    """Data rows in a file without parsing it (Parquet metadata or newline count).
+
+    Exact for Parquet. For CSV it is only an estimate: quoted fields such as
+    username and password may contain newlines.
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+
+    opener = gzip.open if path.endswith('.gz') else open
+    lines, last = 0, b'\n'
+    with opener(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    # Minus the header line
+    return max(lines - 1, 0)
+
+
+def iter_chunks(path, columns, chunk_rows=CHUNK_ROWS):
+    """Yield DataFrame chunks holding only the requested columns"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        present = [c for c in columns if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=present):
+            yield batch.to_pandas()
+        return
+
+    # Integer columns are left to the C parser's numeric inference, which is
+    # far cheaper than parsing strings and converting afterwards
+    reader = pd.read_csv(
+        path,
+        usecols=lambda c: c in columns,
+        dtype={c: object for c in columns if c not in INT_COLUMNS},
+        keep_default_na=False,
+        na_values=[''],
+        chunksize=chunk_rows
+    )
+    for chunk in reader:
+        yield chunk
+
+
+class _CategoryColumn:
+    """int32 codes filled in place, with categories discovered chunk by chunk"""
+
+    def __init__(self, size):
+        self.codes = np.full(size, -1, dtype=np.int32)
+        self.categories = {}
+
+    def resize(self, size):
+        self.codes = _resized(self.codes, size, -1)
+
+    def fill(self, start, values):
+        codes, uniques = pd.factorize(values)
+        mapping = np.array([self.categories.setdefault(str(u), len(self.categories)) for u in uniques], dtype=np.int32)
+        if len(mapping):
+            self.codes[start:start + len(codes)] = np.where(codes >= 0, mapping[np.maximum(codes, 0)], -1)
+
+    def finish(self, rows):
+        return pd.Categorical.from_codes(self.codes[:rows], categories=list(self.categories))
+
+
+def _fill_value(column):
+    if column in INT_COLUMNS:
+        return MISSING_INT
+    if column in TIME_COLUMNS:
+        return np.datetime64('NaT')
+    return None
+
+
+def _resized(array, size, fill):
+    """array grown (or cut) to size, new slots set to fill"""
+    out = np.empty(size, dtype=array.dtype)
+    keep = min(len(array), size)
+    out[:keep] = array[:keep]
+    out[keep:] = fill
+    return out
+
+
+def load_training_frame(paths, columns=DEFAULT_COLUMNS, chunk_rows=CHUNK_ROWS):
+    """Read CSV, CSV.gz and Parquet files into one compactly typed DataFrame.
+
+    Row counts are estimated up front so every column is normally allocated
+    once and filled chunk by chunk; there is no per-file frame list and no
+    pd.concat copy at the end. Parsed rows, not the estimate, decide the
+    result: columns grow if a file holds more rows than counted (e.g. bare
+    \r line endings) and slots left by quoted newlines are trimmed.
+    """
+    paths = sorted(paths)
+    capacity = sum(count_rows(p) for p in paths)
+
+    arrays = {}
+    for column in columns:
+        if column in INT_COLUMNS:
+            arrays[column] = np.full(capacity, MISSING_INT, dtype=INT_COLUMNS[column])
+        elif column in TIME_COLUMNS:
+            arrays[column] = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[ns]')
+        elif column in CATEGORY_COLUMNS:
+            arrays[column] = _CategoryColumn(capacity)
+        else:
+            arrays[column] = np.empty(capacity, dtype=object)
+
+    row = 0
+    for path in paths:
+        print(f"Reading: {path}")
+        for chunk in iter_chunks(path, columns, chunk_rows):
+            n = len(chunk)
+            if row + n > capacity:
+                capacity = max(row + n, capacity + capacity // 2)
+                for column, target in arrays.items():
+                    if isinstance(target, _CategoryColumn):
+                        target.resize(capacity)
+                    else:
+                        arrays[column] = _resized(target, capacity, _fill_value(column))
+            for column, target in arrays.items():
+                if column not in chunk:
+                    continue
+                values = chunk[column]
+                if column in INT_COLUMNS:
+                    if not pd.api.types.is_numeric_dtype(values):
+                        values = pd.to_numeric(values, errors='coerce')
+                    target[row:row + n] = values.fillna(MISSING_INT).to_numpy(dtype=INT_COLUMNS[column])
+                elif column in TIME_COLUMNS:
+                    if not pd.api.types.is_datetime64_any_dtype(values):
+                        values = pd.to_datetime(values, format=UTC_TIME_FORMAT, errors='coerce')
+                    target[row:row + n] = values.to_numpy(dtype='datetime64[ns]')
+                elif column in CATEGORY_COLUMNS:
+                    target.fill(row, values.to_numpy())
+                else:
+                    target[row:row + n] = values.to_numpy()
+            row += n
+
+    data = {}
+    for column, target in arrays.items():
+        data[column] = target.finish(row) if isinstance(target, _CategoryColumn) else target[:row]
+    return pd.DataFrame(data, copy=False)
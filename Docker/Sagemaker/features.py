@@ -0,0 +1,294 @@
+import hashlib
+import os
+import socket
+
+import numpy as np
+import pandas as pd
+
+# Bump when a feature's definition changes; cached partitions built by an
+# older version are recomputed on the next run
+FEATURE_VERSION = 2
+FEATURE_PREFIX = "features/"
+
+# Column order of the model input; train.py exports the ONNX model with
+# this layout and the analyzer builds the same matrix at inference time
+FEATURE_COLUMNS = [
+    'dst_port',
+    'logtype',
+    'src_ip',
+    'src_net24',
+    'src_net16',
+    'attempts_1m',
+    'attempts_per_minute',
+    'src_events',
+    'distinct_ports',
+    'distinct_usernames',
+    'gap_prev',
+    'interarrival_mean',
+    'interarrival_std',
+    'interarrival_min'
+]
+
+# Stand-in for "not applicable" (first event of a source, non-IPv4 host, ...)
+MISSING = -1.0
+
+WINDOW_MS = 60_000
+
+# Per-source aggregates only look this far back from each event, so a
+# day-sized training partition and the analyzer's few minutes of history
+# describe an event the same way. train.py records it in the model state
+HISTORY_MS = 15 * 60_000
+UTC_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def _numeric(values):
+    """float64 array from a numeric, string or categorical column; NaN where unparseable"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = pd.to_numeric(pd.Series(values.cat.categories.astype(str)), errors='coerce').to_numpy(dtype=np.float64)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, categories[np.maximum(codes, 0)] if len(categories) else np.nan, np.nan)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _ipv4_to_int(hosts):
+    """uint32 value of each dotted-quad host, -1 for anything else"""
+    out = np.full(len(hosts), -1, dtype=np.int64)
+    for i, host in enumerate(hosts):
+        try:
+            out[i] = int.from_bytes(socket.inet_pton(socket.AF_INET, str(host)), 'big')
+        except OSError:
+            pass
+    return out
+
+
+def _distinct_in_window(host_codes, times, values, timeline, span):
+    """Distinct non-null values of each event's source over its trailing HISTORY_MS.
+
+    All arrays are in (source, time) order. An occurrence of a value counts
+    from its own time until HISTORY_MS later or until the same value shows
+    up again, whichever is first, so the distinct count at an event is the
+    number of those intervals covering it: starts so far minus ends so far.
+    """
+    valid = np.flatnonzero(values >= 0)
+    by_value = valid[np.lexsort((valid, values[valid], host_codes[valid]))]
+    next_time = np.full(len(by_value), np.iinfo(np.int64).max)
+    same = (host_codes[by_value[1:]] == host_codes[by_value[:-1]]) & (values[by_value[1:]] == values[by_value[:-1]])
+    next_time[:-1][same] = times[by_value[1:]][same]
+
+    base = host_codes[by_value].astype(np.int64) * span
+    starts = np.sort(base + times[by_value])
+    ends = np.sort(base + np.minimum(next_time, times[by_value] + HISTORY_MS + 1))
+    return np.searchsorted(starts, timeline, side='right') - np.searchsorted(ends, timeline, side='right')
+
+
+def _range_min(values, left, right):
+    """NaN-ignoring min of values[left:right + 1] per range, one sparse table level at a time"""
+    out = np.empty(len(left))
+    level = np.frexp(right - left + 1)[1] - 1
+    table = values
+    for k in range(int(level.max()) + 1 if len(level) else 0):
+        hit = level == k
+        out[hit] = np.fmin(table[left[hit]], table[right[hit] - (1 << k) + 1])
+        table = np.fmin(table[:-(1 << k)], table[1 << k:])
+    return out
+
+
+def events_frame(records):
+    """DataFrame from analyzer event dicts (awslogs_decoder.project_message output)"""
+    return pd.DataFrame.from_records(records, columns=['utc_time', 'src_host', 'dst_port', 'logtype', 'username'])
+
+
+def build_features(frame):
+    """Per-event features describing the event's source over its trailing HISTORY_MS.
+
+    The frame needs utc_time, src_host, dst_port, logtype and username;
+    extra columns are ignored. Rows without a parseable time or source
+    are dropped, and the result keeps the frame's index so callers can
+    align labels or events with it. Every per-source aggregate covers
+    only the events in [t - HISTORY_MS, t], so an event gets the same
+    features whether the frame holds a day or just enough history.
+    Everything is computed with sorts, searchsorted and cumulative sums,
+    so cost grows with rows rather than sources.
+    """
+    times = frame['utc_time']
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, format=UTC_TIME_FORMAT, errors='coerce')
+    host_codes, hosts = pd.factorize(frame['src_host'])
+
+    keep = ~np.asarray(pd.isna(times)) & (host_codes >= 0)
+    index = frame.index[keep]
+    host_codes = host_codes[keep]
+    n = len(host_codes)
+    if not n:
+        return pd.DataFrame(index=index, columns=FEATURE_COLUMNS, dtype=np.float64)
+
+    time_ms = np.asarray(times)[keep].astype('datetime64[ms]').astype(np.int64)
+    time_ms -= time_ms.min()
+    dst_port = _numeric(frame['dst_port'])[keep]
+    user_codes = pd.factorize(frame['username'])[0][keep]
+
+    # Sort by (source, time); each source's events become one contiguous run
+    order = np.lexsort((time_ms, host_codes))
+    sorted_hosts = host_codes[order]
+    sorted_ms = time_ms[order]
+
+    # Offset each source's timeline so runs never overlap, then a single
+    # searchsorted finds every window's edges. Events sharing a timestamp
+    # all count, so last can sit past the event itself
+    span = int(sorted_ms.max()) + HISTORY_MS + 2
+    timeline = sorted_hosts.astype(np.int64) * span + sorted_ms
+    last = np.searchsorted(timeline, timeline, side='right') - 1
+    first = np.searchsorted(timeline, timeline - HISTORY_MS, side='left')
+    in_window = last + 1 - np.searchsorted(timeline, timeline - WINDOW_MS, side='left')
+    src_events = last + 1 - first
+
+    # gaps[i] is the wait before sorted event i; NaN for a source's first
+    # event and for a previous event outside the history window
+    gaps = np.empty(n, dtype=np.float64)
+    gaps[0] = np.nan
+    gaps[1:] = np.diff(sorted_ms) / 1000.0
+    gaps[np.r_[True, sorted_hosts[1:] != sorted_hosts[:-1]]] = np.nan
+    gaps[gaps * 1000.0 > HISTORY_MS] = np.nan
+
+    # The window's gaps are gaps[first + 1:last + 1]; their sum telescopes
+    # and their squares come from a running total, kept in integer
+    # milliseconds so a day-long total loses nothing to rounding
+    n_gaps = src_events - 1
+    has_gaps = n_gaps > 0
+    gap_ms = np.where(np.isnan(gaps), 0, np.r_[0, np.diff(sorted_ms)])
+    gap_sq = np.cumsum(gap_ms * gap_ms)
+    gap_sq = gap_sq[last] - gap_sq[first]
+    gap_total = sorted_ms[last] - sorted_ms[first]
+    gap_sum = gap_total / 1000.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gap_mean = np.where(has_gaps, gap_sum / n_gaps, np.nan)
+        gap_var = (n_gaps * gap_sq - gap_total * gap_total) / (n_gaps * n_gaps.astype(np.float64))
+        gap_std = np.where(has_gaps, np.sqrt(np.maximum(gap_var, 0)) / 1000.0, np.nan)
+    gap_min = np.full(n, np.nan)
+    gap_min[has_gaps] = _range_min(gaps, first[has_gaps] + 1, last[has_gaps])
+
+    port_codes = np.where(np.isnan(dst_port), -1, dst_port + 1).astype(np.int64)
+    windowed = {
+        'attempts_1m': in_window,
+        'src_events': src_events,
+        'attempts_per_minute': src_events / np.maximum(gap_sum / 60.0, 1.0),
+        'distinct_ports': _distinct_in_window(sorted_hosts, sorted_ms, port_codes[order], timeline, span),
+        'distinct_usernames': _distinct_in_window(sorted_hosts, sorted_ms, user_codes[order], timeline, span),
+        'gap_prev': gaps,
+        'interarrival_mean': gap_mean,
+        'interarrival_std': gap_std,
+        'interarrival_min': gap_min
+    }
+
+    # Source address, indexed by host code
+    ip = _ipv4_to_int(hosts)
+    per_host = {
+        'src_ip': ip,
+        'src_net24': np.where(ip >= 0, ip >> 8, -1),
+        'src_net16': np.where(ip >= 0, ip >> 16, -1)
+    }
+    columns = {column: values[host_codes].astype(np.float64) for column, values in per_host.items()}
+
+    # Back from (source, time) order to frame order
+    for column, values in windowed.items():
+        columns[column] = np.empty(n)
+        columns[column][order] = values
+    columns['dst_port'] = dst_port
+    columns['logtype'] = _numeric(frame['logtype'])[keep]
+
+    return pd.DataFrame(columns, index=index)[FEATURE_COLUMNS].fillna(MISSING)
+
+
+def feature_matrix(features):
+    """float32 model input in FEATURE_COLUMNS order"""
+    return features[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+
+
+def source_tag(objects):
+    """Fingerprint of a partition's input objects and the feature version"""
+    digest = hashlib.sha256(f"v{FEATURE_VERSION}".encode())
+    for obj in sorted(objects, key=lambda o: o['Key']):
+        digest.update(f"{obj['Key']}:{obj['ETag']}".encode())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """Per-partition feature Parquet files in S3, tagged with their inputs.
+
+    Each object carries the source_tag of the input partition it was built
+    from; a partition is only recomputed when that tag changes.
+    """
+
+    def __init__(self, s3_client, bucket, prefix=FEATURE_PREFIX, local_dir='/tmp/features'):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.local_dir = local_dir
+        os.makedirs(local_dir, exist_ok=True)
+
+    def key(self, partition):
+        return f"{self.prefix}{partition}/features.parquet"
+
+    def _local_path(self, partition):
+        return os.path.join(self.local_dir, f"{partition.replace('/', '__')}.parquet")
+
+    def load(self, partition, tag):
+        """Cached features for partition, or None if missing or stale"""
+        from botocore.exceptions import ClientError
+
+        key = self.key(partition)
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        if head.get('Metadata', {}).get('source-tag') != tag:
+            return None
+
+        local_path = self._local_path(partition)
+        self.s3.download_file(self.bucket, key, local_path)
+        return pd.read_parquet(local_path)
+
+    def store(self, partition, tag, features):
+        local_path = self._local_path(partition)
+        features.to_parquet(local_path, index=False)
+        self.s3.upload_file(local_path, self.bucket, self.key(partition), ExtraArgs={'Metadata': {'source-tag': tag}})
+
+
+def build_training_features(bucket, input_prefix, local_dir, cache, trained=None):
+    """Features for input partitions, computing only new or changed ones.
+
+    trained maps partition -> source tag for partitions an existing model
+    was already fitted on; those are left out (warm-start runs). Returns
+    the features and the source tag of every partition they came from.
+    """
+    from data_loader import download_keys, list_training_partitions, load_training_frame
+
+    trained = trained or {}
+    partitions = list_training_partitions(bucket, input_prefix)
+    frames = []
+    tags = {}
+    computed = 0
+    for partition in sorted(partitions):
+        objects = partitions[partition]
+        tag = source_tag(objects)
+        if trained.get(partition) == tag:
+            continue
+        features = cache.load(partition, tag)
+        if features is None:
+            print(f"Building features for partition {partition}")
+            paths = download_keys(bucket, input_prefix, [obj['Key'] for obj in objects], local_dir)
+            features = build_features(load_training_frame(paths)).reset_index(drop=True)
+            cache.store(partition, tag, features)
+            for path in paths:
+                os.remove(path)
+            computed += 1
+        frames.append(features)
+        tags[partition] = tag
+
+    print(f"Features: {len(tags) - computed} partitions cached, {computed} computed, "
+          f"{len(partitions) - len(tags)} already trained")
+    if not frames:
+        return pd.DataFrame(columns=FEATURE_COLUMNS, dtype=np.float64), tags
+    return pd.concat(frames, ignore_index=True), tags
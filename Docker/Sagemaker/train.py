@@ -1,39 +1,20 @@
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
+import json
 import os
-import pandas as pd
+import time
+import numpy as np
 import boto3
 import joblib
+from botocore.exceptions import ClientError
 from skl2onnx import convert_sklearn
 from skl2onnx.common.data_types import FloatTensorType
-
-
-def download_from_s3(bucket, prefix, local_dir):
-    """Download files from S3 to local directory"""
-    print(f"Attempting to download from s3://{bucket}/{prefix} to {local_dir}")
-    s3 = boto3.client('s3')
-    os.makedirs(local_dir, exist_ok=True)
-
-    try:
-        response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-
-        if 'Contents' not in response:
-            raise FileNotFoundError(f"No files found in s3://{bucket}/{prefix}")
-
-        for obj in response['Contents']:
-            if obj['Key'].endswith('.csv'):
-                local_file = os.path.join(local_dir, os.path.basename(obj['Key']))
-                print(f"Downloading s3://{bucket}/{obj['Key']} to {local_file}")
-                s3.download_file(bucket, obj['Key'], local_file)
-                print(f"Successfully downloaded {local_file}")
-    except Exception as e:
-        print(f"Error downloading from S3: {str(e)}")
-        raise
+from features import FEATURE_COLUMNS, HISTORY_MS, FeatureCache, build_training_features, feature_matrix
 
 
 def upload_to_s3(local_path, bucket, prefix):
-    """Upload ONNX model directly to S3"""
-    print(f"Uploading ONNX model to S3...")
+    """Upload a model artifact directly to S3"""
+    print(f"Uploading {os.path.basename(local_path)} to S3...")
     s3 = boto3.client('s3')
 
     try:
@@ -47,62 +28,193 @@ def upload_to_s3(local_path, bucket, prefix):
         raise
 
 
+# SageMaker writes hyperparameters here as strings; environment variables
+# of the same name in upper case override them for local runs
+HYPERPARAMETERS_PATH = "/opt/ml/input/config/hyperparameters.json"
+DEFAULT_HYPERPARAMETERS = {
+    # "full" refits on every partition; "warm_start" adds trees fitted on
+    # partitions the previous model has not seen
+    'mode': 'full',
+    'n_estimators': 100,
+    'warm_start_trees': 25,
+    # Tree size bounds model.onnx size and conversion memory; 0 is unbounded
+    'max_depth': 0,
+    'min_samples_leaf': 1,
+    # Stratified subsample for fast iteration; 0 trains on every row
+    'subsample_rows': 0,
+    # -1 uses every core in the container
+    'n_jobs': -1
+}
+
+MODEL_ARTIFACT = "model.joblib"
+STATE_ARTIFACT = "training_state.json"
+
+
+def load_hyperparameters(path=HYPERPARAMETERS_PATH):
+    params = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            params = json.load(f)
+    return {
+        name: type(default)(os.environ.get(name.upper(), params.get(name, default)))
+        for name, default in DEFAULT_HYPERPARAMETERS.items()
+    }
+
+
+def label_events(features):
+    """Label based on destination port (FTP attack example)"""
+    return (features['dst_port'] == 21).astype(np.int8).to_numpy()
+
+
+def make_model(n_estimators, n_jobs, max_depth=0, min_samples_leaf=1):
+    return RandomForestClassifier(
+        n_estimators=n_estimators,
+        n_jobs=n_jobs,
+        max_depth=max_depth or None,
+        min_samples_leaf=min_samples_leaf
+    )
+
+
+def stratified_subsample(X, y, rows, random_state=42):
+    """At most rows samples with the class balance of y"""
+    if rows <= 0 or rows >= len(y):
+        return X, y
+    stratify = y if len(np.unique(y)) > 1 else None
+    X_sample, _, y_sample, _ = train_test_split(X, y, train_size=rows, stratify=stratify, random_state=random_state)
+    return X_sample, y_sample
+
+
+def export_onnx(model, path):
+    """Convert a fitted model to ONNX with the FEATURE_COLUMNS input layout"""
+    initial_type = [("input", FloatTensorType([None, len(FEATURE_COLUMNS)]))]
+    # Plain probability tensor instead of a ZipMap list of dicts, so the
+    # analyzer can slice the threat column straight out of one run() call
+    onnx_model = convert_sklearn(model, initial_types=initial_type, options={type(model): {'zipmap': False}})
+    with open(path, "wb") as f:
+        f.write(onnx_model.SerializeToString())
+
+
+def load_previous_model(bucket, prefix, local_dir):
+    """The last run's fitted model and training state, or (None, {})"""
+    s3 = boto3.client('s3')
+    model_path = os.path.join(local_dir, MODEL_ARTIFACT)
+    state_path = os.path.join(local_dir, STATE_ARTIFACT)
+    try:
+        s3.download_file(bucket, f"{prefix}/{MODEL_ARTIFACT}", model_path)
+        s3.download_file(bucket, f"{prefix}/{STATE_ARTIFACT}", state_path)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            print("No previous model found; training from scratch")
+            return None, {}
+        raise
+
+    with open(state_path) as f:
+        state = json.load(f)
+    if state.get('feature_columns') != FEATURE_COLUMNS or state.get('history_ms') != HISTORY_MS:
+        print("Previous model used different features; training from scratch")
+        return None, {}
+    return joblib.load(model_path), state
+
+
 # Configuration
 input_dir = "/opt/ml/input/data/training"
 output_dir = "/opt/ml/model"
 bucket = "darktracer-training-bucket-dev"
 input_prefix = "input/"
+feature_prefix = "features/"
 output_prefix = "output"
 
-# Ensure local directories exist
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(input_dir, exist_ok=True)
-
-# Download data from S3
-download_from_s3(bucket=bucket, prefix=input_prefix, local_dir=input_dir)
-
-# Load data from .csv files
-csv_files = [f for f in os.listdir(input_dir) if f.endswith(".csv")]
-dfs = []
-for file_name in csv_files:
-    file_path = os.path.join(input_dir, file_name)
-    print(f"Reading: {file_path}")
-    df = pd.read_csv(file_path)
-    dfs.append(df)
-
-data = pd.concat(dfs, ignore_index=True)
-print("Training data shape:", data.shape)
-
-# Create label column based on destination port (FTP attack example)
-data['label'] = data['dst_port'].apply(lambda x: 1 if x == 21 else 0)
-
-# Prepare features and target variable
-X = data.drop(columns=['label']).select_dtypes(include=['number'])
-y = data['label']
-
-# Train/test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# Train a simple RandomForest model
-model = RandomForestClassifier()
-model.fit(X_train, y_train)
-
-# Evaluate model accuracy
-accuracy = model.score(X_test, y_test)
-print(f"Validation Accuracy: {accuracy:.4f}")
-
-# Convert model to ONNX format
-onnx_output_path = os.path.join(output_dir, "model.onnx")
-initial_type = [("input", FloatTensorType([None, X.shape[1]]))]
-onnx_model = convert_sklearn(model, initial_types=initial_type)
-with open(onnx_output_path, "wb") as f:
-    f.write(onnx_model.SerializeToString())
-print(f"Model saved in ONNX format to {onnx_output_path}")
-
-# Upload ONNX model to S3
-upload_to_s3(
-    local_path=onnx_output_path,
-    bucket=bucket,
-    prefix=output_prefix
-)
 
+def main():
+    hyperparameters = load_hyperparameters()
+    print("Hyperparameters:", hyperparameters)
+
+    # Ensure local directories exist
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(input_dir, exist_ok=True)
+
+    model, state = None, {}
+    if hyperparameters['mode'] == 'warm_start':
+        model, state = load_previous_model(bucket, output_prefix, output_dir)
+
+    # Per-source features for every input partition; partitions already in
+    # the feature cache are reused, only new ones are downloaded and computed
+    cache = FeatureCache(boto3.client('s3'), bucket, prefix=feature_prefix)
+    features, tags = build_training_features(bucket, input_prefix, input_dir, cache, trained=state.get('partitions'))
+    if features.empty:
+        print("No new partitions since the last run; keeping the previous model")
+        return
+
+    # Prepare features in the column order the analyzer scores with
+    y = label_events(features)
+    if model is not None and set(np.unique(y)) != set(model.classes_):
+        # Trees fitted on a single class cannot be mixed into the forest
+        print("New partitions do not cover every class; refitting on all partitions")
+        model, state = None, {}
+        features, tags = build_training_features(bucket, input_prefix, input_dir, cache)
+        y = label_events(features)
+    X = feature_matrix(features)
+    del features
+    print("Training data shape:", X.shape)
+
+    X, y = stratified_subsample(X, y, hyperparameters['subsample_rows'])
+
+    # Train/test split
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    if model is None:
+        model = make_model(
+            hyperparameters['n_estimators'],
+            hyperparameters['n_jobs'],
+            hyperparameters['max_depth'],
+            hyperparameters['min_samples_leaf']
+        )
+        partitions = tags
+    else:
+        # warm_start keeps the fitted trees and only fits the added ones
+        model.set_params(
+            warm_start=True,
+            n_estimators=model.n_estimators + hyperparameters['warm_start_trees'],
+            n_jobs=hyperparameters['n_jobs']
+        )
+        partitions = {**state['partitions'], **tags}
+        print(f"Warm start: adding {hyperparameters['warm_start_trees']} trees to {len(model.estimators_)}")
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    print(f"Fit {len(model.estimators_)} trees on {len(y_train)} rows in {time.perf_counter() - start:.1f}s")
+
+    # Evaluate model accuracy
+    accuracy = model.score(X_test, y_test)
+    print(f"Validation Accuracy: {accuracy:.4f}")
+
+    # Keep the fitted model and the partitions it has seen for the next warm start
+    model_path = os.path.join(output_dir, MODEL_ARTIFACT)
+    state_path = os.path.join(output_dir, STATE_ARTIFACT)
+    joblib.dump(model, model_path)
+    with open(state_path, "w") as f:
+        json.dump({
+            'feature_columns': FEATURE_COLUMNS,
+            # Trailing window of the per-source features; the analyzer keeps this much history
+            'history_ms': HISTORY_MS,
+            'partitions': partitions,
+            'accuracy': accuracy
+        }, f)
+
+    # Convert model to ONNX format
+    onnx_output_path = os.path.join(output_dir, "model.onnx")
+    start = time.perf_counter()
+    export_onnx(model, onnx_output_path)
+    print(f"Model saved in ONNX format to {onnx_output_path} in {time.perf_counter() - start:.1f}s")
+
+    # Upload the ONNX model last so the analyzer never sees it ahead of its state
+    for path in (model_path, state_path, onnx_output_path):
+        upload_to_s3(
+            local_path=path,
+            bucket=bucket,
+            prefix=output_prefix
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from functools import wraps
+
+import boto3
+from botocore.config import Config
+
+# One pool per client; sized for the handlers' worker threads
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32'))
+
+# Adaptive mode adds client-side rate limiting on top of standard retries
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'adaptive'}
+)
+
+# Warm-container state: one botocore session, one client per service
+_session = None
+_clients = {}
+_lock = threading.RLock()
+
+
+def session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+
+def client(service_name):
+    """The container's client for service_name, created on first use.
+
+    Every client shares one session, so credentials and endpoint data are
+    resolved once per container instead of once per client. botocore
+    clients are thread-safe, so the handlers' worker threads share them too.
+    """
+    existing = _clients.get(service_name)
+    if existing is not None:
+        return existing
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = session().client(service_name, config=CLIENT_CONFIG)
+        return _clients[service_name]
+
+
+class LazyClient:
+    """Module-level stand-in for a client that is only built when first used"""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(client(self.service_name), name)
+
+    def __repr__(self):
+        return f"LazyClient({self.service_name!r})"
+
+
+def lazy(service_name):
+    return LazyClient(service_name)
+
+
+class RateLimiter:
+    """Token bucket shared by every thread in the container.
+
+    A caller that finds the bucket empty reserves the next token and sleeps
+    until it is due, so concurrent callers queue up instead of bursting.
+    """
+
+    def __init__(self, per_second, burst=None):
+        self.per_second = per_second
+        self.burst = burst or max(1.0, per_second)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.per_second <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.per_second)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.per_second if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottledClient:
+    """A client whose API operations each wait for a token from limiter.
+
+    Everything else (exceptions, meta, paginators) passes straight through.
+    """
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in self.client.meta.method_to_api_mapping:
+            return attr
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            self.limiter.acquire()
+            return attr(*args, **kwargs)
+        return call
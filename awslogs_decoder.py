@@ -0,0 +1,185 @@
+import base64
+import codecs
+import csv
+import gzip
+import io
+import json
+import re
+
+# orjson is optional; it is only used for the per-message parse
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Read the gzip stream in chunks so we never hold the whole envelope
+CHUNK_SIZE = 64 * 1024
+
+# Fields project_message keeps, in the exporter's CSV column names
+EVENT_FIELDS = ('src_host', 'dst_port', 'logtype', 'utc_time', 'username')
+
+# CloudWatch Logs writes messageType first in every envelope
+_ENVELOPE_START = re.compile(rb'\s*\{\s*"messageType"')
+
+_json_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _JsonStream:
+    """Incremental reader over a gzip'd JSON document"""
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk, dropping everything already consumed"""
+        if self.eof:
+            return False
+        chunk = self.fileobj.read(self.chunk_size)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + self.text.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def at_end(self):
+        """Skip whitespace; True if nothing but whitespace is left"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return False
+            if not self.fill():
+                return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it"""
+        if self.at_end():
+            raise ValueError("Unexpected end of awslogs payload")
+        return self.buf[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in awslogs payload at {self.buf[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more data as needed"""
+        self.peek()
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer edge may be a truncated number
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def _iter_envelope(stream):
+    """Yield the logEvents entries of the envelope object starting at the stream's position"""
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.pos += 1
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key != 'logEvents':
+            stream.value()
+        else:
+            stream.expect('[')
+            if stream.peek() != ']':
+                while True:
+                    yield stream.value()
+                    if stream.peek() != ',':
+                        break
+                    stream.pos += 1
+            stream.expect(']')
+        if stream.peek() != ',':
+            break
+        stream.pos += 1
+    stream.expect('}')
+
+
+def iter_log_events(data, chunk_size=CHUNK_SIZE):
+    """Yield the logEvents entries of a base64 awslogs payload one at a time"""
+    stream = _JsonStream(gzip.GzipFile(fileobj=io.BytesIO(base64.b64decode(data))), chunk_size)
+    yield from _iter_envelope(stream)
+
+
+def is_envelope(head):
+    """True if the bytes open a CloudWatch Logs envelope rather than an OpenCanary line"""
+    return _ENVELOPE_START.match(head) is not None
+
+
+def iter_envelope_events(fileobj, chunk_size=CHUNK_SIZE):
+    """Yield (event number, projected message) from back-to-back envelopes.
+
+    This is how Firehose writes a CloudWatch Logs subscription to S3: one
+    envelope per record, concatenated. Log events are numbered across the
+    whole object, so reprocessing it gives every event the same number.
+    """
+    stream = _JsonStream(fileobj, chunk_size)
+    number = 0
+    while not stream.at_end():
+        for log_event in _iter_envelope(stream):
+            number += 1
+            honeypot_data = project_message(log_event.get('message', ''))
+            if honeypot_data is not None:
+                yield number, honeypot_data
+
+
+def project_message(message):
+    """Parse an OpenCanary message keeping only the fields the analyzer uses"""
+    try:
+        data = _loads(message)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    logdata = data.get('logdata')
+    return {
+        'src_host': data.get('src_host'),
+        'dst_port': data.get('dst_port'),
+        'logtype': data.get('logtype'),
+        'utc_time': data.get('utc_time'),
+        'username': logdata.get('USERNAME') if isinstance(logdata, dict) else None
+    }
+
+
+def iter_honeypot_events(data, chunk_size=CHUNK_SIZE):
+    """Yield (timestamp, projected message) for every parseable log event"""
+    for log_event in iter_log_events(data, chunk_size):
+        honeypot_data = project_message(log_event.get('message', ''))
+        if honeypot_data is not None:
+            yield log_event.get('timestamp'), honeypot_data
+
+
+def iter_export_events(lines, key):
+    """Yield (line number, projected event) from OpenCanary JSON lines,
+    CloudWatch Logs export lines or the exporter's CSV (by key suffix)"""
+    if key.endswith(('.csv', '.csv.gz')):
+        for line_no, row in enumerate(csv.DictReader(lines), start=2):
+            yield line_no, {field: row.get(field) or None for field in EVENT_FIELDS}
+        return
+
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        # CloudWatch Logs exports prefix each message with its timestamp
+        if not line.startswith('{'):
+            line = line.partition(' ')[2]
+        event = project_message(line)
+        if event is not None:
+            yield line_no, event
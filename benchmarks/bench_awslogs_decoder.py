@@ -0,0 +1,108 @@
+"""Compare the streaming awslogs decoder against the old full-parse path.
+
+Usage: python benchmarks/bench_awslogs_decoder.py [--size-mb 1] [--repeat 20]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from awslogs_decoder import iter_honeypot_events  # noqa: E402
+
+LOGTYPES = [2000, 3000, 4000, 4002, 5001, 6001, 9999]
+PORTS = [21, 22, 23, 80, 443, 3306, 3389, 5432, 8080]
+
+
+def build_payload(size_mb):
+    """Build a base64 awslogs payload whose uncompressed envelope is ~size_mb"""
+    rng = random.Random(42)
+    events = []
+    size = 0
+    ts = int(time.time() * 1000)
+    while size < size_mb * 1024 * 1024:
+        message = json.dumps({
+            'dst_host': '10.0.1.25',
+            'dst_port': rng.choice(PORTS),
+            'local_time': '2025-04-25 12:00:00.000000',
+            'local_time_adjusted': '2025-04-25 12:00:00.000000',
+            'logdata': {
+                'USERNAME': rng.choice(['root', 'admin', 'ubuntu', 'test']),
+                'PASSWORD': ''.join(rng.choices('abcdefghijk0123456789', k=10)),
+                'SESSION': rng.randrange(100000)
+            },
+            'logtype': rng.choice(LOGTYPES),
+            'node_id': 'opencanary-1',
+            'src_host': f"203.0.113.{rng.randrange(256)}",
+            'src_port': rng.randrange(1024, 65535),
+            'utc_time': '2025-04-25 12:00:00.000000'
+        })
+        event = {'id': str(len(events)), 'timestamp': ts, 'message': message}
+        events.append(event)
+        size += len(json.dumps(event))
+
+    envelope = {
+        'messageType': 'DATA_MESSAGE',
+        'owner': '123456789012',
+        'logGroup': '/darktracer/honeypot/opencanary',
+        'logStream': 'opencanary',
+        'subscriptionFilters': ['honeypot-to-analyzer'],
+        'logEvents': events
+    }
+    return base64.b64encode(gzip.compress(json.dumps(envelope).encode('utf-8'))), len(events)
+
+
+def baseline_decode(data):
+    """The decode path the analyzer used before awslogs_decoder"""
+    log_data = json.loads(gzip.decompress(base64.b64decode(data)))
+    out = []
+    for log_event in log_data['logEvents']:
+        try:
+            out.append((log_event.get('timestamp'), json.loads(log_event['message'])))
+        except json.JSONDecodeError:
+            continue
+    return out
+
+
+def streaming_decode(data):
+    return list(iter_honeypot_events(data))
+
+
+def measure(fn, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), sorted(timings)[len(timings) // 2], peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    data, n_events = build_payload(args.size_mb)
+    assert len(baseline_decode(data)) == len(streaming_decode(data)) == n_events
+
+    print(f"payload: {n_events} events, {len(data) / 1024:.0f} KiB base64")
+    print(f"{'decoder':<12} {'best ms':>10} {'median ms':>10} {'peak MiB':>10}")
+    for name, fn in (('baseline', baseline_decode), ('streaming', streaming_decode)):
+        best, median, peak = measure(fn, data, args.repeat)
+        print(f"{name:<12} {best * 1000:>10.1f} {median * 1000:>10.1f} {peak / 1024 / 1024:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Import-plus-init time of every Lambda handler module, as a cold start sees it.
+
+Each module is imported in a fresh interpreter, the way Lambda's init
+phase does. botocore's create_client is wrapped to count the clients
+built during init and the time spent building them. No AWS call is made:
+credentials and region are dummies.
+
+Usage: python benchmarks/bench_cold_start.py [--repeat 5] [--modules lambda_threat_analyzer ...]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HANDLER_MODULES = [
+    'lambda_threat_analyzer',
+    'lambda_remediation_worker',
+    'lambda_function',
+    'lambda_honeypot_to_csv',
+    'lambda_compact_honeypot',
+    'lambda_athena_unload',
+    'chatbot_lambda',
+    'log_index'
+]
+
+# Enough configuration for every module to initialise without touching AWS
+CHILD_ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'S3_BUCKET': 'bench-bucket',
+    'LOG_GROUP_NAME': '/bench/honeypot',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench'
+}
+
+
+def run_child(module):
+    import contextlib
+    import importlib
+    import io
+
+    sys.path.insert(0, ROOT)
+    import botocore.session
+
+    created = []
+    original = botocore.session.Session.create_client
+
+    def counting_create_client(self, service_name, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(self, service_name, *args, **kwargs)
+        finally:
+            created.append((service_name, time.perf_counter() - start))
+
+    botocore.session.Session.create_client = counting_create_client
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        importlib.import_module(module)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'seconds': elapsed,
+        'client_seconds': sum(s for _, s in created),
+        'clients': [name for name, _ in created],
+        'peak_kb': peak_kb
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--modules', nargs='+', default=HANDLER_MODULES)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    env = {**os.environ, **CHILD_ENV}
+    print(f"{'module':<26} {'init ms':>8} {'client ms':>10} {'clients':>8} {'peak RSS MiB':>13}  created at init")
+    for module in args.modules:
+        runs = []
+        for _ in range(args.repeat):
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', module],
+                capture_output=True, text=True, env=env
+            )
+            if child.returncode:
+                error = child.stderr.strip().splitlines()[-1] if child.stderr.strip() else child.returncode
+                print(f"{module:<26} failed: {error}")
+                break
+            runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+        if not runs:
+            continue
+        init_ms = statistics.median(r['seconds'] for r in runs) * 1000
+        client_ms = statistics.median(r['client_seconds'] for r in runs) * 1000
+        peak = statistics.median(r['peak_kb'] for r in runs) / 1024
+        clients = runs[0]['clients']
+        print(f"{module:<26} {init_ms:>8.1f} {client_ms:>10.1f} {len(clients):>8} {peak:>13.1f}  {', '.join(clients) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+"""Events/sec, latency, peak RSS and AWS calls per event of each handler on synthetic OpenCanary load.
+
+Events come from opencanary_synth and are replayed through the real
+handlers, each scenario in a fresh subprocess against moto's in-process
+AWS. Two services are stand-ins instead: Athena, which moto cannot run
+UNLOAD for, writes the partition's rows to moto S3, and SQS keeps sent
+messages in memory, since moto's send cost grows with queue depth. Every
+API call made after setup is counted. Latency is per handler invocation.
+
+Scenarios:
+  analyzer           lambda_threat_analyzer, remediation queued to SQS
+  analyzer-inline    lambda_threat_analyzer, remediation applied in-process
+  remediation-worker lambda_remediation_worker draining the analyzer's queue
+  s3-ingest          lambda_function on CloudWatch export objects
+  honeypot-export    lambda_honeypot_to_csv over CloudWatch Logs streams
+  athena-unload      lambda_athena_unload, one new event_date partition per run
+
+Each scenario runs --repeat times and every metric is the median over
+the runs. Results are compared with benchmarks/baselines/replay.json,
+and the run exits non-zero when a metric is worse than its baseline by
+more than --tolerance. --save-baseline records the current run instead.
+Only runs with the same --events are compared. Timings
+include moto's own overhead and only compare like for like on the
+machine that recorded the baseline; API calls per event do not depend on
+the machine.
+
+Usage: python benchmarks/bench_replay.py [--events 10000] [--repeat 3] [--scenarios analyzer s3-ingest ...] [--save-baseline]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'replay.json')
+
+SCENARIOS = ['analyzer', 'analyzer-inline', 'remediation-worker', 's3-ingest', 'honeypot-export', 'athena-unload']
+
+# metric -> True when higher is better
+METRICS = {
+    'events_per_second': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'peak_mib': False,
+    'calls_per_event': False
+}
+
+REGION = 'us-east-1'
+
+# Same shape of traffic in every scenario; only how it is packaged differs
+EVENTS_PER_PAYLOAD = 500
+EVENTS_PER_OBJECT = 5000
+EVENTS_PER_EXPORT_RUN = 2000
+UNLOAD_PARTITIONS = 7
+WORKER_BATCH_SIZE = 100
+
+
+class CallCounter:
+    """Counts botocore API calls by (service, operation) from install() on"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def install(self):
+        import botocore.client
+        original = botocore.client.BaseClient._make_api_call
+        counter = self
+
+        def counting_make_api_call(client, operation_name, api_params):
+            key = f"{client.meta.service_model.service_name}:{operation_name}"
+            counter.calls[key] = counter.calls.get(key, 0) + 1
+            return original(client, operation_name, api_params)
+
+        botocore.client.BaseClient._make_api_call = counting_make_api_call
+
+    def add(self, key):
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def reset(self):
+        self.calls = {}
+
+
+class ReplayClock:
+    """Stand-in for a module's `time` whose time() is the replayed event time.
+
+    Windowed state (the rate detector) then sees payloads arrive at the
+    pace they were recorded at, not all within a few seconds.
+    """
+
+    def __init__(self):
+        self.now = None
+
+    def time(self):
+        return self.now if self.now is not None else time.time()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def synthetic_events(count, seed, span_end_ms=None):
+    """count events ending a minute before span_end_ms (default now)"""
+    from opencanary_synth import OpenCanarySynth
+
+    events = list(OpenCanarySynth(seed=seed, start_ms=0).events(count))
+    shift = (span_end_ms or int(time.time() * 1000)) - 60 * 1000 - (events[-1][0] if events else 0)
+    return [(ts + shift, event) for ts, event in events]
+
+
+def _timed(invoke, payloads):
+    latencies = []
+    for payload in payloads:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            invoke(payload)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+# ---- scenarios: each returns (events replayed, invocation latencies) ----
+
+def _analyzer_resources(queue):
+    import boto3
+
+    waf = boto3.client('wafv2', region_name=REGION)
+    ec2 = boto3.client('ec2', region_name=REGION)
+    dynamodb = boto3.client('dynamodb', region_name=REGION)
+    ip_set = waf.create_ip_set(Name='bench-blocked', Scope='REGIONAL', IPAddressVersion='IPV4', Addresses=[])['Summary']
+    vpc = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    group = ec2.create_security_group(GroupName='honeypot', Description='bench', VpcId=vpc)['GroupId']
+    ec2.authorize_security_group_ingress(GroupId=group, IpPermissions=[
+        {'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}
+        for port in (21, 22, 23, 80, 1433, 3306, 3389, 5900, 6379)
+    ])
+    for table, key in (('bench-rate-state', 'slot'), ('bench-blocklist', 'name')):
+        dynamodb.create_table(TableName=table, BillingMode='PAY_PER_REQUEST',
+                              AttributeDefinitions=[{'AttributeName': key, 'AttributeType': 'S'}],
+                              KeySchema=[{'AttributeName': key, 'KeyType': 'HASH'}])
+    env = {
+        'WAF_IP_SET_IDS': ip_set['Id'],
+        'WAF_IP_SET_NAMES': ip_set['Name'],
+        'BLOCKLIST_TABLE': 'bench-blocklist',
+        'RATE_STATE_TABLE': 'bench-rate-state',
+        'SECURITY_GROUP_ID': group,
+        'SNS_TOPIC_ARN': boto3.client('sns', region_name=REGION).create_topic(Name='bench-alerts')['TopicArn']
+    }
+    if queue:
+        env['REMEDIATION_QUEUE_URL'] = f"https://sqs.{REGION}.amazonaws.com/000000000000/bench-remediation"
+    os.environ.update(env)
+
+
+def _analyzer_payloads(events):
+    """(arrival time, awslogs event) per subscription delivery"""
+    from opencanary_synth import awslogs_event, chunks
+    return [(chunk[-1][0] / 1000, awslogs_event(chunk, first_id=n * EVENTS_PER_PAYLOAD))
+            for n, chunk in enumerate(chunks(events, EVENTS_PER_PAYLOAD))]
+
+
+class CollectingSQS:
+    """SQS stand-in: send_message_batch keeps the messages as Lambda SQS records"""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.records = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.counter.add('sqs:SendMessageBatch')
+        self.records += [{'messageId': str(uuid.uuid4()), 'body': entry['MessageBody'], 'eventSource': 'aws:sqs'}
+                         for entry in Entries]
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+
+def _analyzer(counter):
+    """A function invoking lambda_threat_analyzer at a payload's arrival time, and its queue"""
+    import lambda_threat_analyzer
+    import rate_detector
+
+    clock = rate_detector.time = ReplayClock()
+    sqs = CollectingSQS(counter)
+    if hasattr(lambda_threat_analyzer.remediation_queue, 'sqs'):
+        lambda_threat_analyzer.remediation_queue.sqs = sqs
+
+    def invoke(payload):
+        clock.now, event = payload
+        return lambda_threat_analyzer.handler(event, None)
+    return invoke, sqs
+
+
+def replay_analyzer(count, seed, counter, queue=True):
+    _analyzer_resources(queue)
+    payloads = _analyzer_payloads(synthetic_events(count, seed))
+    invoke, _ = _analyzer(counter)
+
+    counter.reset()
+    return count, _timed(invoke, payloads)
+
+
+def replay_analyzer_inline(count, seed, counter):
+    return replay_analyzer(count, seed, counter, queue=False)
+
+
+def replay_remediation_worker(count, seed, counter):
+    _analyzer_resources(queue=True)
+    payloads = _analyzer_payloads(synthetic_events(count, seed))
+    invoke, sqs = _analyzer(counter)
+    import lambda_remediation_worker
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for payload in payloads:
+            invoke(payload)
+
+    # Batches of up to 100 messages, as the event source mapping delivers them
+    batches = [{'Records': sqs.records[i:i + WORKER_BATCH_SIZE]}
+               for i in range(0, len(sqs.records), WORKER_BATCH_SIZE)]
+
+    counter.reset()
+    return count, _timed(lambda event: lambda_remediation_worker.handler(event, None), batches)
+
+
+def replay_s3_ingest(count, seed, counter):
+    import boto3
+    from opencanary_synth import chunks, export_object
+
+    s3 = boto3.client('s3', region_name=REGION)
+    s3.create_bucket(Bucket='bench-archive')
+    boto3.client('dynamodb', region_name=REGION).create_table(
+        TableName='bench-events', BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[{'AttributeName': 'event_id', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'event_id', 'KeyType': 'HASH'}])
+    os.environ['RESULTS_TABLE'] = 'bench-events'
+
+    events = []
+    for n, chunk in enumerate(chunks(synthetic_events(count, seed), EVENTS_PER_OBJECT)):
+        body = export_object(chunk)
+        key = f"exports/honeypot/{n:05d}.gz"
+        s3.put_object(Bucket='bench-archive', Key=key, Body=body)
+        events.append({'Records': [{'s3': {'bucket': {'name': 'bench-archive'}, 'object': {'key': key, 'size': len(body)}}}]})
+    import lambda_function
+
+    counter.reset()
+    return count, _timed(lambda event: lambda_function.lambda_handler(event, None), events)
+
+
+def replay_honeypot_export(count, seed, counter):
+    import boto3
+    from opencanary_synth import chunks, log_events
+
+    os.environ['BUCKET_NAME'] = 'bench-logs'
+    boto3.client('s3', region_name=REGION).create_bucket(Bucket='bench-logs')
+    logs = boto3.client('logs', region_name=REGION)
+    import lambda_honeypot_to_csv
+
+    logs.create_log_group(logGroupName=lambda_honeypot_to_csv.LOG_GROUP)
+    streams = [f"opencanary-{n}" for n in range(4)]
+    for stream in streams:
+        logs.create_log_stream(logGroupName=lambda_honeypot_to_csv.LOG_GROUP, logStreamName=stream)
+
+    # Every round's events land after the previous run's high-water mark
+    events = synthetic_events(count, seed, span_end_ms=int(time.time() * 1000) - 5 * 1000)
+    lambda_honeypot_to_csv.save_checkpoint({'timestamp': events[0][0] - 1, 'event_ids': {}})
+
+    latencies = []
+    counter.reset()
+    for chunk in chunks(events, EVENTS_PER_EXPORT_RUN):
+        calls = dict(counter.calls)
+        for n, stream in enumerate(streams):
+            for batch in chunks(chunk[n::len(streams)], 1000):
+                logs.put_log_events(logGroupName=lambda_honeypot_to_csv.LOG_GROUP, logStreamName=stream,
+                                    logEvents=log_events(batch))
+        # Only the handler's own calls count
+        counter.calls = calls
+        latencies += _timed(lambda _: lambda_honeypot_to_csv.lambda_handler(None, None), [None])
+    return count, latencies
+
+
+class UnloadingAthena:
+    """Athena stand-in: UNLOAD queries finish at once, writing their
+    partition's rows to moto S3 in parts with a data manifest"""
+
+    def __init__(self, rows_by_partition, counter, parts=4):
+        import boto3
+
+        self.s3 = boto3.client('s3', region_name=REGION)
+        self.exceptions = boto3.client('athena', region_name=REGION).exceptions
+        self.rows_by_partition = rows_by_partition
+        self.counter = counter
+        self.parts = parts
+        self.executions = {}
+
+    def start_query_execution(self, QueryString, **kwargs):
+        self.counter.add('athena:StartQueryExecution')
+        execution_id = f"bench-{len(self.executions):06d}"
+        target = QueryString.split("TO '", 1)[1].split("'", 1)[0]
+        bucket, _, prefix = target[len('s3://'):].partition('/')
+        partition = QueryString.split("= '", 1)[1].split("'", 1)[0] if "= '" in QueryString else None
+        rows = self.rows_by_partition.get(partition, [])
+
+        files = []
+        size = (len(rows) + self.parts - 1) // self.parts or 1
+        for n in range(0, len(rows), size):
+            key = f"{prefix}{execution_id}_{n // size:05d}"
+            self.s3.put_object(Bucket=bucket, Key=key, Body=''.join(rows[n:n + size]).encode('utf-8'))
+            files.append(f"s3://{bucket}/{key}")
+        manifest_key = f"athena-results/{execution_id}-manifest.csv"
+        self.s3.put_object(Bucket=bucket, Key=manifest_key, Body='\n'.join(files).encode('utf-8'))
+
+        self.executions[execution_id] = {
+            'QueryExecutionId': execution_id,
+            'Status': {'State': 'SUCCEEDED'},
+            'Statistics': {
+                'DataScannedInBytes': sum(len(row) for row in rows),
+                'TotalExecutionTimeInMillis': 1,
+                'DataManifestLocation': f"s3://{bucket}/{manifest_key}"
+            }
+        }
+        return {'QueryExecutionId': execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        self.counter.add('athena:GetQueryExecution')
+        return {'QueryExecution': self.executions[QueryExecutionId]}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        self.counter.add('athena:BatchGetQueryExecution')
+        return {'QueryExecutions': [self.executions[i] for i in QueryExecutionIds]}
+
+
+def replay_athena_unload(count, seed, counter):
+    import boto3
+
+    os.environ.update(PROJECT_NAME='bench', ENVIRONMENT='dev')
+    import lambda_athena_unload as unload
+
+    # No real query runs, so there is nothing to wait for between polls
+    unload.POLL_INITIAL_DELAY = 0
+
+    boto3.client('s3', region_name=REGION).create_bucket(Bucket=unload.TRAINING_BUCKET)
+    glue = boto3.client('glue', region_name=REGION)
+    glue.create_database(DatabaseInput={'Name': unload.ATHENA_DATABASE})
+    glue.create_table(DatabaseName=unload.ATHENA_DATABASE, TableInput={
+        'Name': unload.ATHENA_TABLE,
+        'PartitionKeys': [{'Name': unload.PARTITION_COLUMN, 'Type': 'string'}],
+        'StorageDescriptor': {'Columns': [{'Name': c, 'Type': 'string'} for c in unload.HEADER_LINE.strip().split(',')]}
+    })
+
+    days = [(datetime.utcnow() - timedelta(days=UNLOAD_PARTITIONS - n)).strftime('%Y-%m-%d') for n in range(UNLOAD_PARTITIONS)]
+    rows_by_partition = {day: [] for day in days}
+    for n, (_, event) in enumerate(synthetic_events(count, seed)):
+        logdata = event['logdata']
+        rows_by_partition[days[n * UNLOAD_PARTITIONS // count]].append(','.join(str(v) for v in (
+            event['utc_time'], event['src_host'], event['src_port'], event['dst_host'], event['dst_port'],
+            event['logtype'], event['node_id'], logdata.get('USERNAME', ''), logdata.get('PASSWORD', '')
+        )) + '\n')
+    unload.athena = UnloadingAthena(rows_by_partition, counter)
+
+    # A new day's partition appears before each run, as the daily schedule sees it
+    latencies = []
+    counter.reset()
+    for day in days:
+        calls = dict(counter.calls)
+        glue.create_partition(DatabaseName=unload.ATHENA_DATABASE, TableName=unload.ATHENA_TABLE,
+                              PartitionInput={'Values': [day], 'StorageDescriptor': {}})
+        counter.calls = calls
+        latencies += _timed(lambda _: unload.lambda_handler({}, None), [None])
+    return count, latencies
+
+
+def run_child(scenario, count, seed):
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print(json.dumps({'error': "moto is not installed (pip install 'moto[all]')"}))
+        return
+
+    os.environ.update(AWS_DEFAULT_REGION=REGION, AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench')
+    counter = CallCounter()
+    counter.install()
+    with mock_aws():
+        events, latencies = globals()[f"replay_{scenario.replace('-', '_')}"](count, seed, counter)
+    print(json.dumps({
+        'events': events,
+        'latencies': latencies,
+        'calls': counter.calls,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }))
+
+
+def summarize(run):
+    latencies = sorted(run['latencies']) or [0.0]
+    total = sum(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(round(0.99 * (len(latencies) - 1))))]
+    return {
+        'events_per_second': run['events'] / total if total else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': p99 * 1000,
+        'peak_mib': run['peak_kb'] / 1024,
+        'calls_per_event': sum(run['calls'].values()) / run['events'],
+        'invocations': len(latencies),
+        'calls': run['calls']
+    }
+
+
+def median_result(results):
+    """Per-metric median of several runs of one scenario"""
+    merged = {name: statistics.median(r[name] for r in results) for name in METRICS}
+    merged['invocations'] = results[0]['invocations']
+    merged['calls'] = results[0]['calls']
+    return merged
+
+
+def regressions(result, baseline, tolerance):
+    """Metrics worse than baseline by more than tolerance, as (name, base, now)"""
+    worse = []
+    for name, higher_is_better in METRICS.items():
+        base, now = baseline.get(name), result[name]
+        if base is None or base == 0:
+            continue
+        change = (base - now) / base if higher_is_better else (now - base) / base
+        if change > tolerance:
+            worse.append((name, base, now))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='record this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression per metric')
+    parser.add_argument('--child', nargs=3, metavar=('SCENARIO', 'EVENTS', 'SEED'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scenario, count, seed = args.child
+        run_child(scenario, int(count), int(seed))
+        return
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    machine = f"{platform.machine()} {platform.python_implementation()} {platform.python_version()}"
+    recorded = baselines.get('_machine')
+    if recorded and recorded != machine and not args.save_baseline:
+        print(f"Baseline was recorded on {recorded}, this is {machine}; timings may not compare")
+    compare = not args.save_baseline and baselines.get('_events') == args.events
+    if baselines and not args.save_baseline and not compare:
+        print(f"Baseline was recorded with --events {baselines.get('_events')}; not comparing")
+
+    print(f"{'scenario':<20} {'events':>7} {'calls':>6} {'events/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'peak RSS MiB':>13} {'calls/event':>12}")
+    results, failed = {}, []
+    for scenario in args.scenarios:
+        runs = []
+        for _ in range(args.repeat):
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', scenario, str(args.events), str(args.seed)],
+                capture_output=True, text=True
+            )
+            lines = child.stdout.strip().splitlines()
+            run = json.loads(lines[-1]) if child.returncode == 0 and lines else {}
+            if 'events' not in run:
+                error = run.get('error') or (child.stderr.strip().splitlines() or [child.returncode])[-1]
+                print(f"{scenario:<20} failed: {error}")
+                failed.append(scenario)
+                break
+            runs.append(summarize(run))
+        if len(runs) < args.repeat:
+            continue
+
+        result = results[scenario] = median_result(runs)
+        print(f"{scenario:<20} {args.events:>7} {result['invocations']:>6} {result['events_per_second']:>9.0f} "
+              f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['peak_mib']:>13.1f} "
+              f"{result['calls_per_event']:>12.3f}")
+        if compare and scenario in baselines:
+            for name, base, now in regressions(result, baselines[scenario], args.tolerance):
+                print(f"  REGRESSION {name}: {base:.3f} -> {now:.3f}")
+                failed.append(scenario)
+
+    if args.save_baseline:
+        if baselines.get('_events') != args.events:
+            # Results for another event count no longer compare
+            baselines = {}
+        baselines.update(results)
+        baselines['_machine'] = machine
+        baselines['_events'] = args.events
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Peak RSS and throughput of the S3 ingest stage against object size.
+
+Compares the old read-everything path (get_object().read(), decompress,
+splitlines) with lambda_function.process_object streaming the same .gz
+object. Each run is a fresh subprocess; objects come from a directory
+backed S3 stand-in and writes go to a DynamoDB stand-in that leaves a
+share of every batch unprocessed so the retry path is exercised.
+
+Usage: python benchmarks/bench_s3_ingest.py [--rows 100000 1000000 4000000]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+class LocalS3:
+    """get_object over files in a directory, returning a streaming body"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_object(self, Bucket, Key):
+        return {'Body': open(os.path.join(self.root, Bucket, Key), 'rb')}
+
+
+class FlakyDynamoDB:
+    """batch_write_item that drops a share of each request into UnprocessedItems"""
+
+    def __init__(self, unprocessed_rate=0.1, seed=3):
+        self.rng = random.Random(seed)
+        self.unprocessed_rate = unprocessed_rate
+        self.items = 0
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        unprocessed = {}
+        for table, requests in RequestItems.items():
+            kept = [r for r in requests if self.rng.random() < self.unprocessed_rate]
+            self.items += len(requests) - len(kept)
+            if kept:
+                unprocessed[table] = kept
+        return {'UnprocessedItems': unprocessed}
+
+
+def generate(path, rows):
+    rng = random.Random(7)
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        for i in range(rows):
+            f.write('2025-04-01T00:00:00.000Z ' + json.dumps({
+                'src_host': f"203.0.{rng.randrange(256)}.{rng.randrange(256)}",
+                'dst_port': rng.choice([21, 22, 23, 80, 443, 3306]),
+                'logtype': rng.choice([2000, 3000, 4000, 4002, 5001]),
+                'utc_time': f"2025-04-01 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}.000000",
+                'logdata': {'USERNAME': rng.choice(['root', 'admin', 'ubuntu'])}
+            }) + '\n')
+
+
+def buffered_ingest(s3, dynamodb, bucket, key):
+    """The handler's previous approach: the whole object in memory at once"""
+    from awslogs_decoder import iter_export_events
+    from lambda_function import batch_write_items, to_item
+
+    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    lines = gzip.decompress(body).decode('utf-8').splitlines()
+    items = [to_item(bucket, key, line_no, event, None) for line_no, event in iter_export_events(lines, key)]
+    batch_write_items(dynamodb, 'results', items)
+    return len(items)
+
+
+def run_child(mode, root):
+    # Clients are lazy, but botocore still wants a region to resolve
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    import lambda_function
+
+    # No sleeping between retries; the stand-in is not throttling
+    lambda_function.DYNAMODB_BACKOFF_BASE = 0
+    s3, dynamodb = LocalS3(root), FlakyDynamoDB()
+    start = time.perf_counter()
+    if mode == 'buffered':
+        rows = buffered_ingest(s3, dynamodb, 'bench', 'events.gz')
+    else:
+        rows = lambda_function.process_object(s3, dynamodb, 'bench', 'events.gz', 'results')
+    elapsed = time.perf_counter() - start
+    assert dynamodb.items == rows
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed} {peak_kb} {rows} {dynamodb.calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000, 4000000])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'ROOT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    print(f"{'mode':<10} {'rows':>10} {'gz MiB':>7} {'seconds':>9} {'rows/s':>9} {'peak RSS MiB':>13} {'ddb calls':>10}")
+    for rows in args.rows:
+        root = tempfile.mkdtemp(prefix='local-s3-')
+        try:
+            os.makedirs(os.path.join(root, 'bench'))
+            path = os.path.join(root, 'bench', 'events.gz')
+            generate(path, rows)
+            size = os.path.getsize(path) / 1024 / 1024
+            for mode in ('buffered', 'streaming'):
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--child', mode, root],
+                    capture_output=True, text=True
+                )
+                if child.returncode:
+                    # Usually the OOM killer: the object does not fit this machine
+                    print(f"{mode:<10} {rows:>10} {size:>7.1f} failed with exit status {child.returncode}")
+                    continue
+                out = child.stdout.split()
+                elapsed, peak_kb, written, calls = float(out[-4]), int(out[-3]), int(out[-2]), int(out[-1])
+                print(f"{mode:<10} {written:>10} {size:>7.1f} {elapsed:>9.2f} {written / elapsed:>9.0f} "
+                      f"{peak_kb / 1024:>13.1f} {calls:>10}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
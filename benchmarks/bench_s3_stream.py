@@ -0,0 +1,136 @@
+"""Peak RSS versus row count for the streaming gzip CSV sink.
+
+Each (mode, rows) pair runs in a fresh subprocess so ru_maxrss is not
+polluted by earlier runs. Objects go to a directory-backed S3 stand-in.
+
+Usage: python benchmarks/bench_s3_stream.py [--rows 10000 100000 1000000]
+"""
+import argparse
+import csv
+import gzip
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO, StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from s3_stream import write_csv_gz  # noqa: E402
+
+HEADER = ["utc_time", "src_host", "src_port", "dst_host", "dst_port", "logtype", "node_id", "username", "password"]
+
+
+class LocalS3:
+    """Just enough of the S3 client API, storing objects and parts on disk"""
+
+    def __init__(self, root):
+        self.root = root
+        self.calls = 0
+
+    def _path(self, bucket, key):
+        path = os.path.join(self.root, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls += 1
+        with open(self._path(Bucket, Key), 'wb') as f:
+            f.write(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.calls += 1
+        return {'UploadId': 'local'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls += 1
+        with open(self._path(Bucket, f"{Key}.part{PartNumber:05d}"), 'wb') as f:
+            f.write(Body)
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls += 1
+        with open(self._path(Bucket, Key), 'wb') as out:
+            for part in MultipartUpload['Parts']:
+                part_path = self._path(Bucket, f"{Key}.part{part['PartNumber']:05d}")
+                with open(part_path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(part_path)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls += 1
+
+
+def iter_rows(n):
+    rng = random.Random(7)
+    for i in range(n):
+        yield [
+            "2025-04-25 12:00:00.000000",
+            f"203.0.113.{rng.randrange(256)}",
+            rng.randrange(1024, 65535),
+            "10.0.1.25",
+            rng.choice([21, 22, 23, 80, 443, 3306]),
+            rng.choice([2000, 3000, 4000, 4002, 5001]),
+            "opencanary-1",
+            rng.choice(["root", "admin", "ubuntu"]),
+            f"pw{rng.randrange(10 ** 6)}"
+        ]
+
+
+def buffered_upload(s3, bucket, key, rows):
+    """The exporter's previous path: StringIO -> encode -> BytesIO -> put_object"""
+    csv_buffer = StringIO()
+    writer = csv.writer(csv_buffer)
+    writer.writerow(HEADER)
+    for row in rows:
+        writer.writerow(row)
+    gz_buffer = BytesIO()
+    with gzip.GzipFile(mode="w", fileobj=gz_buffer) as gz_file:
+        gz_file.write(csv_buffer.getvalue().encode("utf-8"))
+    s3.put_object(Bucket=bucket, Key=key, Body=gz_buffer.getvalue())
+
+
+def run_child(mode, rows):
+    root = tempfile.mkdtemp(prefix='local-s3-')
+    try:
+        s3 = LocalS3(root)
+        start = time.perf_counter()
+        if mode == 'buffered':
+            buffered_upload(s3, 'bench', 'out.csv.gz', iter_rows(rows))
+        else:
+            write_csv_gz(s3, 'bench', 'out.csv.gz', HEADER, iter_rows(rows))
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(os.path.join(root, 'bench', 'out.csv.gz'))
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"{elapsed} {peak_kb} {size} {s3.calls}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]))
+        return
+
+    print(f"{'mode':<10} {'rows':>10} {'seconds':>9} {'peak RSS MiB':>13} {'object MiB':>11} {'S3 calls':>9}")
+    for rows in args.rows:
+        for mode in ('buffered', 'streaming'):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', mode, str(rows)],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            elapsed, peak_kb, size, calls = float(out[0]), int(out[1]), int(out[2]), int(out[3])
+            print(f"{mode:<10} {rows:>10} {elapsed:>9.2f} {peak_kb / 1024:>13.1f} {size / 1024 / 1024:>11.2f} {calls:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Fit time, peak RSS and ONNX conversion time of the training model against row count.
+
+Each (rows, n_jobs) pair runs in a fresh subprocess so ru_maxrss is not
+polluted by earlier runs. Features come from build_features over
+synthetic honeypot events. The dst_port == 21 label is separable with a
+single split, so a fraction of labels is flipped (--label-noise) to make
+the trees grow to a depth closer to a real labelling.
+
+Usage: python benchmarks/bench_training_fit.py [--rows 100000 500000 2000000] [--n-jobs 1 -1]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'Docker', 'Sagemaker'))
+
+
+def synthetic_events(rows, seed=5):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    hosts = np.array([f"203.0.{rng.integers(256)}.{rng.integers(256)}" for _ in range(5000)])
+    start = np.datetime64('2025-04-01T00:00:00', 'ms')
+    return pd.DataFrame({
+        'utc_time': start + np.sort(rng.integers(0, 86_400_000, rows)).astype('timedelta64[ms]'),
+        'src_host': pd.Categorical(hosts[rng.zipf(1.3, rows) % len(hosts)]),
+        'dst_port': rng.choice([21, 22, 23, 80, 443, 3306], rows).astype(np.int32),
+        'logtype': pd.Categorical(rng.choice(['2000', '3000', '4000', '4002', '5001'], rows)),
+        'username': pd.Categorical(rng.choice(['root', 'admin', 'ubuntu', 'pi', 'oracle'], rows))
+    })
+
+
+def run_child(rows, n_jobs, trees, label_noise, max_depth, min_samples_leaf):
+    import numpy as np
+    from features import build_features, feature_matrix
+    from train import export_onnx, label_events, make_model
+
+    features = build_features(synthetic_events(rows))
+    X = feature_matrix(features)
+    y = label_events(features).copy()
+    rng = np.random.default_rng(11)
+    flip = rng.random(len(y)) < label_noise
+    y[flip] = 1 - y[flip]
+    del features
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    model = make_model(trees, n_jobs, max_depth, min_samples_leaf)
+    start = time.perf_counter()
+    model.fit(X, y)
+    fit_seconds = time.perf_counter() - start
+    fit_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.onnx')
+        start = time.perf_counter()
+        export_onnx(model, path)
+        onnx_seconds = time.perf_counter() - start
+        onnx_bytes = os.path.getsize(path)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"{fit_seconds} {onnx_seconds} {base_kb} {fit_kb} {peak_kb} {onnx_bytes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 500000, 2000000])
+    parser.add_argument('--n-jobs', type=int, nargs='+', default=[1, -1])
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--label-noise', type=float, default=0.05)
+    parser.add_argument('--max-depth', type=int, default=0, help='0 grows trees until leaves are pure')
+    parser.add_argument('--min-samples-leaf', type=int, default=1)
+    parser.add_argument('--child', nargs=6, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        rows, n_jobs, trees, noise, max_depth, min_samples_leaf = args.child
+        run_child(int(rows), int(n_jobs), int(trees), float(noise), int(max_depth), int(min_samples_leaf))
+        return
+
+    print(f"cores: {os.cpu_count()}, trees: {args.trees}, label noise: {args.label_noise}, "
+          f"max_depth: {args.max_depth}, min_samples_leaf: {args.min_samples_leaf}")
+    print(f"{'rows':>10} {'n_jobs':>6} {'fit s':>8} {'onnx s':>8} {'data MiB':>9} {'fit peak MiB':>13} {'peak MiB':>9} {'onnx MiB':>9}")
+    for rows in args.rows:
+        for n_jobs in args.n_jobs:
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', str(rows), str(n_jobs), str(args.trees),
+                 str(args.label_noise), str(args.max_depth), str(args.min_samples_leaf)],
+                capture_output=True, text=True
+            )
+            if child.returncode:
+                # Usually the OOM killer: the row count does not fit this machine
+                print(f"{rows:>10} {n_jobs:>6} failed with exit status {child.returncode}")
+                continue
+            out = child.stdout.split()
+            fit_s, onnx_s = float(out[0]), float(out[1])
+            base_kb, fit_kb, peak_kb, onnx_bytes = int(out[2]), int(out[3]), int(out[4]), int(out[5])
+            print(f"{rows:>10} {n_jobs:>6} {fit_s:>8.2f} {onnx_s:>8.2f} {base_kb / 1024:>9.1f} "
+                  f"{fit_kb / 1024:>13.1f} {peak_kb / 1024:>9.1f} {onnx_bytes / 1024 / 1024:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Load time and peak RSS of the training data loader against the old read_csv + concat path.
+
+Generates synthetic honeypot exports (or uses --data-dir) and loads them
+in a fresh subprocess per loader so ru_maxrss is comparable.
+
+Usage: python benchmarks/bench_training_loader.py [--rows 2000000] [--files 24] [--format csv.gz]
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'Docker', 'Sagemaker'))
+
+HEADER = ["utc_time", "src_host", "src_port", "dst_host", "dst_port", "logtype", "node_id", "username", "password"]
+
+
+def generate(data_dir, rows, files, fmt):
+    import pandas as pd
+
+    rng = random.Random(3)
+    hosts = [f"203.0.{rng.randrange(256)}.{rng.randrange(256)}" for _ in range(2000)]
+    per_file = rows // files
+    for n in range(files):
+        frame = pd.DataFrame({
+            "utc_time": [f"2025-04-{1 + n % 28:02d} {i % 24:02d}:{i % 60:02d}:00.000000" for i in range(per_file)],
+            "src_host": [rng.choice(hosts) for _ in range(per_file)],
+            "src_port": [rng.randrange(1024, 65535) for _ in range(per_file)],
+            "dst_host": "10.0.1.25",
+            "dst_port": [rng.choice([21, 22, 23, 80, 443, 3306]) for _ in range(per_file)],
+            "logtype": [rng.choice([2000, 3000, 4000, 4002, 5001]) for _ in range(per_file)],
+            "node_id": "opencanary-1",
+            "username": [rng.choice(["root", "admin", "ubuntu"]) for _ in range(per_file)],
+            "password": [f"pw{rng.randrange(10 ** 6)}" for _ in range(per_file)]
+        }, columns=HEADER)
+        path = os.path.join(data_dir, f"part-{n:04d}.{fmt}")
+        if fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+
+
+def old_loader(paths):
+    import pandas as pd
+    return pd.concat([pd.read_csv(p) for p in paths], ignore_index=True)
+
+
+def new_loader(paths):
+    from data_loader import load_training_frame
+    return load_training_frame(paths)
+
+
+def run_child(loader, data_dir):
+    import contextlib
+    import io
+
+    paths = sorted(os.path.join(data_dir, f) for f in os.listdir(data_dir))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        frame = (old_loader if loader == 'read_csv' else new_loader)(paths)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed} {peak_kb} {len(frame)} {frame.memory_usage(deep=True).sum()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--files', type=int, default=24)
+    parser.add_argument('--format', choices=['csv', 'csv.gz', 'parquet'], default='csv.gz')
+    parser.add_argument('--data-dir', help='benchmark existing files instead of generating them')
+    parser.add_argument('--child', nargs=2, metavar=('LOADER', 'DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='train-data-')
+    try:
+        if not args.data_dir:
+            generate(data_dir, args.rows, args.files, args.format)
+
+        loaders = ['new'] if args.format == 'parquet' else ['read_csv', 'new']
+        print(f"{'loader':<10} {'rows':>10} {'seconds':>9} {'peak RSS MiB':>13} {'frame MiB':>10}")
+        for loader in loaders:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', loader, data_dir],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            elapsed, peak_kb, rows, frame_bytes = float(out[0]), int(out[1]), int(out[2]), int(out[3])
+            print(f"{loader:<10} {rows:>10} {elapsed:>9.2f} {peak_kb / 1024:>13.1f} {frame_bytes / 1024 / 1024:>10.1f}")
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Synthetic OpenCanary traffic, packaged the way AWS hands it to our handlers.
+
+Events follow the honeypot's real shape: most sources are seen once or
+twice, a few dominate (Zipf over a source pool, part of it clustered in
+a handful of /24s like a botnet), and attackers arrive in bursts: port
+scans across many ports, login brute force against one service, and
+one-off probes. The mix of the three is configurable.
+
+The same events can be written as CloudWatch Logs subscription payloads
+(lambda_threat_analyzer), CloudWatch export objects (lambda_function)
+or PutLogEvents batches (lambda_honeypot_to_csv).
+
+Usage: python benchmarks/opencanary_synth.py --events 100000 --out /tmp/synth [--mix scan=0.2,brute=0.5,probe=0.3]
+"""
+import argparse
+import base64
+import bisect
+import gzip
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+# OpenCanary logtype -> destination port of the service that logs it
+SSH_NEW_CONNECTION = 4000
+SSH_REMOTE_VERSION_SENT = 4001
+SSH_LOGIN_ATTEMPT = 4002
+FTP_LOGIN_ATTEMPT = 2000
+HTTP_GET = 3000
+HTTP_POST_LOGIN_ATTEMPT = 3001
+PORT_SYN = 5001
+PORT_NMAPOS = 5002
+TELNET_LOGIN_ATTEMPT = 6001
+MYSQL_LOGIN_ATTEMPT = 8001
+MSSQL_LOGIN_SQLAUTH = 9001
+VNC = 12001
+RDP = 14001
+REDIS_COMMAND = 17001
+
+SERVICE_PORTS = {
+    SSH_NEW_CONNECTION: 22,
+    SSH_REMOTE_VERSION_SENT: 22,
+    SSH_LOGIN_ATTEMPT: 22,
+    FTP_LOGIN_ATTEMPT: 21,
+    HTTP_GET: 80,
+    HTTP_POST_LOGIN_ATTEMPT: 80,
+    TELNET_LOGIN_ATTEMPT: 23,
+    MYSQL_LOGIN_ATTEMPT: 3306,
+    MSSQL_LOGIN_SQLAUTH: 1433,
+    VNC: 5900,
+    RDP: 3389,
+    REDIS_COMMAND: 6379
+}
+
+# Services brute-forced, weighted roughly as the lab's honeypot sees them
+BRUTE_FORCE_LOGTYPES = [(SSH_LOGIN_ATTEMPT, 60), (TELNET_LOGIN_ATTEMPT, 15), (FTP_LOGIN_ATTEMPT, 10),
+                        (MYSQL_LOGIN_ATTEMPT, 6), (HTTP_POST_LOGIN_ATTEMPT, 5), (MSSQL_LOGIN_SQLAUTH, 4)]
+PROBE_LOGTYPES = [(HTTP_GET, 40), (SSH_REMOTE_VERSION_SENT, 20), (SSH_NEW_CONNECTION, 15), (PORT_SYN, 10),
+                  (REDIS_COMMAND, 5), (VNC, 5), (RDP, 5)]
+
+# Ports nmap's top-ports scan tries first
+SCAN_PORTS = [21, 22, 23, 25, 53, 80, 110, 111, 135, 139, 143, 443, 445, 993, 995, 1433, 1723, 3306, 3389,
+              5432, 5900, 6379, 8080, 8443, 9200, 27017]
+
+USERNAMES = ['root', 'admin', 'ubuntu', 'user', 'test', 'oracle', 'pi', 'postgres', 'ftpuser', 'guest', 'git']
+PASSWORDS = ['123456', 'password', 'admin', 'root', '12345678', 'qwerty', 'toor', 'raspberry', '1234',
+             'admin123', 'changeme', 'P@ssw0rd', 'letmein', 'default']
+USER_AGENTS = ['Mozilla/5.0 zgrab/0.x', 'curl/7.68.0', 'python-requests/2.31.0', 'Go-http-client/1.1',
+               'Mozilla/5.0 (compatible; CensysInspect/1.1)']
+PATHS = ['/', '/wp-login.php', '/.env', '/admin', '/phpmyadmin/', '/cgi-bin/luci', '/actuator/health']
+
+DEFAULT_MIX = {'scan': 0.2, 'brute': 0.5, 'probe': 0.3}
+
+OPENCANARY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def parse_mix(value):
+    """'scan=0.2,brute=0.5,probe=0.3' -> {'scan': 0.2, ...}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown behaviour {name!r}; expected one of {sorted(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class OpenCanarySynth:
+    """Deterministic generator of time-ordered OpenCanary events.
+
+    Attacks start as a Poisson process at attacks_per_second and overlap in
+    time; inside one, events come as close together as nmap or hydra sends
+    them.
+    """
+
+    def __init__(self, seed=1, sources=2000, skew=1.1, clustered=0.3, mix=None,
+                 attacks_per_second=2.0, start_ms=None, node_id='opencanary-1', dst_host='10.0.1.25'):
+        self.rng = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.attacks_per_second = attacks_per_second
+        self.start_ms = start_ms if start_ms is not None else int(time.time() * 1000) - 3600 * 1000
+        self.node_id = node_id
+        self.dst_host = dst_host
+        self.sources = self._source_pool(sources, clustered)
+        # Zipf weights by rank, as a cumulative table for bisect
+        self.cumulative = list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, sources + 1)))
+        self.behaviours = list(self.mix)
+        self.behaviour_weights = [self.mix[name] for name in self.behaviours]
+
+    def _public_ip(self):
+        while True:
+            first = self.rng.randint(1, 223)
+            if first not in (10, 100, 127, 169, 172, 192):
+                return first, self.rng.randrange(256), self.rng.randrange(256), self.rng.randint(1, 254)
+
+    def _source_pool(self, size, clustered):
+        """Distinct public IPv4 sources, a share of them packed into a few /24s"""
+        blocks = [self._public_ip()[:3] for _ in range(max(1, size // 200))]
+        pool, seen = [], set()
+        while len(pool) < size:
+            if self.rng.random() < clustered:
+                ip = (*self.rng.choice(blocks), self.rng.randint(1, 254))
+            else:
+                ip = self._public_ip()
+            if ip not in seen:
+                seen.add(ip)
+                pool.append('.'.join(map(str, ip)))
+        self.rng.shuffle(pool)
+        return pool
+
+    def _source(self):
+        i = bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return self.sources[min(i, len(self.sources) - 1)]
+
+    def _event(self, ts, src_host, logtype, dst_port, logdata):
+        stamp = datetime.utcfromtimestamp(ts / 1000).strftime(OPENCANARY_TIME_FORMAT)
+        return ts, {
+            'dst_host': self.dst_host,
+            'dst_port': dst_port,
+            'local_time': stamp,
+            'local_time_adjusted': stamp,
+            'logdata': logdata,
+            'logtype': logtype,
+            'node_id': self.node_id,
+            'src_host': src_host,
+            'src_port': self.rng.randint(1024, 65535),
+            'utc_time': stamp
+        }
+
+    def _weighted(self, choices):
+        return self.rng.choices([c for c, _ in choices], weights=[w for _, w in choices])[0]
+
+    def _scan(self, ts):
+        """nmap -sS: one source walks many ports a few ms apart, sometimes with OS detection"""
+        src_host = self._source()
+        ports = SCAN_PORTS[:] if self.rng.random() < 0.6 else self.rng.sample(range(1, 65536), self.rng.randint(20, 200))
+        self.rng.shuffle(ports)
+        for port in ports:
+            ts += self.rng.randint(1, 20)
+            yield self._event(ts, src_host, PORT_SYN, port, {
+                'ID': self.rng.randrange(65536), 'IN': 'eth0', 'LEN': 44, 'PROTO': 'TCP', 'SYN': '', 'TTL': 64
+            })
+        if self.rng.random() < 0.3:
+            yield self._event(ts + 1, src_host, PORT_NMAPOS, self.rng.choice(ports), {'PROTO': 'TCP'})
+
+    def _brute(self, ts):
+        """hydra: one source, one service, a run of credential guesses"""
+        src_host = self._source()
+        logtype = self._weighted(BRUTE_FORCE_LOGTYPES)
+        port = SERVICE_PORTS[logtype]
+        if logtype == SSH_LOGIN_ATTEMPT:
+            yield self._event(ts, src_host, SSH_NEW_CONNECTION, port, {'SESSION': self.rng.randrange(100000)})
+        for _ in range(int(self.rng.paretovariate(1.2) * 10)):
+            ts += self.rng.randint(50, 2000)
+            logdata = {'USERNAME': self.rng.choice(USERNAMES), 'PASSWORD': self.rng.choice(PASSWORDS)}
+            if logtype == SSH_LOGIN_ATTEMPT:
+                logdata.update(LOCALVERSION='SSH-2.0-OpenSSH_5.1p1 Debian-4', REMOTEVERSION='SSH-2.0-libssh2_1.9.0')
+            yield self._event(ts, src_host, logtype, port, logdata)
+
+    def _probe(self, ts):
+        """A single connection: banner grab, crawler hit or stray SYN"""
+        src_host = self._source()
+        logtype = self._weighted(PROBE_LOGTYPES)
+        if logtype == HTTP_GET:
+            logdata = {'HOSTNAME': self.dst_host, 'PATH': self.rng.choice(PATHS), 'USERAGENT': self.rng.choice(USER_AGENTS)}
+        elif logtype == PORT_SYN:
+            logdata = {'ID': self.rng.randrange(65536), 'PROTO': 'TCP', 'SYN': ''}
+        else:
+            logdata = {'SESSION': self.rng.randrange(100000)}
+        port = SERVICE_PORTS.get(logtype) or self.rng.choice(SCAN_PORTS)
+        yield self._event(ts, src_host, logtype, port, logdata)
+
+    def events(self, count):
+        """Yield count (timestamp_ms, event) pairs in time order"""
+        # Next event of every attack in progress, merged by timestamp
+        active = []
+        next_start = self.start_ms
+        for produced in range(count):
+            while not active or next_start <= active[0][0]:
+                behaviour = self.rng.choices(self.behaviours, weights=self.behaviour_weights)[0]
+                attack = getattr(self, f"_{behaviour}")(next_start)
+                first = next(attack, None)
+                if first is not None:
+                    heapq.heappush(active, (first[0], next_start, id(attack), first[1], attack))
+                next_start += int(self.rng.expovariate(self.attacks_per_second) * 1000) + 1
+            ts, started, key, event, attack = heapq.heappop(active)
+            yield ts, event
+            following = next(attack, None)
+            if following is not None:
+                heapq.heappush(active, (following[0], started, key, following[1], attack))
+
+
+def chunks(events, size):
+    events = iter(events)
+    while True:
+        chunk = list(itertools.islice(events, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def awslogs_event(events, log_group='/darktracer/honeypot/opencanary', log_stream='opencanary', first_id=0):
+    """A CloudWatch Logs subscription invocation event for a list of (timestamp, event)"""
+    envelope = {
+        'messageType': 'DATA_MESSAGE',
+        'owner': '123456789012',
+        'logGroup': log_group,
+        'logStream': log_stream,
+        'subscriptionFilters': ['honeypot-to-analyzer'],
+        'logEvents': [
+            {'id': str(first_id + n), 'timestamp': ts, 'message': json.dumps(event, separators=(',', ':'))}
+            for n, (ts, event) in enumerate(events)
+        ]
+    }
+    data = base64.b64encode(gzip.compress(json.dumps(envelope).encode('utf-8'))).decode('ascii')
+    return {'awslogs': {'data': data}}
+
+
+def export_object(events):
+    """gzip'd CloudWatch Logs export lines ('<ISO timestamp> <message>'), as lambda_function reads them"""
+    lines = []
+    for ts, event in events:
+        stamp = datetime.utcfromtimestamp(ts / 1000).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        lines.append(f"{stamp} {json.dumps(event, separators=(',', ':'))}\n")
+    return gzip.compress(''.join(lines).encode('utf-8'), compresslevel=6)
+
+
+def log_events(events):
+    """PutLogEvents entries for a list of (timestamp, event)"""
+    return [{'timestamp': ts, 'message': json.dumps(event, separators=(',', ':'))} for ts, event in events]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--out', required=True, help='directory for the payloads and objects')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sources', type=int, default=2000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of the source distribution')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument('--rate', type=float, default=2.0, help='mean attacks started per second')
+    parser.add_argument('--per-payload', type=int, default=500, help='log events per awslogs payload')
+    parser.add_argument('--per-object', type=int, default=50000, help='lines per export object')
+    args = parser.parse_args()
+
+    synth = OpenCanarySynth(seed=args.seed, sources=args.sources, skew=args.skew, mix=args.mix,
+                            attacks_per_second=args.rate)
+    events = list(synth.events(args.events))
+
+    for kind in ('awslogs', 'export'):
+        os.makedirs(os.path.join(args.out, kind), exist_ok=True)
+    for n, chunk in enumerate(chunks(events, args.per_payload)):
+        with open(os.path.join(args.out, 'awslogs', f"payload-{n:05d}.json"), 'w') as f:
+            json.dump(awslogs_event(chunk, first_id=n * args.per_payload), f)
+    for n, chunk in enumerate(chunks(events, args.per_object)):
+        with open(os.path.join(args.out, 'export', f"events-{n:05d}.gz"), 'wb') as f:
+            f.write(export_object(chunk))
+
+    logtypes = {}
+    for _, event in events:
+        logtypes[event['logtype']] = logtypes.get(event['logtype'], 0) + 1
+    sources = {event['src_host'] for _, event in events}
+    span = (events[-1][0] - events[0][0]) / 1000 if events else 0
+    print(f"{len(events)} events from {len(sources)} sources over {span:.0f} s written to {args.out}")
+    print('logtypes: ' + ', '.join(f"{t}={n}" for t, n in sorted(logtypes.items(), key=lambda x: -x[1])))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,143 @@
-import boto3, json, os
+import hashlib, json, os, re, time
+from collections import OrderedDict
+from aws_clients import lazy
+from botocore.exceptions import ClientError
+from log_index import build_context, build_index, load_index, save_index
+from metrics import Metrics
 
-# Initialize clients
-s3 = boto3.client("s3")
-bedrock = boto3.client("bedrock-runtime")
+# Clients are built on first use; dynamodb only when ANSWER_CACHE_TABLE is set
+s3 = lazy("s3")
+bedrock = lazy("bedrock-runtime")
+dynamodb = lazy("dynamodb")
 
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics("Chatbot")
+
+# Upper bound on log context per prompt, in estimated tokens
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+MAX_TOKENS_TO_SAMPLE = 400
+
+# Seconds a warm container trusts its log ETag before a conditional GET
+LOG_REVALIDATE_SECONDS = int(os.environ.get("LOG_REVALIDATE_SECONDS", "10"))
+
+# Answers are reused for the same normalized question against the same log ETag
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Optional DynamoDB table shared by every container (hash key cache_key, TTL on expires_at)
+ANSWER_CACHE_TABLE = os.environ.get("ANSWER_CACHE_TABLE")
+
+# Warm-container copy of the log index and the ETag it was built from
+_log_cache = {
+    "key": None,
+    "etag": None,
+    "index": None,
+    "checked_at": 0.0
+}
+
+# cache key -> (expires_at, answer), least recently used first
+_answer_cache = OrderedDict()
+
+
+def get_index(bucket, key, now=None):
+    """The log's index, revalidated against the log's ETag with a conditional GET.
+
+    An unchanged log answers 304 with no body, so a warm container pays one
+    small request at most every LOG_REVALIDATE_SECONDS. A changed log reuses
+    the stored index when the indexer has already caught up, and otherwise
+    the index is rebuilt from the body of that same GET.
+    """
+    now = now or time.time()
+    cached = _log_cache["index"] is not None and _log_cache["key"] == key
+    if cached and now - _log_cache["checked_at"] < LOG_REVALIDATE_SECONDS:
+        return _log_cache["index"], _log_cache["etag"]
+
+    try:
+        kwargs = {"IfNoneMatch": _log_cache["etag"]} if cached else {}
+        response = s3.get_object(Bucket=bucket, Key=key, **kwargs)
+    except ClientError as e:
+        if cached and e.response["Error"]["Code"] in ("304", "NotModified"):
+            _log_cache["checked_at"] = now
+            return _log_cache["index"], _log_cache["etag"]
+        raise
+
+    etag = response["ETag"]
+    index = load_index(s3, bucket, key)
+    if index is not None and index["source"]["etag"] == etag:
+        response["Body"].close()
+    else:
+        print(f"Index for s3://{bucket}/{key} missing or stale; rebuilding")
+        index = build_index(s3, bucket, key, response=response)
+        save_index(s3, bucket, index)
+
+    _log_cache.update(key=key, etag=etag, index=index, checked_at=now)
+    return index, etag
+
+
+def normalize_question(question):
+    """Case, whitespace and trailing punctuation do not change the answer"""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+def answer_cache_key(question, etag):
+    raw = "|".join([etag, os.environ.get("MODEL_ID", ""), str(CONTEXT_TOKEN_BUDGET), normalize_question(question)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_answer(cache_key, now=None):
+    now = now or time.time()
+    entry = _answer_cache.get(cache_key)
+    if entry is not None:
+        if entry[0] > now:
+            _answer_cache.move_to_end(cache_key)
+            return entry[1]
+        del _answer_cache[cache_key]
+
+    if ANSWER_CACHE_TABLE:
+        try:
+            item = dynamodb.get_item(TableName=ANSWER_CACHE_TABLE, Key={"cache_key": {"S": cache_key}}).get("Item")
+        except Exception as e:
+            print(f"Error reading shared answer cache: {str(e)}")
+            item = None
+        # DynamoDB TTL deletes lazily, so check expiry here as well
+        if item and float(item["expires_at"]["N"]) > now:
+            remember_answer(cache_key, item["answer"]["S"], float(item["expires_at"]["N"]), shared=False)
+            return item["answer"]["S"]
+    return None
+
+
+def remember_answer(cache_key, answer, expires_at, shared=True):
+    _answer_cache[cache_key] = (expires_at, answer)
+    _answer_cache.move_to_end(cache_key)
+    while len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
+    if shared and ANSWER_CACHE_TABLE:
+        try:
+            dynamodb.put_item(TableName=ANSWER_CACHE_TABLE, Item={
+                "cache_key": {"S": cache_key},
+                "answer": {"S": answer},
+                "expires_at": {"N": str(int(expires_at))}
+            })
+        except Exception as e:
+            print(f"Error writing shared answer cache: {str(e)}")
+
+
+def complete(prompt):
+    """One completion from MODEL_ID"""
+    response = bedrock.invoke_model(
+        modelId=os.environ["MODEL_ID"],
+        body=json.dumps({
+            "prompt": prompt,
+            "max_tokens_to_sample": MAX_TOKENS_TO_SAMPLE,
+            "temperature": 0.5
+        }),
+        contentType="application/json",
+        accept="application/json"
+    )
+    return json.loads(response["body"].read()).get("completion", "")
+
+
+@metrics.handler
 def lambda_handler(event, context):
     try:
         # Accept user question from event (JSON or query)
@@ -11,34 +145,37 @@ def lambda_handler(event, context):
         if not question:
             return {"statusCode": 400, "body": json.dumps({"error": "Missing 'question' in request"})}
 
-        # Pull logs from S3
         bucket = os.environ["CLEAN_LOG_BUCKET"]
         s3_key = os.environ["LOG_KEY"]  # You can make this dynamic later
+        with metrics.stage("Index"):
+            index, etag = get_index(bucket, s3_key)
+
+        # Same question against an unchanged log: no model call at all
+        cache_key = answer_cache_key(question, etag)
+        summary = get_cached_answer(cache_key)
+        if summary is not None:
+            metrics.add("CacheHits")
+            return {"statusCode": 200, "body": json.dumps({"answer": summary, "cached": True})}
 
-        log_data = s3.get_object(Bucket=bucket, Key=s3_key)['Body'].read().decode("utf-8")
+        # Only the slices of the log relevant to the question, under the token budget
+        with metrics.stage("Context"):
+            log_context, context_tokens = build_context(index, question, CONTEXT_TOKEN_BUDGET)
+        metrics.add("ContextTokens", context_tokens)
 
         # Prompt for Claude-style models
-        prompt = f"\n\nHuman: Given the following logs:\n{log_data}\n\n{question}\n\nAssistant:"
-
-        # Call Bedrock (e.g., Claude v2)
-        response = bedrock.invoke_model(
-            modelId=os.environ["MODEL_ID"],
-            body=json.dumps({
-                "prompt": prompt,
-                "max_tokens_to_sample": 400,
-                "temperature": 0.5
-            }),
-            contentType="application/json",
-            accept="application/json"
-        )
-
-        result = json.loads(response["body"].read())
-        summary = result.get("completion", "[No output from model]")
+        prompt = (f"\n\nHuman: Given the following summary of honeypot logs:\n{log_context}\n\n"
+                  f"{question}\n\nAssistant:")
+
+        with metrics.stage("Model"):
+            summary = complete(prompt)
+        if summary:
+            remember_answer(cache_key, summary, time.time() + ANSWER_CACHE_TTL)
 
         return {
             "statusCode": 200,
-            "body": json.dumps({"answer": summary})
+            "body": json.dumps({"answer": summary or "[No output from model]", "cached": False})
         }
 
     except Exception as e:
+        metrics.add("Errors")
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
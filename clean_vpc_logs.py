@@ -1,61 +1,336 @@
+import argparse
+import json
+import os
+import re
 import sys
-from datetime import datetime
-from awsglue.transforms import *
-from awsglue.utils import getResolvedOptions
-from pyspark.context import SparkContext
-from awsglue.context import GlueContext
-from awsglue.job import Job
+from datetime import datetime, timedelta
 
-# Initialize Glue contexts
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-job = Job(glueContext)
-
-print("Starting Glue job...")
+from pyspark.sql import SparkSession, functions as F
+from pyspark.sql.utils import AnalysisException
+from pyspark.sql.types import StructType, StructField, StringType
 
+# Glue libraries are only present inside the Glue runtime; without them the
+# job runs on a local SparkSession (see --local below)
 try:
-    # Optional: get the current year dynamically
-    current_year = datetime.now().year
-    # You can hardcode 2025 if needed
-    # current_year = 2025
-
-    # Path adjusted to match deep folders: /year/month/day/hour/file
-    path = f"s3://darktracer-logs-dev/honeypot/{current_year}/*/*/*/honeypot-opencanary-logs.csv.gz"
-
-    print(f"Reading from path: {path}")
-
-    # Read CSV files
-    df = spark.read \
-        .option("header", "true") \
-        .option("compression", "gzip") \
-        .option("ignoreMissingFiles", "true") \
-        .csv(path)
-
-    # Check if DataFrame is empty
-    if df.rdd.isEmpty():
-        print("No data found at the specified path.")
-        job.commit()
-        sys.exit(0)
+    from awsglue.utils import getResolvedOptions
+    from awsglue.context import GlueContext
+    from awsglue.job import Job
+    from pyspark.context import SparkContext
+except ImportError:
+    GlueContext = None
+
+# Columns written by lambda_honeypot_to_csv, read as strings and cast below
+RAW_SCHEMA = StructType([
+    StructField("utc_time", StringType()),
+    StructField("src_host", StringType()),
+    StructField("src_port", StringType()),
+    StructField("dst_host", StringType()),
+    StructField("dst_port", StringType()),
+    StructField("logtype", StringType()),
+    StructField("node_id", StringType()),
+    StructField("username", StringType()),
+    StructField("password", StringType())
+])
+
+# Fields that identify one OpenCanary event for deduplication
+EVENT_IDENTITY = ["utc_time", "src_host", "src_port", "dst_host", "dst_port", "logtype", "node_id"]
+
+UTC_TIME_FORMAT = "yyyy-MM-dd HH:mm:ss.SSSSSS"
+IPV4_PATTERN = r"^(\d{1,3}\.){3}\d{1,3}$"
+
+# honeypot/YYYY/MM/DD/HH/<name>.csv.gz, named after the export's high-water
+# mark; with the exporter's late-arrival re-read this gives the days an
+# export can hold, as in lambda_compact_honeypot
+SOURCE_KEY_PATTERN = re.compile(r"/(\d{4})/(\d{2})/(\d{2})/(\d{2})/[^/]+\.csv\.gz$")
+LATE_ARRIVAL = timedelta(seconds=120)
+
+
+def resolve_options():
+    """Job arguments from Glue, or from the command line in local mode"""
+    if GlueContext is not None and "--local" not in sys.argv:
+        args = getResolvedOptions(sys.argv, ["project_name", "environment"])
+        project, env = args["project_name"], args["environment"]
+        return argparse.Namespace(
+            local=False,
+            input_path=f"s3://{project}-logs-{env}/honeypot/",
+            output_path=f"s3://{project}-cleaned-logs-{env}/honeypot_logs/",
+            manifest_path=f"s3://{project}-cleaned-logs-{env}/manifests/clean_vpc_logs.json",
+            compacted_path=f"s3://{project}-logs-{env}/honeypot_compacted/"
+        )
+
+    parser = argparse.ArgumentParser(description="Clean new honeypot CSV exports into partitioned Parquet")
+    parser.add_argument("--local", action="store_true", help="run on a local SparkSession")
+    parser.add_argument("--input-path", default="s3://darktracer-logs-dev/honeypot/")
+    parser.add_argument("--output-path", default="s3://darktracer-cleaned-logs-dev/honeypot_logs/")
+    parser.add_argument("--manifest-path", default="s3://darktracer-cleaned-logs-dev/manifests/clean_vpc_logs.json")
+    parser.add_argument("--compacted-path", default="s3://darktracer-logs-dev/honeypot_compacted/")
+    return parser.parse_args()
+
+
+def _split_s3(path):
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def list_input_files(input_path):
+    """Every exported .csv.gz object under input_path (S3 or local directory),
+    with the date it was last written"""
+    if input_path.startswith("s3://"):
+        import boto3
+        bucket, prefix = _split_s3(input_path)
+        paginator = boto3.client("s3").get_paginator("list_objects_v2")
+        return {
+            f"s3://{bucket}/{obj['Key']}": obj["LastModified"].date()
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+            for obj in page.get("Contents", [])
+            if obj["Key"].endswith(".csv.gz")
+        }
+
+    return {
+        path: datetime.utcfromtimestamp(os.path.getmtime(path)).date()
+        for path in sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(input_path)
+            for name in names
+            if name.endswith(".csv.gz")
+        )
+    }
+
+
+def source_days(path, modified):
+    """ISO dates an export can hold events for, or None if its name gives no hour"""
+    match = SOURCE_KEY_PATTERN.search(path)
+    if not match:
+        return None
+    day = (datetime(*map(int, match.groups())) - LATE_ARRIVAL).date()
+    days = []
+    while day <= modified:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def _read_json(path):
+    """Parsed JSON at path (S3 or local), or None if it does not exist"""
+    if path.startswith("s3://"):
+        import boto3
+        s3 = boto3.client("s3")
+        bucket, key = _split_s3(path)
+        try:
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except s3.exceptions.NoSuchKey:
+            return None
+    else:
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            body = f.read()
+    return json.loads(body)
+
+
+def load_manifest(manifest_path):
+    """Input files already cleaned by earlier runs"""
+    manifest = _read_json(manifest_path)
+    return set(manifest["processed_files"]) if manifest else set()
+
+
+def load_compacted_days(compacted_path):
+    """lambda_compact_honeypot's days, with their files and sources as full paths.
+
+    The compaction manifest holds keys in the logs bucket, which is the
+    parent of compacted_path.
+    """
+    manifest = _read_json(compacted_path.rstrip("/") + "/_manifest.json")
+    if not manifest:
+        return {}
+    root = compacted_path.rstrip("/").rsplit("/", 1)[0] + "/"
+    return {
+        day: {
+            "files": [root + f["key"] for f in entry["files"]],
+            "sources": {root + key for key in entry["sources"]}
+        }
+        for day, entry in manifest["days"].items()
+    }
+
+
+def save_manifest(manifest_path, processed_files):
+    body = json.dumps({
+        "updated_at": datetime.utcnow().isoformat(),
+        "processed_files": sorted(processed_files)
+    }).encode("utf-8")
+    if manifest_path.startswith("s3://"):
+        import boto3
+        bucket, key = _split_s3(manifest_path)
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=body)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+        with open(manifest_path, "wb") as f:
+            f.write(body)
 
-    print("Files read successfully!")
-    print(f"Columns: {df.columns}")
-    print(f"Row count: {df.count()}")
-    df.show(5)
 
-    # Write cleaned data back to another S3 path
-    output_path = "s3://darktracer-training-bucket-dev/input/"
-    print(f"Writing data to: {output_path}")
+def clean(df):
+    """Cast CSV columns, drop malformed rows and dedupe on event identity"""
+    return validate(df.select(
+        F.to_timestamp("utc_time", UTC_TIME_FORMAT).alias("utc_time"),
+        F.trim("src_host").alias("src_host"),
+        F.col("src_port").cast("int").alias("src_port"),
+        F.trim("dst_host").alias("dst_host"),
+        F.col("dst_port").cast("int").alias("dst_port"),
+        F.col("logtype").cast("int").alias("logtype"),
+        "node_id",
+        "username",
+        "password"
+    ))
 
-    df.write \
-        .mode("overwrite") \
-        .option("header", "true") \
-        .csv(output_path)
 
-except Exception as e:
-    print("Error occurred:", str(e))
-    raise e
+def clean_compacted(df):
+    """Compacted Parquet is already typed; trim and validate it like the CSV"""
+    return validate(df.select(
+        F.col("utc_time").cast("timestamp").alias("utc_time"),
+        F.trim("src_host").alias("src_host"),
+        F.col("src_port").cast("int").alias("src_port"),
+        F.trim("dst_host").alias("dst_host"),
+        F.col("dst_port").cast("int").alias("dst_port"),
+        F.col("logtype").cast("int").alias("logtype"),
+        "node_id",
+        "username",
+        "password"
+    ))
+
+
+def validate(df):
+    """Drop malformed rows and dedupe on event identity"""
+    # OpenCanary uses -1 for "no port" on service start-up events
+    df = df.where(
+        F.col("utc_time").isNotNull() &
+        F.col("logtype").isNotNull() &
+        (F.col("src_host").rlike(IPV4_PATTERN) | F.col("src_host").contains(":")) &
+        F.col("dst_port").between(-1, 65535) &
+        (F.col("src_port").isNull() | F.col("src_port").between(-1, 65535))
+    )
+
+    return df.dropDuplicates(EVENT_IDENTITY).withColumn("event_date", F.to_date("utc_time"))
+
+
+def drop_written(spark, df, output_path):
+    """Drop rows already in the output's event_date partitions.
+
+    Replayed or overlapping exports repeat events that an earlier run has
+    already appended, so the batch is anti-joined on event identity
+    against just the partitions it touches.
+    """
+    dates = [row.event_date for row in df.select("event_date").distinct().collect()]
+    try:
+        written = spark.read.parquet(output_path)
+    except AnalysisException:
+        # Nothing written yet
+        return df
+    written = written.where(F.col("event_date").isin(dates)).select(*EVENT_IDENTITY)
+    # Ports can be null, so compare null-safely
+    matches = [df[name].eqNullSafe(written[name]) for name in EVENT_IDENTITY]
+    return df.join(written, matches, "left_anti")
+
+
+def main():
+    options = resolve_options()
+
+    job = None
+    if options.local:
+        spark = SparkSession.builder.master("local[*]").appName("clean_vpc_logs").getOrCreate()
+    else:
+        # Initialize Glue contexts
+        sc = SparkContext()
+        glueContext = GlueContext(sc)
+        spark = glueContext.spark_session
+        job = Job(glueContext)
+
+    print("Starting Glue job...")
+
+    try:
+        processed = load_manifest(options.manifest_path)
+        input_files = list_input_files(options.input_path)
+        new_files = [path for path in input_files if path not in processed]
+        # Exports expired by lambda_compact_honeypot can never be listed again
+        expired = processed.difference(input_files)
+        processed -= expired
+
+        if not new_files:
+            print("No new files since the last run.")
+            if expired:
+                save_manifest(options.manifest_path, processed)
+            if job is not None:
+                job.commit()
+            return
+
+        # A day compacted by lambda_compact_honeypot is read from its daily
+        # Parquet files while any of its exports is new, and an export whose
+        # every day is compacted is not read at all
+        compacted = load_compacted_days(options.compacted_path)
+        new_set = set(new_files)
+        parquet_days = sorted(day for day, entry in compacted.items() if entry["sources"] & new_set)
+        csv_files = []
+        for path in new_files:
+            days = source_days(path, input_files[path])
+            if days is None or not compacted.keys() >= set(days):
+                csv_files.append(path)
+
+        frames = []
+        if csv_files:
+            print(f"Reading {len(csv_files)} new files from {options.input_path}")
+            # Explicit schema: no inference pass, no header-sniffing job
+            raw = spark.read \
+                .option("header", "true") \
+                .option("mode", "PERMISSIVE") \
+                .schema(RAW_SCHEMA) \
+                .csv(csv_files)
+            # Their rows on the compacted days come from the Parquet below
+            frames.append(clean(raw).where(~F.col("event_date").isin(parquet_days)))
+
+        parquet_files = [path for day in parquet_days for path in compacted[day]["files"]]
+        if parquet_files:
+            print(f"Reading {len(parquet_days)} compacted days from {options.compacted_path}")
+            frames.append(clean_compacted(spark.read.parquet(*parquet_files)))
+
+        if not frames:
+            print("The new files only cover compacted days with no rows.")
+            save_manifest(options.manifest_path, processed.union(new_files))
+            if job is not None:
+                job.commit()
+            return
+
+        # One cached pass: the count below materializes the cache, the write
+        # reuses it, so the existing partitions are read before any append
+        batch = frames[0]
+        for frame in frames[1:]:
+            batch = batch.unionByName(frame)
+        batch = batch.persist()
+        cleaned = drop_written(spark, batch, options.output_path).persist()
+        row_count = cleaned.count()
+        print(f"Clean rows not yet written: {row_count}")
+
+        if row_count:
+            print(f"Appending data to: {options.output_path}")
+            cleaned.write \
+                .mode("append") \
+                .partitionBy("event_date") \
+                .parquet(options.output_path)
+
+        cleaned.unpersist()
+        batch.unpersist()
+
+        # Record the inputs only after the output is written; exports read
+        # through their compacted days count too, so compaction can expire them
+        save_manifest(options.manifest_path, processed.union(new_files))
+
+    except Exception as e:
+        print("Error occurred:", str(e))
+        raise e
+
+    # Finalize Glue job
+    if job is not None:
+        job.commit()
+    print("Glue job completed.")
+
 
-# Finalize Glue job
-job.commit()
-print("Glue job completed.")
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,171 @@ resource "aws_glue_catalog_database" "clean_logs_db" {
   }
 }
 
+###################
+# HONEYPOT PARQUET TABLE
+###################
+# Typed table over the exporter's OUTPUT_FORMAT=parquet files. Partition
+# projection lets Athena prune year/month/day/hour without a crawler.
+resource "aws_glue_catalog_table" "honeypot_parquet" {
+  name          = "honeypot_parquet"
+  database_name = aws_glue_catalog_database.clean_logs_db.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"            = "parquet"
+    "projection.enabled"        = "true"
+    "projection.year.type"      = "integer"
+    "projection.year.range"     = "2025,2035"
+    "projection.month.type"     = "integer"
+    "projection.month.range"    = "1,12"
+    "projection.month.digits"   = "2"
+    "projection.day.type"       = "integer"
+    "projection.day.range"      = "1,31"
+    "projection.day.digits"     = "2"
+    "projection.hour.type"      = "integer"
+    "projection.hour.range"     = "0,23"
+    "projection.hour.digits"    = "2"
+    "storage.location.template" = "s3://${aws_s3_bucket.logs.bucket}/honeypot_parquet/year=$${year}/month=$${month}/day=$${day}/hour=$${hour}/"
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+  partition_keys {
+    name = "hour"
+    type = "string"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.logs.bucket}/honeypot_parquet/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "utc_time"
+      type = "timestamp"
+    }
+    columns {
+      name = "src_host"
+      type = "string"
+    }
+    columns {
+      name = "src_port"
+      type = "int"
+    }
+    columns {
+      name = "dst_host"
+      type = "string"
+    }
+    columns {
+      name = "dst_port"
+      type = "int"
+    }
+    columns {
+      name = "logtype"
+      type = "int"
+    }
+    columns {
+      name = "node_id"
+      type = "string"
+    }
+    columns {
+      name = "username"
+      type = "string"
+    }
+    columns {
+      name = "password"
+      type = "string"
+    }
+  }
+}
+
+###################
+# HONEYPOT COMPACTED TABLE
+###################
+# Daily Parquet files from lambda_compact_honeypot. Athena reads each day
+# through its symlink manifest, which compaction replaces in one PUT, so a
+# query sees a whole generation of the day or none of it.
+resource "aws_glue_catalog_table" "honeypot_compacted" {
+  name          = "honeypot_compacted"
+  database_name = aws_glue_catalog_database.clean_logs_db.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"               = "parquet"
+    "projection.enabled"           = "true"
+    "projection.event_date.type"   = "date"
+    "projection.event_date.format" = "yyyy-MM-dd"
+    "projection.event_date.range"  = "2025-01-01,NOW"
+    "storage.location.template"    = "s3://${aws_s3_bucket.logs.bucket}/honeypot_compacted/_symlink/event_date=$${event_date}/"
+  }
+
+  partition_keys {
+    name = "event_date"
+    type = "string"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.logs.bucket}/honeypot_compacted/_symlink/"
+    input_format  = "org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "utc_time"
+      type = "timestamp"
+    }
+    columns {
+      name = "src_host"
+      type = "string"
+    }
+    columns {
+      name = "src_port"
+      type = "int"
+    }
+    columns {
+      name = "dst_host"
+      type = "string"
+    }
+    columns {
+      name = "dst_port"
+      type = "int"
+    }
+    columns {
+      name = "logtype"
+      type = "int"
+    }
+    columns {
+      name = "node_id"
+      type = "string"
+    }
+    columns {
+      name = "username"
+      type = "string"
+    }
+    columns {
+      name = "password"
+      type = "string"
+    }
+  }
+}
+
 ###################
 # GLUE CRAWLER
 ###################
@@ -33,8 +198,9 @@ resource "aws_glue_crawler" "clean_logs_crawler" {
   role          = aws_iam_role.glue_service_role.arn
   database_name = aws_glue_catalog_database.clean_logs_db.name
 
+  # Parquet written by clean_vpc_logs.py, partitioned by event_date
   s3_target {
-    path = "s3://${aws_s3_bucket.cleaned_logs.bucket}/"
+    path = "s3://${aws_s3_bucket.cleaned_logs.bucket}/honeypot_logs/"
   }
 
   schedule = "cron(0 12 * * ? *)"
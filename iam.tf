@@ -190,10 +190,10 @@ resource "aws_iam_role_policy" "lambda_waf_policy" {
           "wafv2:TagResource",
           "wafv2:UntagResource"
         ]
-        Resource = [
-          aws_wafv2_ip_set.blocked_ips.arn,
-          "${aws_wafv2_ip_set.blocked_ips.arn}/*"
-        ]
+        Resource = concat(
+          [aws_wafv2_ip_set.blocked_ips.arn, "${aws_wafv2_ip_set.blocked_ips.arn}/*"],
+          aws_wafv2_ip_set.blocked_ips_overflow[*].arn
+        )
       },
       {
         Effect = "Allow"
@@ -247,6 +247,67 @@ resource "aws_iam_role" "bedrock_lambda_role" {
   })
 }
 
+# Shared answer cache for the chatbot Lambda
+resource "aws_iam_role_policy" "chatbot_answer_cache" {
+  name = "${var.project_name}-chatbot-answer-cache-${terraform.workspace}"
+  role = aws_iam_role.bedrock_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem"
+        ]
+        Resource = aws_dynamodb_table.chatbot_answers.arn
+      }
+    ]
+  })
+}
+
+# The chatbot and the log indexer read the log and read/write its index
+resource "aws_iam_role_policy" "chatbot_log_index" {
+  name = "${var.project_name}-chatbot-log-index-${terraform.workspace}"
+  role = aws_iam_role.bedrock_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["s3:GetObject"]
+        Resource = "${aws_s3_bucket.cleaned_logs.arn}/${var.chatbot_log_key}"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ]
+        Resource = "${aws_s3_bucket.cleaned_logs.arn}/index/*"
+      },
+      {
+        # Without ListBucket a missing index reads as AccessDenied, not NoSuchKey
+        Effect    = "Allow"
+        Action    = ["s3:ListBucket"]
+        Resource  = aws_s3_bucket.cleaned_logs.arn
+        Condition = { StringLike = { "s3:prefix" = ["index/*"] } }
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      }
+    ]
+  })
+}
+
 #----------------------------------------------------------
 # Lambda IAM Policy
 # - Defines permissions for the Lambda function
@@ -286,6 +347,8 @@ resource "aws_iam_role_policy" "athena_lambda_policy" {
         Action = [
           "athena:StartQueryExecution",
           "athena:GetQueryExecution",
+          "athena:BatchGetQueryExecution",
+          "athena:StopQueryExecution",
           "athena:GetQueryResults",
           "athena:DeleteNamedQuery"
         ]
@@ -298,7 +361,8 @@ resource "aws_iam_role_policy" "athena_lambda_policy" {
           "s3:GetObject",
           "s3:ListBucket",
           "s3:PutObject",
-          "s3:DeleteObject"
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ]
         Resource = [
           # Training bucket permissions (destination)
@@ -306,7 +370,10 @@ resource "aws_iam_role_policy" "athena_lambda_policy" {
           "arn:aws:s3:::${var.project_name}-training-bucket-${terraform.workspace}",
           # Logs bucket permissions (source)
           "arn:aws:s3:::${var.project_name}-logs-${terraform.workspace}/*",
-          "arn:aws:s3:::${var.project_name}-logs-${terraform.workspace}"
+          "arn:aws:s3:::${var.project_name}-logs-${terraform.workspace}",
+          # Cleaned logs bucket (honeypot_logs table data)
+          "arn:aws:s3:::${var.project_name}-cleaned-logs-${terraform.workspace}/*",
+          "arn:aws:s3:::${var.project_name}-cleaned-logs-${terraform.workspace}"
         ]
       },
       {
@@ -371,6 +438,39 @@ resource "aws_iam_role_policy" "lambda_waf_sns_policy" {
         ]
         Resource = aws_sns_topic.threat_alerts.arn
       },
+      {
+        # model.onnx scored in-process by the threat analyzer
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = "arn:aws:s3:::${var.model_bucket}/${var.model_key}"
+      },
+      {
+        # Shared rate detector state and WAF blocklist index, merged with conditional writes
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
+          "dynamodb:PutItem"
+        ]
+        Resource = [
+          aws_dynamodb_table.rate_state.arn,
+          aws_dynamodb_table.waf_blocklist.arn
+        ]
+      },
+      {
+        # Remediation intents, sent by the analyzer and drained by the worker
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = aws_sqs_queue.remediation.arn
+      },
       {
         Effect = "Allow"
         Action = [
@@ -0,0 +1,179 @@
+import bisect
+import ipaddress
+import os
+import socket
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Labels returned by IPClassifier, checked in this order
+ALLOWLISTED = 'allowlisted'
+PRIVATE = 'private'
+KNOWN_BAD = 'known_bad'
+INVALID = 'invalid'
+
+# Sources that must never reach WAF or the security group
+SKIP_REMEDIATION = (ALLOWLISTED, PRIVATE, INVALID)
+
+PRIVATE_CIDRS = [
+    '10.0.0.0/8',
+    '172.16.0.0/12',
+    '192.168.0.0/16',
+    '100.64.0.0/10',
+    '127.0.0.0/8',
+    '169.254.0.0/16',
+    'fc00::/7',
+    'fe80::/10',
+    '::1/128'
+]
+
+
+class _IntervalTable:
+    """Sorted, non-overlapping [start, end] integer ranges for one IP version"""
+
+    def __init__(self, ranges):
+        # Merge overlapping and adjacent ranges so a single bisect is enough
+        self.starts, self.ends = [], []
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+        self._np_starts = self._np_ends = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, value):
+        i = bisect.bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def contains_many(self, values):
+        """Vectorized contains over a uint64 array (IPv4 only)"""
+        if self._np_starts is None:
+            self._np_starts = np.array(self.starts, dtype=np.uint64)
+            self._np_ends = np.array(self.ends, dtype=np.uint64)
+        if not len(self.starts):
+            return np.zeros(len(values), dtype=bool)
+        i = np.searchsorted(self._np_starts, values, side='right') - 1
+        valid = i >= 0
+        return valid & (values <= self._np_ends[np.maximum(i, 0)])
+
+
+class IPClassifier:
+    """Classify source IPs against private ranges, allowlists and bad-CIDR feeds.
+
+    Built once at cold start; every lookup is a bisect per category, so it
+    stays O(log n) with hundreds of thousands of CIDRs loaded.
+    """
+
+    def __init__(self, allowlist=(), known_bad=(), private=PRIVATE_CIDRS):
+        self.tables = []
+        for label, cidrs in ((ALLOWLISTED, allowlist), (PRIVATE, private), (KNOWN_BAD, known_bad)):
+            v4, v6 = [], []
+            for version, start, end in _parse_ranges(cidrs):
+                (v4 if version == 4 else v6).append((start, end))
+            self.tables.append((label, _IntervalTable(v4), _IntervalTable(v6)))
+
+    @classmethod
+    def from_env(cls):
+        """Build from ALLOWLIST_CIDRS, KNOWN_BAD_CIDRS and KNOWN_BAD_FEED"""
+        allowlist = _split(os.environ.get('ALLOWLIST_CIDRS', ''))
+        known_bad = _split(os.environ.get('KNOWN_BAD_CIDRS', ''))
+        feed = os.environ.get('KNOWN_BAD_FEED')
+        if feed:
+            known_bad.extend(load_cidr_feed(feed))
+        return cls(allowlist=allowlist, known_bad=known_bad)
+
+    def classify(self, ip):
+        """Return the label for a single IP, or None if it is unremarkable"""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except (TypeError, ValueError):
+            return INVALID
+        value = int(addr)
+        for label, v4, v6 in self.tables:
+            if (v4 if addr.version == 4 else v6).contains(value):
+                return label
+        return None
+
+    def classify_many(self, ips):
+        """Classify a batch of IPs, vectorizing the IPv4 lookups with NumPy"""
+        ips = list(ips)
+        if np is None:
+            return [self.classify(ip) for ip in ips]
+
+        labels = [None] * len(ips)
+        v4_index, v4_values = [], []
+        for n, ip in enumerate(ips):
+            try:
+                addr = ipaddress.ip_address(ip)
+            except (TypeError, ValueError):
+                labels[n] = INVALID
+                continue
+            if addr.version == 4:
+                v4_index.append(n)
+                v4_values.append(int(addr))
+            else:
+                labels[n] = self.classify(addr)
+
+        if v4_values:
+            values = np.array(v4_values, dtype=np.uint64)
+            unlabelled = np.ones(len(values), dtype=bool)
+            for label, v4, _ in self.tables:
+                hits = unlabelled & v4.contains_many(values)
+                for i in np.flatnonzero(hits):
+                    labels[v4_index[i]] = label
+                unlabelled &= ~hits
+        return labels
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _parse_ranges(cidrs):
+    """Yield (version, first, last) integer ranges.
+
+    inet_pton is used instead of ipaddress.ip_network, which is far too slow
+    to load 100k+ feed entries during a Lambda cold start.
+    """
+    for cidr in cidrs:
+        address, _, prefix = str(cidr).strip().partition('/')
+        try:
+            if ':' in address:
+                version, bits = 6, 128
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+            else:
+                version, bits = 4, 32
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+            prefix = int(prefix) if prefix else bits
+            if not 0 <= prefix <= bits:
+                raise ValueError(prefix)
+        except (OSError, ValueError):
+            print(f"WARNING: Ignoring invalid CIDR {cidr!r}")
+            continue
+        host_mask = (1 << (bits - prefix)) - 1
+        yield version, value & ~host_mask, value | host_mask
+
+
+def load_cidr_feed(location):
+    """Read one CIDR per line from a local path or s3://bucket/key, skipping comments"""
+    if location.startswith('s3://'):
+        from aws_clients import client
+        bucket, _, key = location[len('s3://'):].partition('/')
+        body = client('s3').get_object(Bucket=bucket, Key=key)['Body']
+        lines = (line.decode('utf-8') for line in body.iter_lines())
+    else:
+        with open(location) as f:
+            lines = f.read().splitlines()
+
+    cidrs = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            cidrs.append(line)
+    return cidrs
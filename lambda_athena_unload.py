@@ -1,7 +1,10 @@
-import boto3
+import json
 import os
 import time
 import logging
+from datetime import datetime
+from aws_clients import client, lazy
+from metrics import Metrics
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -16,10 +19,44 @@ ATHENA_DATABASE = f"{PROJECT_NAME}_clean_logs_{ENVIRONMENT}"
 ATHENA_TABLE = os.environ.get('ATHENA_TABLE', 'honeypot_logs')
 
 ATHENA_OUTPUT = f"s3://{PROJECT_NAME}-training-bucket-{ENVIRONMENT}/athena-results/"
-UNLOAD_TARGET = f"s3://{PROJECT_NAME}-training-bucket-{ENVIRONMENT}/input/"
+TRAINING_BUCKET = f"{PROJECT_NAME}-training-bucket-{ENVIRONMENT}"
+UNLOAD_PREFIX = "input/"
+UNLOAD_TARGET = f"s3://{TRAINING_BUCKET}/{UNLOAD_PREFIX}"
 
-athena = boto3.client('athena')
-s3 = boto3.client('s3')
+HEADER_LINE = "utc_time,src_host,src_port,dst_host,dst_port,logtype,node_id,username,password\n"
+
+# "incremental" unloads only event_date partitions not exported yet;
+# "full" unloads the whole table in one query
+UNLOAD_MODE = os.environ.get('UNLOAD_MODE', 'incremental')
+PARTITION_COLUMN = os.environ.get('PARTITION_COLUMN', 'event_date')
+CHECKPOINT_KEY = os.environ.get('CHECKPOINT_KEY', 'checkpoints/athena-unload.json')
+
+# Stay well under Athena's concurrent DML query quota
+MAX_CONCURRENT_QUERIES = int(os.environ.get('MAX_CONCURRENT_QUERIES', '5'))
+
+# Stop starting new partitions when less than this much Lambda time is left
+MIN_REMAINING_MS = 60 * 1000
+
+# Queries still running after this long are stopped and retried next run
+QUERY_TIMEOUT_SECONDS = 300
+
+# Backoff for polling Athena and waiting on UNLOAD files to appear
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 10
+LIST_RETRIES = 6
+
+# S3 rejects multipart parts smaller than 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# DeleteObjects takes at most 1000 keys
+DELETE_BATCH_SIZE = 1000
+
+# Built on first use, so a cold start pays only for the clients it touches
+athena = lazy('athena')
+s3 = lazy('s3')
+
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics('AthenaUnload')
 
 # ====================
 # Helper Functions
@@ -38,7 +75,9 @@ def run_query(query):
         raise
 
 def wait_for_query(execution_id, timeout=300):
+    """Poll with exponential backoff until the query reaches a final state"""
     start_time = time.time()
+    delay = POLL_INITIAL_DELAY
     while True:
         if time.time() - start_time > timeout:
             raise Exception("Query timeout exceeded")
@@ -53,7 +92,8 @@ def wait_for_query(execution_id, timeout=300):
         if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
             return state
 
-        time.sleep(1)
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY)
 
 def get_query_results(execution_id):
     try:
@@ -63,114 +103,379 @@ def get_query_results(execution_id):
         logger.error(f"Error getting query results: {str(e)}")
         raise
 
-# --- CHANGED: Replaced write_header_file with combine_header_and_data ---
-
-def combine_header_and_data(bucket, prefix, header, output_filename='final_output.csv'):
+def _split_s3(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def list_unload_parts(bucket, prefix, execution_id):
+    """Return (key, size) for every data file the UNLOAD wrote.
+
+    Athena writes a data manifest listing each file; if it is not there we
+    page through the prefix for keys carrying the query id. S3 listings can
+    lag the query finishing, so both are retried with backoff.
+    """
+    status = athena.get_query_execution(QueryExecutionId=execution_id)
+    manifest = status['QueryExecution'].get('Statistics', {}).get('DataManifestLocation')
+
+    delay = POLL_INITIAL_DELAY
+    for attempt in range(LIST_RETRIES):
+        keys = []
+        if manifest:
+            manifest_bucket, manifest_key = _split_s3(manifest)
+            try:
+                body = s3.get_object(Bucket=manifest_bucket, Key=manifest_key)['Body']
+                keys = [_split_s3(line.decode('utf-8').strip())[1] for line in body.iter_lines() if line.strip()]
+                if not keys:
+                    # The manifest is authoritative: the query wrote nothing
+                    return []
+            except s3.exceptions.NoSuchKey:
+                keys = []
+        else:
+            paginator = s3.get_paginator('list_objects_v2')
+            keys = [
+                obj['Key']
+                for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+                for obj in page.get('Contents', [])
+                if execution_id in obj['Key']
+            ]
+
+        if keys:
+            # Sizes decide which parts can be copied server-side
+            parts = [(key, s3.head_object(Bucket=bucket, Key=key)['ContentLength']) for key in sorted(keys)]
+            return [(key, size) for key, size in parts if size > 0]
+
+        if attempt + 1 < LIST_RETRIES:
+            logger.warning(f"No UNLOAD files found yet, retrying... ({attempt+1}/{LIST_RETRIES})")
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_DELAY)
+
+    return []
+
+
+def merge_unload_parts(bucket, prefix, header, execution_id, output_filename='final_output.csv', allow_empty=False):
+    """Concatenate the header and every UNLOAD part into one object, server-side.
+
+    Parts of at least 5 MiB are copied with upload_part_copy. Only the header
+    and small files (or the first few MiB needed to pad a part up to the S3
+    minimum) pass through Lambda, so memory stays bounded by MIN_PART_SIZE
+    whatever the dataset size. Once the merged object is written the parts
+    are deleted, so the prefix holds each row once.
+    """
     try:
-        logger.info(f"Combining header and data in bucket {bucket}, prefix {prefix}")
-
-        retries = 5  # Try 5 times
-        data_files = []
-
-        for attempt in range(retries):
-            response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-            data_files = [obj['Key'] for obj in response.get('Contents', []) if obj['Key'].endswith('_0')]
+        parts = list_unload_parts(bucket, prefix, execution_id)
+        if not parts:
+            if not allow_empty:
+                raise Exception("No data files found after retries")
+            logger.info("UNLOAD wrote no data files")
+            return 0
+        logger.info(f"Merging header and {len(parts)} UNLOAD files in bucket {bucket}, prefix {prefix}")
 
-            if data_files:
-                break  # Found data files, no need to retry
+        final_key = prefix + output_filename
+        buffer = bytearray(header.encode('utf-8'))
+        uploaded = []
+        upload_id = None
+
+        def upload_buffer():
+            nonlocal upload_id, buffer
+            if upload_id is None:
+                upload_id = s3.create_multipart_upload(Bucket=bucket, Key=final_key)['UploadId']
+            response = s3.upload_part(
+                Bucket=bucket, Key=final_key, UploadId=upload_id,
+                PartNumber=len(uploaded) + 1, Body=bytes(buffer)
+            )
+            uploaded.append({'ETag': response['ETag'], 'PartNumber': len(uploaded) + 1})
+            buffer = bytearray()
+
+        def copy_range(key, first, last):
+            nonlocal upload_id
+            if upload_id is None:
+                upload_id = s3.create_multipart_upload(Bucket=bucket, Key=final_key)['UploadId']
+            response = s3.upload_part_copy(
+                Bucket=bucket, Key=final_key, UploadId=upload_id,
+                PartNumber=len(uploaded) + 1,
+                CopySource={'Bucket': bucket, 'Key': key},
+                CopySourceRange=f"bytes={first}-{last}"
+            )
+            uploaded.append({'ETag': response['CopyPartResult']['ETag'], 'PartNumber': len(uploaded) + 1})
+
+        def read_range(key, first, last):
+            return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={first}-{last}")['Body'].read()
+
+        try:
+            for key, size in parts:
+                offset = 0
+                # Top the buffered bytes up to a full part before copying
+                if buffer:
+                    needed = min(MIN_PART_SIZE - len(buffer), size)
+                    buffer += read_range(key, 0, needed - 1)
+                    offset = needed
+                    if len(buffer) >= MIN_PART_SIZE:
+                        upload_buffer()
+
+                remaining = size - offset
+                if remaining >= MIN_PART_SIZE:
+                    copy_range(key, offset, size - 1)
+                elif remaining:
+                    # Too small to stand alone as a non-final part
+                    buffer += read_range(key, offset, size - 1)
+
+            if upload_id is None:
+                s3.put_object(Bucket=bucket, Key=final_key, Body=bytes(buffer))
             else:
-                logger.warning(f"No data files found, retrying... ({attempt+1}/{retries})")
-                time.sleep(2)  # wait 2 seconds and retry
+                if buffer:
+                    upload_buffer()
+                s3.complete_multipart_upload(
+                    Bucket=bucket, Key=final_key, UploadId=upload_id,
+                    MultipartUpload={'Parts': uploaded}
+                )
+        except Exception:
+            if upload_id is not None:
+                s3.abort_multipart_upload(Bucket=bucket, Key=final_key, UploadId=upload_id)
+            raise
 
-        if not data_files:
-            raise Exception("No data files found after retries")
+        logger.info(f"Written combined file to {final_key}")
+        delete_keys(bucket, [key for key, _ in parts])
+        return len(parts)
+
+    except Exception as e:
+        logger.error(f"Error combining header and data: {str(e)}")
+        raise
 
-        first_data_file_key = data_files[0]
-        logger.info(f"Using first data file: {first_data_file_key}")
 
-        data_obj = s3.get_object(Bucket=bucket, Key=first_data_file_key)
-        data_body = data_obj['Body'].read()
+def build_unload_query(target, where=""):
+    return f"""
+        UNLOAD (
+            SELECT 
+                CAST(utc_time AS VARCHAR) as utc_time,
+                src_host,
+                CAST(src_port AS VARCHAR) as src_port,
+                dst_host,
+                CAST(dst_port AS VARCHAR) as dst_port,
+                CAST(logtype AS VARCHAR) as logtype,
+                node_id,
+                username,
+                password
+            FROM {ATHENA_TABLE}
+            {where}
+        )
+        TO '{target}'
+        WITH (format = 'CSV', compression = 'NONE')
+    """
 
-        combined_data = header.encode('utf-8') + data_body
 
-        final_key = prefix + output_filename
-        s3.put_object(Bucket=bucket, Key=final_key, Body=combined_data)
+def load_checkpoint():
+    """Last event_date partition that was fully exported, or None"""
+    try:
+        body = s3.get_object(Bucket=TRAINING_BUCKET, Key=CHECKPOINT_KEY)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body).get('last_partition')
+
+
+def save_checkpoint(last_partition):
+    s3.put_object(
+        Bucket=TRAINING_BUCKET,
+        Key=CHECKPOINT_KEY,
+        Body=json.dumps({'last_partition': last_partition, 'updated_at': datetime.utcnow().isoformat()}).encode('utf-8')
+    )
+
+
+def list_new_partitions(last_partition):
+    """Completed partitions after last_partition, oldest first.
+
+    Today's partition is still being appended to, so it waits for tomorrow.
+    """
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    paginator = client('glue').get_paginator('get_partitions')
+
+    partitions = set()
+    for page in paginator.paginate(DatabaseName=ATHENA_DATABASE, TableName=ATHENA_TABLE):
+        for partition in page['Partitions']:
+            value = partition['Values'][0]
+            if (last_partition is None or value > last_partition) and value < today:
+                partitions.add(value)
+    return sorted(partitions)
+
+
+def delete_keys(bucket, keys):
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': key} for key in keys[i:i + DELETE_BATCH_SIZE]],
+            'Quiet': True
+        })
+
+
+def clear_prefix(bucket, prefix):
+    """UNLOAD refuses a non-empty target, so clear leftovers from failed runs"""
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+
+
+def run_queries_concurrently(queries, max_concurrent=MAX_CONCURRENT_QUERIES, context=None, timeout=300):
+    """Run {name: sql} with at most max_concurrent queries in flight.
+
+    Yields (name, QueryExecution) as each query reaches a final state. Running
+    queries are polled together with batch_get_query_execution. When the
+    Lambda is close to its timeout no new queries are started, and once
+    timeout seconds have passed the queries still running are stopped;
+    either way the generator just ends, so the caller keeps what already
+    finished and picks the rest up on the next run.
+    """
+    pending = list(queries.items())
+    running = {}
+    start_time = time.time()
+    delay = POLL_INITIAL_DELAY
 
-        logger.info(f"Written combined file to {final_key}")
+    while pending or running:
+        if time.time() - start_time > timeout:
+            logger.error(f"Query timeout exceeded; stopping {len(running)} queries, "
+                         f"deferring {len(running) + len(pending)} partitions")
+            for execution_id in running:
+                try:
+                    athena.stop_query_execution(QueryExecutionId=execution_id)
+                except Exception as e:
+                    logger.warning(f"Could not stop query {execution_id}: {str(e)}")
+            return
+
+        out_of_time = context is not None and context.get_remaining_time_in_millis() < MIN_REMAINING_MS
+        while pending and len(running) < max_concurrent and not out_of_time:
+            name, query = pending[0]
+            try:
+                running[run_query(query)] = name
+                pending.pop(0)
+            except athena.exceptions.TooManyRequestsException:
+                logger.warning("Athena query quota reached, waiting for running queries")
+                break
+        if out_of_time and pending:
+            logger.warning(f"Deferring {len(pending)} partitions to the next run")
+            pending = []
+
+        if not running:
+            break
+
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+        response = athena.batch_get_query_execution(QueryExecutionIds=list(running))
+        for execution in response['QueryExecutions']:
+            if execution['Status']['State'] in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+                # Something finished, so poll the remaining queries sooner
+                delay = POLL_INITIAL_DELAY
+                yield running.pop(execution['QueryExecutionId']), execution
+
+
+def unload_partitions(partitions, context=None):
+    """Unload each partition to its own prefix and merge it into one CSV.
+
+    Returns (exported partitions, bytes scanned, files written).
+    """
+    queries = {}
+    for partition in partitions:
+        prefix = f"{UNLOAD_PREFIX}{PARTITION_COLUMN}={partition}/"
+        clear_prefix(TRAINING_BUCKET, prefix)
+        queries[partition] = build_unload_query(
+            f"s3://{TRAINING_BUCKET}/{prefix}",
+            f"WHERE {PARTITION_COLUMN} = '{partition}'"
+        )
 
-    except Exception as e:
-        logger.error(f"Error combining header and data: {str(e)}")
-        raise
+    exported, scanned, files = [], 0, 0
+    for partition, execution in run_queries_concurrently(queries, context=context, timeout=QUERY_TIMEOUT_SECONDS):
+        state = execution['Status']['State']
+        if state != 'SUCCEEDED':
+            reason = execution['Status'].get('StateChangeReason', 'No reason provided')
+            logger.error(f"UNLOAD of {PARTITION_COLUMN}={partition} {state}: {reason}")
+            continue
+
+        stats = execution.get('Statistics', {})
+        scanned += stats.get('DataScannedInBytes', 0)
+        metrics.add('QueryTime', stats.get('TotalExecutionTimeInMillis', 0), 'Milliseconds')
+        prefix = f"{UNLOAD_PREFIX}{PARTITION_COLUMN}={partition}/"
+        try:
+            with metrics.stage('Merge'):
+                files += merge_unload_parts(
+                    TRAINING_BUCKET, prefix, HEADER_LINE, execution['QueryExecutionId'],
+                    output_filename=f"honeypot-{partition}.csv", allow_empty=True
+                )
+        except Exception as e:
+            logger.error(f"Merge of {PARTITION_COLUMN}={partition} failed: {str(e)}")
+            continue
+        exported.append(partition)
 
+    metrics.add('Partitions', len(exported))
+    metrics.add('Bytes', scanned, 'Bytes')
+    return exported, scanned, files
 
-# --- END CHANGED ---
 
 # ====================
 # Lambda Handler
 # ====================
 
+@metrics.handler
 def lambda_handler(event, context):
     try:
-        # 1. Run COUNT(*) query
-        count_query = f"SELECT COUNT(*) AS total FROM {ATHENA_TABLE}"
-        exec_id = run_query(count_query)
-        wait_for_query(exec_id)
-        rows = get_query_results(exec_id)
-        count = int(rows[1]['Data'][0]['VarCharValue'])  # rows[0] = column names
-
-        logger.info(f"Total rows to unload: {count}")
-
-        if count > 0:
-            # 2. Run UNLOAD
-            unload_query = f"""
-                UNLOAD (
-                    SELECT 
-                        CAST(utc_time AS VARCHAR) as utc_time,
-                        src_host,
-                        CAST(src_port AS VARCHAR) as src_port,
-                        dst_host,
-                        CAST(dst_port AS VARCHAR) as dst_port,
-                        CAST(logtype AS VARCHAR) as logtype,
-                        node_id,
-                        username,
-                        password
-                    FROM {ATHENA_TABLE}
-                )
-                TO '{UNLOAD_TARGET}'
-                WITH (format = 'CSV')
-            """
+        mode = (event or {}).get('mode', UNLOAD_MODE)
 
+        if mode == 'full':
+            # Whole table in one query; the statistics replace a separate COUNT(*)
             logger.info("Starting UNLOAD operation")
-            unload_id = run_query(unload_query)
-
-            if wait_for_query(unload_id) != 'SUCCEEDED':
-                raise Exception("UNLOAD query failed")
-
-            logger.info("Successfully unloaded data")
-
-            # --- ADD THIS ---
-            logger.info("Waiting 5 seconds for S3 to receive unload files...")
-            time.sleep(5)
-            # --- END ADD ---
-            
-            # --- CHANGED: Use combine_header_and_data instead of writing separate headers ---
-            bucket = f"{PROJECT_NAME}-training-bucket-{ENVIRONMENT}"
-            prefix = "input/"
-            header_line = "utc_time,src_host,src_port,dst_host,dst_port,logtype,node_id,username,password\n"
-            combine_header_and_data(bucket, prefix, header_line)
-            # --- END CHANGED ---
-
-        else:
-            logger.info("No data to unload")
-
+            # The full export replaces everything under the prefix, including
+            # per-partition CSVs from incremental runs
+            clear_prefix(TRAINING_BUCKET, UNLOAD_PREFIX)
+            with metrics.stage('Query'):
+                unload_id = run_query(build_unload_query(UNLOAD_TARGET))
+
+                if wait_for_query(unload_id) != 'SUCCEEDED':
+                    raise Exception("UNLOAD query failed")
+
+            stats = athena.get_query_execution(QueryExecutionId=unload_id)['QueryExecution'].get('Statistics', {})
+            logger.info(f"Successfully unloaded data, scanned {stats.get('DataScannedInBytes', 0)} bytes")
+            metrics.add('Bytes', stats.get('DataScannedInBytes', 0), 'Bytes')
+
+            with metrics.stage('Merge'):
+                files = merge_unload_parts(TRAINING_BUCKET, UNLOAD_PREFIX, HEADER_LINE, unload_id, allow_empty=True)
+            return {
+                'statusCode': 200,
+                'body': f'Successfully unloaded {files} files, scanned {stats.get("DataScannedInBytes", 0)} bytes',
+                'unloadLocation': UNLOAD_TARGET
+            }
+
+        last_partition = load_checkpoint()
+        partitions = list_new_partitions(last_partition)
+        if not partitions:
+            logger.info(f"No new partitions since {last_partition}")
+            return {
+                'statusCode': 200,
+                'body': 'No new partitions to unload',
+                'unloadLocation': UNLOAD_TARGET
+            }
+
+        logger.info(f"Unloading {len(partitions)} new partitions after {last_partition}")
+        exported, scanned, files = unload_partitions(partitions, context)
+
+        # Advance only over the contiguous run of exported partitions so a
+        # failed day is retried next time instead of being skipped
+        for partition in partitions:
+            if partition not in exported:
+                break
+            last_partition = partition
+        if last_partition is not None:
+            save_checkpoint(last_partition)
+
+        failed = [p for p in partitions if p not in exported]
         return {
-            'statusCode': 200,
-            'body': f'Successfully processed {count} rows',
+            'statusCode': 200 if not failed else 207,
+            'body': f'Unloaded {len(exported)} partitions ({files} files, {scanned} bytes scanned), {len(failed)} pending',
+            'lastPartition': last_partition,
             'unloadLocation': UNLOAD_TARGET
         }
 
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
+        metrics.add('Errors')
         return {
             'statusCode': 500,
             'body': f'Error processing request: {str(e)}'
@@ -0,0 +1,325 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import date, datetime, timedelta
+from aws_clients import lazy
+from lambda_honeypot_to_csv import CSV_HEADER, parquet_record, parquet_schema
+from metrics import Metrics
+from s3_stream import S3MultipartWriter, open_text_lines
+
+# Built on first use, so a cold start pays only for the clients it touches
+s3 = lazy("s3")
+
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics("HoneypotCompaction")
+
+BUCKET = os.environ.get("BUCKET_NAME", "darktracer-logs-dev")
+SOURCE_PREFIX = os.environ.get("BUCKET_PREFIX", "honeypot")
+COMPACTED_PREFIX = os.environ.get("COMPACTED_PREFIX", "honeypot_compacted")
+
+# The exporter's high-water mark; a day is complete once it is past the
+# day's end by the late-arrival window the exporter re-reads
+CHECKPOINT_KEY = os.environ.get("CHECKPOINT_KEY", "checkpoints/honeypot-to-csv.json")
+LATE_ARRIVAL_MS = int(os.environ.get("LATE_ARRIVAL_SECONDS", "120")) * 1000
+
+# Every generation of compacted days, their files and the sources they replace
+MANIFEST_KEY = f"{COMPACTED_PREFIX}/_manifest.json"
+
+# Roll to a new output file past this size, so a busy day lands in files
+# of roughly 128 to 512 MB and a quiet one in a single file
+TARGET_FILE_BYTES = int(os.environ.get("TARGET_FILE_MB", "256")) * 1024 * 1024
+ROW_GROUP_ROWS = int(os.environ.get("ROW_GROUP_ROWS", "131072"))
+
+# Days compacted per invocation, so a backlog drains within the Lambda timeout
+MAX_DAYS_PER_RUN = int(os.environ.get("MAX_DAYS_PER_RUN", "7"))
+
+# Hourly exports are kept this long after their days are compacted
+SOURCE_RETENTION_DAYS = int(os.environ.get("SOURCE_RETENTION_DAYS", "2"))
+
+# The clean_vpc_logs Glue job reads each export, or the compacted days it
+# falls in; one is only deleted once this manifest lists it as processed.
+# Unset, none are deleted.
+GLUE_MANIFEST_PATH = os.environ.get("GLUE_MANIFEST_PATH")
+
+# Replaced generations stay readable this long for queries already planned
+# against the previous symlink manifest
+RETIRED_GRACE_SECONDS = int(os.environ.get("RETIRED_GRACE_SECONDS", "3600"))
+
+# Fields that identify one OpenCanary event, as in clean_vpc_logs
+EVENT_IDENTITY = ["utc_time", "src_host", "src_port", "dst_host", "dst_port", "logtype", "node_id"]
+IDENTITY_INDEXES = [CSV_HEADER.index(name) for name in EVENT_IDENTITY]
+
+# honeypot/YYYY/MM/DD/HH/<name>.csv.gz, named after the export's high-water mark
+SOURCE_KEY_PATTERN = re.compile(r"/(\d{4})/(\d{2})/(\d{2})/(\d{2})/[^/]+\.csv\.gz$")
+
+# DeleteObjects takes at most 1000 keys
+DELETE_BATCH_SIZE = 1000
+
+
+def load_json(key, default):
+    try:
+        body = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return default
+    return json.loads(body)
+
+
+def save_manifest(manifest):
+    manifest["updated_at"] = datetime.utcnow().isoformat()
+    s3.put_object(Bucket=BUCKET, Key=MANIFEST_KEY, Body=json.dumps(manifest, indent=1).encode("utf-8"))
+
+
+def list_sources():
+    """Every hourly export, with the span of event times it can hold.
+
+    An export holds events from its high-water mark (minus the late-arrival
+    re-read) until it was written, which is usually within its hour but can
+    run into the next day after missed runs.
+    """
+    sources = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f"{SOURCE_PREFIX}/"):
+        for obj in page.get("Contents", []):
+            match = SOURCE_KEY_PATTERN.search(obj["Key"])
+            if not match:
+                continue
+            hour = datetime(*map(int, match.groups()))
+            sources.append({
+                "key": obj["Key"],
+                "first_day": (hour - timedelta(milliseconds=LATE_ARRIVAL_MS)).date(),
+                "last_day": obj["LastModified"].date()
+            })
+    sources.sort(key=lambda source: source["key"])
+    return sources
+
+
+def sources_for(day, sources):
+    return [source for source in sources if source["first_day"] <= day <= source["last_day"]]
+
+
+def completed_days(sources, checkpoint, manifest):
+    """Days with exports whose events can no longer arrive, oldest first"""
+    if checkpoint is None:
+        return []
+    complete_before = datetime.utcfromtimestamp((checkpoint["timestamp"] - LATE_ARRIVAL_MS) / 1000)
+    days = set()
+    for source in sources:
+        day = source["first_day"]
+        while day <= source["last_day"]:
+            days.add(day)
+            day += timedelta(days=1)
+    return sorted(
+        day for day in days
+        if datetime.combine(day + timedelta(days=1), datetime.min.time()) <= complete_before
+        and day.isoformat() not in manifest["days"]
+    )
+
+
+def iter_day_rows(day, sources):
+    """Rows of the sources whose utc_time falls on day, first copy of each event only"""
+    prefix = day.isoformat()
+    seen = set()
+    duplicates = 0
+    for source in sources:
+        reader = csv.reader(open_text_lines(s3, BUCKET, source["key"]))
+        next(reader, None)  # header
+        for row in reader:
+            if len(row) != len(CSV_HEADER) or not row[0].startswith(prefix):
+                continue
+            identity = "\x1f".join(row[i] for i in IDENTITY_INDEXES).encode("utf-8")
+            digest = hashlib.blake2b(identity, digest_size=12).digest()
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            yield row
+    metrics.add("DuplicateRows", duplicates)
+
+
+def write_day(day, rows, generation):
+    """Write a day's rows as Parquet files of about TARGET_FILE_BYTES each.
+
+    Returns [{"key", "rows", "bytes"}] for the files written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    files = []
+    state = {"out": None, "writer": None}
+
+    def close():
+        if state["writer"] is not None:
+            state["writer"].close()
+            state["out"].close()
+            files[-1]["bytes"] = state["out"].bytes_written
+            state["out"] = state["writer"] = None
+
+    def flush(columns):
+        if state["writer"] is None:
+            key = f"{COMPACTED_PREFIX}/data/event_date={day.isoformat()}/{generation}-{len(files):04d}.parquet"
+            state["out"] = S3MultipartWriter(s3, BUCKET, key)
+            state["writer"] = pq.ParquetWriter(state["out"], schema, compression="snappy",
+                                               use_dictionary=["src_host", "logtype"])
+            files.append({"key": key, "rows": 0, "bytes": 0})
+        state["writer"].write_table(pa.table(columns, schema=schema))
+        files[-1]["rows"] += len(columns["utc_time"])
+        if state["out"].bytes_written >= TARGET_FILE_BYTES:
+            close()
+
+    try:
+        columns = {name: [] for name in CSV_HEADER}
+        for row in rows:
+            record = parquet_record(row)
+            for name in CSV_HEADER:
+                columns[name].append(record[name])
+            if len(columns["utc_time"]) >= ROW_GROUP_ROWS:
+                flush(columns)
+                columns = {name: [] for name in CSV_HEADER}
+        if columns["utc_time"]:
+            flush(columns)
+        close()
+    except Exception:
+        if state["out"] is not None:
+            state["out"].abort()
+        raise
+    return files
+
+
+def list_keys(prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    return [obj["Key"] for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix) for obj in page.get("Contents", [])]
+
+
+def delete_keys(keys):
+    """Delete keys in DeleteObjects batches; returns how many were deleted"""
+    deleted = 0
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        chunk = keys[i:i + DELETE_BATCH_SIZE]
+        response = s3.delete_objects(Bucket=BUCKET, Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True})
+        for error in response.get("Errors", []):
+            print(f"⚠️ Could not delete {error['Key']}: {error.get('Message')}")
+        deleted += len(chunk) - len(response.get("Errors", []))
+    return deleted
+
+
+def compact_day(day, sources, manifest, generation):
+    """Compact one day and swap it in.
+
+    The symlink manifest Athena reads is replaced with a single PUT, so
+    queries see either the previous generation or the whole new one. Files
+    of earlier generations, and of attempts that died before their swap,
+    are retired rather than deleted straight away.
+    """
+    day_sources = sources_for(day, sources)
+    files = write_day(day, iter_day_rows(day, day_sources), generation)
+    rows = sum(f["rows"] for f in files)
+
+    symlink = "".join(f"s3://{BUCKET}/{f['key']}\n" for f in files)
+    s3.put_object(Bucket=BUCKET, Key=f"{COMPACTED_PREFIX}/_symlink/event_date={day.isoformat()}/symlink.txt",
+                  Body=symlink.encode("utf-8"))
+
+    new_keys = {f["key"] for f in files}
+    stale = [k for k in list_keys(f"{COMPACTED_PREFIX}/data/event_date={day.isoformat()}/") if k not in new_keys]
+    now = time.time()
+    manifest["retired"].extend({"key": key, "retired_at": now} for key in stale)
+    manifest["days"][day.isoformat()] = {
+        "files": files,
+        "rows": rows,
+        "sources": [source["key"] for source in day_sources],
+        "generation": generation,
+        "compacted_at": now
+    }
+    save_manifest(manifest)
+
+    metrics.add("SourceFiles", len(day_sources))
+    metrics.add("OutputFiles", len(files))
+    metrics.add("Rows", rows)
+    print(f"✅ Compacted {len(day_sources)} exports into {len(files)} files ({rows} rows) for {day.isoformat()}")
+
+
+def load_glue_processed():
+    """s3:// paths the clean_vpc_logs Glue job has processed, or None if unknown"""
+    if not GLUE_MANIFEST_PATH:
+        return None
+    bucket, _, key = GLUE_MANIFEST_PATH[len("s3://"):].partition("/")
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return set()
+    return set(json.loads(body)["processed_files"])
+
+
+def expire(sources, manifest):
+    """Delete retired generations, and exports both compacted long enough
+    ago and already read by the Glue job"""
+    now = time.time()
+    expired = [r for r in manifest["retired"] if now - r["retired_at"] >= RETIRED_GRACE_SECONDS]
+
+    processed = load_glue_processed()
+    if processed is None:
+        print("⚠️ GLUE_MANIFEST_PATH not set; keeping every hourly export")
+        processed = set()
+    retain_after = now - SOURCE_RETENTION_DAYS * 86400
+    old_sources = []
+    unread = 0
+    for source in sources:
+        day = source["first_day"]
+        while day <= source["last_day"]:
+            compacted = manifest["days"].get(day.isoformat())
+            if compacted is None or compacted["compacted_at"] > retain_after:
+                break
+            day += timedelta(days=1)
+        else:
+            if f"s3://{BUCKET}/{source['key']}" in processed:
+                old_sources.append(source["key"])
+            else:
+                unread += 1
+
+    if unread:
+        print(f"⚠️ Keeping {unread} compacted exports the Glue job has not processed yet")
+    metrics.add("UnreadExports", unread)
+    deleted = delete_keys([r["key"] for r in expired] + old_sources)
+    if expired:
+        expired_keys = {r["key"] for r in expired}
+        manifest["retired"] = [r for r in manifest["retired"] if r["key"] not in expired_keys]
+        save_manifest(manifest)
+    metrics.add("DeletedObjects", deleted)
+
+
+@metrics.handler
+def lambda_handler(event=None, context=None):
+    """Compact newly completed days; {"days": ["YYYY-MM-DD"]} recompacts those days"""
+    with metrics.stage("List"):
+        manifest = load_json(MANIFEST_KEY, {"days": {}, "retired": []})
+        checkpoint = load_json(CHECKPOINT_KEY, None)
+        sources = list_sources()
+
+    requested = [date.fromisoformat(day) for day in (event or {}).get("days", [])]
+    listed = {source["key"] for source in sources}
+    for day in list(requested):
+        missing = set(manifest["days"].get(day.isoformat(), {}).get("sources", [])) - listed
+        if missing:
+            # Recompacting without them would drop their rows from the day
+            print(f"⚠️ Not recompacting {day.isoformat()}: {len(missing)} of its exports have expired")
+            requested.remove(day)
+    if requested:
+        days = requested[:MAX_DAYS_PER_RUN]
+    elif (event or {}).get("days"):
+        days = []
+    else:
+        days = completed_days(sources, checkpoint, manifest)[:MAX_DAYS_PER_RUN]
+    if not days:
+        print("⚠️ No completed days to compact.")
+
+    generation = int(time.time() * 1000)
+    with metrics.stage("Compact"):
+        for day in days:
+            compact_day(day, sources, manifest, generation)
+    metrics.add("CompactedDays", len(days))
+
+    with metrics.stage("Expire"):
+        expire(sources, manifest)
@@ -1,29 +1,171 @@
 # Import required AWS SDK and JSON library
+import io
 import json
-import boto3
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+from aws_clients import lazy
+from awslogs_decoder import EVENT_FIELDS, is_envelope, iter_envelope_events, iter_export_events
+from metrics import Metrics
+from s3_stream import open_decompressed
+from threat_model import ThreatModel, trailing_history
+
+# Created on first use, once per container, and shared by the worker threads
+s3 = lazy('s3')
+dynamodb = lazy('dynamodb')
+
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics('S3Ingest')
+
+# train.py's model.onnx, scored in-process; None stores rows unscored
+threat_model = ThreatModel.from_env()
+
+# DynamoDB table (hash key event_id) the scored rows are written to
+RESULTS_TABLE = os.environ.get('RESULTS_TABLE')
+
+# Objects processed at once; each holds at most one batch in memory
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '4'))
+
+# Rows parsed, scored and written together
+BATCH_ROWS = int(os.environ.get('BATCH_ROWS', '500'))
+
+# DynamoDB accepts at most 25 puts per batch_write_item
+DYNAMODB_BATCH_SIZE = 25
+DYNAMODB_MAX_ATTEMPTS = 8
+DYNAMODB_BACKOFF_BASE = 0.05
+
+# Stored as numbers whether they came from JSON or CSV
+NUMERIC_FIELDS = ('dst_port', 'logtype')
+
+
+def to_item(bucket, key, line_no, event, score):
+    """DynamoDB item for one event; the id is stable so reprocessing overwrites"""
+    item = {
+        'event_id': {'S': f"{bucket}/{key}#{line_no}"},
+        'source': {'S': f"s3://{bucket}/{key}"}
+    }
+    for field in EVENT_FIELDS:
+        value = event.get(field)
+        if value is None or value == '':
+            continue
+        if field in NUMERIC_FIELDS:
+            try:
+                item[field] = {'N': str(int(value))}
+                continue
+            except (TypeError, ValueError):
+                pass
+        item[field] = {'S': str(value)}
+    if score is not None and not math.isnan(score):
+        item['threat_score'] = {'N': f"{score:.6f}"}
+    return item
+
+
+def batch_write_items(dynamodb_client, table, items):
+    """Write items 25 at a time, retrying UnprocessedItems with jittered backoff"""
+    for i in range(0, len(items), DYNAMODB_BATCH_SIZE):
+        requests = {table: [{'PutRequest': {'Item': item}} for item in items[i:i + DYNAMODB_BATCH_SIZE]]}
+        for attempt in range(DYNAMODB_MAX_ATTEMPTS):
+            response = dynamodb_client.batch_write_item(RequestItems=requests)
+            requests = response.get('UnprocessedItems') or {}
+            if not requests:
+                break
+            delay = DYNAMODB_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(delay)
+        else:
+            unprocessed = sum(len(r) for r in requests.values())
+            raise RuntimeError(f"{unprocessed} items still unprocessed after {DYNAMODB_MAX_ATTEMPTS} attempts")
+
+
+def process_object(s3_client, dynamodb_client, bucket, key, table, model=None, batch_rows=BATCH_ROWS):
+    """Stream one object through parse -> score -> write in fixed-size batches.
+
+    Only one batch of rows is held at a time, so memory does not grow with
+    the object size. Returns the number of rows written. Each batch is
+    scored with the object's earlier rows from the model's training window,
+    so per-source features do not restart at every batch.
+    """
+    written = 0
+    batch = []
+    history = []
+
+    def flush():
+        nonlocal history
+        scores = None
+        if model is not None:
+            events = [(None, event) for _, event in batch]
+            with metrics.stage('Score'):
+                scores = model.score(events, history=history)
+                history = trailing_history(history + events)
+        if scores is None:
+            scores = [None] * len(batch)
+        items = [to_item(bucket, key, line_no, event, score) for (line_no, event), score in zip(batch, scores)]
+        with metrics.stage('Write'):
+            batch_write_items(dynamodb_client, table, items)
+        metrics.add('Events', len(items))
+        return len(items)
+
+    with open_decompressed(s3_client, bucket, key) as raw:
+        # Firehose delivers the CloudWatch Logs subscription as envelopes;
+        # exports and the exporter's CSV are one event per line
+        if is_envelope(raw.peek(64)):
+            events = iter_envelope_events(raw)
+        else:
+            events = iter_export_events(io.TextIOWrapper(raw, encoding='utf-8', errors='replace', newline=''), key)
+        for line_no, event in events:
+            batch.append((line_no, event))
+            if len(batch) >= batch_rows:
+                written += flush()
+                batch = []
+        if batch:
+            written += flush()
+    return written
+
 
 # AWS Lambda handler function that processes S3 events
+@metrics.handler
 def lambda_handler(event, context):
-    # Log the incoming event for debugging
-    print("Event received:", json.dumps(event))
+    if not RESULTS_TABLE:
+        # Every batch write would fail; fail the invocation instead of each object
+        raise RuntimeError("RESULTS_TABLE is not set")
 
-    # Extract S3 bucket and key information from the event
-    record = event['Records'][0]
-    bucket = record['s3']['bucket']['name']
-    key    = record['s3']['object']['key']
+    records = [
+        (record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']))
+        for record in event.get('Records', [])
+        if 's3' in record
+    ]
+    metrics.add('Bytes', sum(r['s3']['object'].get('size', 0) for r in event.get('Records', []) if 's3' in r), 'Bytes')
+    print(f"Processing {len(records)} S3 objects")
 
-    # Initialize S3 client and retrieve object
-    s3 = boto3.client('s3')
-    response = s3.get_object(Bucket=bucket, Key=key)
-    body = response['Body'].read()
+    def process(record):
+        bucket, key = record
+        try:
+            # Download, decompress and parse run interleaved with scoring and writing
+            with metrics.stage('Object'):
+                rows = process_object(s3, dynamodb, bucket, key, RESULTS_TABLE, threat_model)
+            print(f"Wrote {rows} rows from s3://{bucket}/{key}")
+            return key, rows, None
+        except Exception as e:
+            print(f"Error processing s3://{bucket}/{key}: {str(e)}")
+            return key, 0, str(e)
 
-    # Print first 500 bytes of file content for debugging
-    print("File content:", body[:500])  # Truncated preview
+    # Every record in the event, several objects at a time
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = list(pool.map(process, records))
 
-    # You'd invoke SageMaker and write to DynamoDB here next
+    failed = {key: error for key, _, error in results if error}
+    metrics.add('Errors', len(failed))
+    rows = sum(n for _, n, _ in results)
 
-    # Return success response
+    # Return success response; 207 when some objects failed so they can be retried
     return {
-        'statusCode': 200,
-        'body': 'Processed'
+        'statusCode': 207 if failed else 200,
+        'body': json.dumps({
+            'objects': len(records),
+            'rows_written': rows,
+            'failed': failed
+        })
     }
@@ -1,82 +1,359 @@
-import boto3
-import gzip
-import csv
+import heapq
+import itertools
 import json
 import os
+import queue
+import threading
 from datetime import datetime, timedelta
-from io import BytesIO, StringIO
+from aws_clients import lazy
+from metrics import Metrics
+from s3_stream import S3MultipartWriter, write_csv_gz
 
-logs = boto3.client("logs")
-s3 = boto3.client("s3")
+# Built on first use, so a cold start pays only for the clients it touches
+logs = lazy("logs")
+s3 = lazy("s3")
+
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics("HoneypotExport")
 
 LOG_GROUP = "/darktracer/honeypot/opencanary"
 BUCKET = os.environ.get("BUCKET_NAME", "darktracer-logs-dev")
 PREFIX = os.environ.get("BUCKET_PREFIX", "honeypot")
 
-def lambda_handler(event=None, context=None):
-    now = datetime.utcnow()
-    end_time = int(now.timestamp() * 1000)
-    start_time = int((now - timedelta(minutes=30)).timestamp() * 1000)
+# "csv" keeps the gzip CSV layout; "parquet" writes typed, Hive-partitioned files
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "csv").lower()
+PARQUET_PREFIX = os.environ.get("PARQUET_PREFIX", "honeypot_parquet")
+
+# OpenCanary utc_time, e.g. 2025-04-25 12:00:00.123456
+UTC_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# High-water mark of the last export, kept outside the honeypot/ prefix
+CHECKPOINT_KEY = os.environ.get("CHECKPOINT_KEY", "checkpoints/honeypot-to-csv.json")
+
+# Lookback for the very first run, before any checkpoint exists
+INITIAL_LOOKBACK_MINUTES = 30
+
+# Events can land in CloudWatch slightly out of order, so each run re-reads
+# this much before the high-water mark and drops event IDs already exported
+LATE_ARRIVAL_MS = int(os.environ.get("LATE_ARRIVAL_SECONDS", "120")) * 1000
+
+CSV_HEADER = [
+    "utc_time",
+    "src_host",
+    "src_port",
+    "dst_host",
+    "dst_port",
+    "logtype",
+    "node_id",
+    "username",
+    "password"
+]
+
+# Log streams read at once, one fetch thread each; groups of this many
+# streams are merged one after another
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "4"))
+
+# filter_log_events pages (up to 1 MB each) fetched ahead per log stream;
+# with MAX_WORKERS and the open gzip/multipart part this bounds the
+# export's memory
+PREFETCH_PAGES = int(os.environ.get("PREFETCH_PAGES", "2"))
+
+# Rows buffered per Parquet partition before it is written out as a file
+PARQUET_FLUSH_ROWS = int(os.environ.get("PARQUET_FLUSH_ROWS", "200000"))
+
+
+def load_checkpoint():
+    """Return the saved high-water mark, or None on the first run"""
+    try:
+        body = s3.get_object(Bucket=BUCKET, Key=CHECKPOINT_KEY)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+
+def save_checkpoint(checkpoint):
+    s3.put_object(Bucket=BUCKET, Key=CHECKPOINT_KEY, Body=json.dumps(checkpoint).encode("utf-8"))
 
-    print(f"📅 Fetching logs from {LOG_GROUP} from {start_time} to {end_time}")
 
-    response = logs.filter_log_events(
+def list_log_streams(start_time):
+    """Names of log streams that may hold events at or after start_time"""
+    streams = []
+    paginator = logs.get_paginator("describe_log_streams")
+    for page in paginator.paginate(logGroupName=LOG_GROUP):
+        for stream in page.get("logStreams", []):
+            # An event can't be ingested before it happened, so streams whose
+            # last ingestion predates the window have nothing new
+            if stream.get("lastIngestionTime", start_time) >= start_time:
+                streams.append(stream["logStreamName"])
+    return streams
+
+
+def iter_stream_pages(stream_name, start_time, end_time):
+    """Follow nextToken until the stream's events in the window are exhausted"""
+    paginator = logs.get_paginator("filter_log_events")
+    for page in paginator.paginate(
         logGroupName=LOG_GROUP,
+        logStreamNames=[stream_name],
         startTime=start_time,
-        endTime=end_time,
-        limit=10000
+        endTime=end_time
+    ):
+        yield page.get("events", [])
+
+
+def prefetched(pages, depth=PREFETCH_PAGES):
+    """Yield the events of pages, fetched on a background thread at most depth pages ahead"""
+    pending = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for page in pages:
+                while not stop.is_set():
+                    try:
+                        pending.put(page, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            pending.put(done)
+        except Exception as e:
+            pending.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            page = pending.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield from page
+    finally:
+        # Lets the producer exit if the consumer gives up early
+        stop.set()
+
+
+def merge_streams(names, start_time, end_time):
+    """The streams' events in (timestamp, eventId) order, each stream
+    fetched on its own thread a few pages ahead of the merge"""
+    return heapq.merge(
+        *(prefetched(iter_stream_pages(name, start_time, end_time)) for name in names),
+        key=lambda e: (e["timestamp"], e["eventId"])
     )
 
-    events = response.get("events", [])
 
-    if not events:
-        print("⚠️ No logs found in time window.")
-        return
+def fetch_new_events(start_time, end_time, seen_ids, max_workers=MAX_WORKERS):
+    """Every stream's events, minus the events exported by earlier runs.
 
-    # Prepare CSV with new columns
-    csv_buffer = StringIO()
-    writer = csv.writer(csv_buffer)
-    writer.writerow([
-        "utc_time",
-        "src_host",
-        "src_port",
-        "dst_host",
-        "dst_port",
-        "logtype",
-        "node_id",
-        "username",
-        "password"
-    ])
+    Streams are read max_workers at a time and each group is merged into
+    timestamp order, so nothing is collected or sorted as a whole and at
+    most max_workers * PREFETCH_PAGES pages are held whatever the number of
+    streams. With more streams than max_workers the output is ordered
+    within each group; the writers and the checkpoint do not depend on a
+    global order.
+    """
+    streams = list_log_streams(start_time)
+    groups = [streams[i:i + max_workers] for i in range(0, len(streams), max_workers)]
+    # Each group's threads only start once the previous group is drained
+    merged = itertools.chain.from_iterable(merge_streams(group, start_time, end_time) for group in groups)
+    return (e for e in merged if e["eventId"] not in seen_ids)
+
+
+class ExportProgress:
+    """Counts events as they stream past and builds the next checkpoint.
+
+    Only event IDs inside the late-arrival window of the running high-water
+    mark are kept, so this stays small however many events are exported.
+    """
+
+    def __init__(self, checkpoint):
+        self.high_water = checkpoint["timestamp"]
+        self.event_ids = dict(checkpoint["event_ids"])
+        self.events = 0
+        self.bytes = 0
+
+    def track(self, events):
+        for event in events:
+            self.events += 1
+            self.bytes += len(event["message"])
+            self.high_water = max(self.high_water, event["timestamp"])
+            self.event_ids[event["eventId"]] = event["timestamp"]
+            if len(self.event_ids) >= 20000 and self.events % 10000 == 0:
+                self._prune()
+            yield event
+
+    def _prune(self):
+        floor = self.high_water - LATE_ARRIVAL_MS
+        self.event_ids = {eid: ts for eid, ts in self.event_ids.items() if ts >= floor}
 
+    def checkpoint(self):
+        """Advance the high-water mark, keeping IDs still inside the late-arrival window"""
+        self._prune()
+        return {"timestamp": self.high_water, "event_ids": self.event_ids}
+
+
+def iter_csv_rows(events):
+    """Yield one CSV row per parseable OpenCanary event"""
     for event in events:
         try:
             # Parse the JSON message
             log_data = json.loads(event["message"])
-            
-            # Extract values, using get() to handle missing fields safely
-            writer.writerow([
-                log_data.get("utc_time", ""),
-                log_data.get("src_host", ""),
-                log_data.get("src_port", ""),
-                log_data.get("dst_host", ""),
-                log_data.get("dst_port", ""),
-                log_data.get("logtype", ""),
-                log_data.get("node_id", ""),
-                log_data.get("logdata", {}).get("USERNAME", ""),
-                log_data.get("logdata", {}).get("PASSWORD", "")
-            ])
         except json.JSONDecodeError:
             print(f"⚠️ Failed to parse JSON from log: {event['message']}")
+            metrics.add("ParseErrors")
             continue
 
-    # Compress CSV
-    gz_buffer = BytesIO()
-    with gzip.GzipFile(mode="w", fileobj=gz_buffer) as gz_file:
-        gz_file.write(csv_buffer.getvalue().encode("utf-8"))
+        # Extract values, using get() to handle missing fields safely
+        logdata = log_data.get("logdata", {})
+        yield [
+            log_data.get("utc_time", ""),
+            log_data.get("src_host", ""),
+            log_data.get("src_port", ""),
+            log_data.get("dst_host", ""),
+            log_data.get("dst_port", ""),
+            log_data.get("logtype", ""),
+            log_data.get("node_id", ""),
+            logdata.get("USERNAME", ""),
+            logdata.get("PASSWORD", "")
+        ]
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_timestamp(value):
+    try:
+        return datetime.strptime(value, UTC_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def parquet_schema():
+    """Typed Parquet schema for CSV_HEADER rows"""
+    # pyarrow is only needed for Parquet output (e.g. via the AWS SDK for pandas layer)
+    import pyarrow as pa
+
+    return pa.schema([
+        ("utc_time", pa.timestamp("us")),
+        ("src_host", pa.string()),
+        ("src_port", pa.int32()),
+        ("dst_host", pa.string()),
+        ("dst_port", pa.int32()),
+        ("logtype", pa.int32()),
+        ("node_id", pa.string()),
+        ("username", pa.string()),
+        ("password", pa.string())
+    ])
+
+
+INT_COLUMNS = {"src_port", "dst_port", "logtype"}
+
+
+def parquet_record(row):
+    """CSV_HEADER row -> dict of typed values, with empty strings as None"""
+    record = dict(zip(CSV_HEADER, row))
+    for name in INT_COLUMNS:
+        record[name] = _to_int(record[name])
+    record["utc_time"] = _to_timestamp(record["utc_time"])
+    return {name: (value if value != "" else None) for name, value in record.items()}
+
+
+def write_parquet_partitions(rows, run_id, flush_rows=PARQUET_FLUSH_ROWS):
+    """Write typed Parquet files under Hive-style year=/month=/day=/hour= partitions.
+
+    Rows are grouped by the hour of their utc_time, and every file is named
+    after run_id so repeated runs add files instead of overwriting them.
+    Rows arrive in time order, so a partition is written out as soon as a
+    later hour starts, or once it holds flush_rows rows; late rows for an
+    hour already written go to a numbered extra file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    partitions = {}
+    files = {}
+    keys = []
+
+    def flush(partition):
+        columns = partitions.pop(partition)
+        n = files.get(partition, 0)
+        files[partition] = n + 1
+        suffix = f"-{n}" if n else ""
+        key = f"{PARQUET_PREFIX}/{partition}/honeypot-opencanary-logs-{run_id}{suffix}.parquet"
+        table = pa.table(columns, schema=schema)
+        with S3MultipartWriter(s3, BUCKET, key) as out:
+            pq.write_table(table, out, compression="snappy", use_dictionary=["src_host", "logtype"])
+        keys.append(key)
+
+    for row in rows:
+        record = parquet_record(row)
+        hour = record["utc_time"] or datetime.utcfromtimestamp(run_id / 1000)
+        partition = hour.strftime("year=%Y/month=%m/day=%d/hour=%H")
+        for older in [p for p in partitions if p < partition]:
+            flush(older)
+        columns = partitions.setdefault(partition, {n: [] for n in CSV_HEADER})
+        for name in CSV_HEADER:
+            columns[name].append(record[name])
+        if len(columns["utc_time"]) >= flush_rows:
+            flush(partition)
+
+    for partition in sorted(partitions):
+        flush(partition)
+    return keys
+
+
+@metrics.handler
+def lambda_handler(event=None, context=None):
+    now = datetime.utcnow()
+    end_time = int(now.timestamp() * 1000)
+
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        start_time = int((now - timedelta(minutes=INITIAL_LOOKBACK_MINUTES)).timestamp() * 1000)
+        checkpoint = {"timestamp": start_time, "event_ids": {}}
+    else:
+        start_time = checkpoint["timestamp"] - LATE_ARRIVAL_MS
+
+    print(f"📅 Fetching logs from {LOG_GROUP} from {start_time} to {end_time}")
+
+    progress = ExportProgress(checkpoint)
+    # Events stream from CloudWatch straight into the upload, so Fetch only
+    # covers the first page and Write covers fetch, parse and upload
+    with metrics.stage("Fetch"):
+        events = progress.track(fetch_new_events(start_time, end_time, checkpoint["event_ids"]))
+        first = next(events, None)
+
+    if first is None:
+        print("⚠️ No new logs since last export.")
+        return
+    events = itertools.chain([first], events)
+
+    if OUTPUT_FORMAT == "parquet":
+        with metrics.stage("Write"):
+            keys = write_parquet_partitions(iter_csv_rows(events), checkpoint["timestamp"])
+        print(f"✅ Uploaded {progress.events} log events to {len(keys)} Parquet files under s3://{BUCKET}/{PARQUET_PREFIX}/")
+    else:
+        # Define dynamic S3 path. Path and name both come from the previous
+        # high-water mark, so a run retried before its checkpoint was saved
+        # rewrites the same object instead of duplicating it, and later runs
+        # never overwrite it.
+        time_path = datetime.utcfromtimestamp(checkpoint["timestamp"] / 1000).strftime("%Y/%m/%d/%H")
+        key = f"{PREFIX}/{time_path}/honeypot-opencanary-logs-{checkpoint['timestamp']}.csv.gz"
+
+        # Rows are gzip'd and uploaded in parts as they are produced
+        with metrics.stage("Write"):
+            rows = write_csv_gz(s3, BUCKET, key, CSV_HEADER, iter_csv_rows(events))
+        print(f"✅ Uploaded {rows} log events to s3://{BUCKET}/{key}")
 
-    # Define dynamic S3 path
-    time_path = now.strftime("%Y/%m/%d/%H")
-    key = f"{PREFIX}/{time_path}/honeypot-opencanary-logs.csv.gz"
+    metrics.add("Events", progress.events)
+    metrics.add("Bytes", progress.bytes, "Bytes")
 
-    s3.put_object(Bucket=BUCKET, Key=key, Body=gz_buffer.getvalue())
-    print(f"✅ Uploaded {len(events)} log events to s3://{BUCKET}/{key}")
+    # Only advance the high-water mark once the export is safely in S3
+    save_checkpoint(progress.checkpoint())
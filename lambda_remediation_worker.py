@@ -0,0 +1,232 @@
+import json
+import math
+import os
+import time
+from aws_clients import RateLimiter, ThrottledClient, lazy
+from metrics import Metrics
+from remediation_queue import ALERT, BLOCK, CLOSE_PORTS, parse_records, port_number
+from waf_blocklist import Blocklist, host_network
+
+# Control-plane calls per second, per container, shared by every IP set,
+# security group and topic; well under the account-level API limits
+WAF_CALLS_PER_SECOND = float(os.environ.get('WAF_CALLS_PER_SECOND', '5'))
+EC2_CALLS_PER_SECOND = float(os.environ.get('EC2_CALLS_PER_SECOND', '10'))
+SNS_CALLS_PER_SECOND = float(os.environ.get('SNS_CALLS_PER_SECOND', '10'))
+
+waf_client = ThrottledClient(lazy('wafv2'), RateLimiter(WAF_CALLS_PER_SECOND))
+ec2_client = ThrottledClient(lazy('ec2'), RateLimiter(EC2_CALLS_PER_SECOND))
+sns_client = ThrottledClient(lazy('sns'), RateLimiter(SNS_CALLS_PER_SECOND))
+
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics('RemediationWorker')
+
+# Expiring, CIDR-collapsed blocks over the IP sets in WAF_IP_SET_IDS; the
+# index stays warm so already-blocked sources cost no WAF call
+blocklist = Blocklist.from_env(waf_client)
+
+# Seconds a warm container may reuse the honeypot SG IpPermissions snapshot
+SG_SNAPSHOT_TTL = int(os.environ.get('SG_SNAPSHOT_TTL', '60'))
+
+_sg_snapshot = {
+    'group_id': None,
+    'permissions': None,
+    'fetched_at': 0.0
+}
+
+# SNS accepts at most 10 entries per publish_batch
+SNS_BATCH_SIZE = 10
+
+
+@metrics.handler
+def handler(event, context):
+    return process_batch(event)
+
+
+def process_batch(event, metrics=metrics):
+    """Apply a batch of remediation intents from the queue.
+
+    Duplicate intents are coalesced first: every IP is blocked in one
+    blocklist update, every port of a group closed with one revoke call and
+    digests for the same attack group merged into one alert. Only messages
+    whose own work failed are reported back, so SQS redelivers just those.
+    """
+    intents, failed = parse_records(event)
+    metrics.add('Intents', len(intents))
+
+    blocks = {}
+    ports = {}
+    alerts = {}
+    requested = 0
+    for message_id, intent in intents:
+        action = intent.get('action')
+        if action == BLOCK:
+            requested += len(intent.get('ips', []))
+            for ip in intent.get('ips', []):
+                blocks.setdefault(ip, set()).add(message_id)
+        elif action == CLOSE_PORTS:
+            requested += len(intent.get('ports', []))
+            for port in intent.get('ports', []):
+                ports.setdefault((intent.get('group_id'), port), set()).add(message_id)
+        elif action == ALERT:
+            requested += 1
+            _merge_alert(alerts, intent, message_id)
+        else:
+            # Retrying cannot make an unknown intent valid; drop it
+            print(f"Ignoring unknown remediation intent {action!r}")
+    metrics.add('CoalescedIntents', requested - len(blocks) - len(ports) - len(alerts))
+
+    if blocks:
+        with metrics.stage('WAF'):
+            blocked_ips = blocklist.block(list(blocks))
+        for ip, message_ids in blocks.items():
+            # Sources WAF's IPv4 sets cannot hold are never going to succeed
+            if ip not in blocked_ips and host_network(ip) is not None:
+                failed |= message_ids
+        metrics.add('RemediatedSources', len(blocked_ips))
+
+    closed = {}
+    if ports:
+        by_group = {}
+        for group_id, port in ports:
+            by_group.setdefault(group_id, set()).add(port)
+        with metrics.stage('SG'):
+            for group_id, group_ports in by_group.items():
+                closed[group_id] = close_ports_in_security_group(group_id, group_ports)
+        for (group_id, port), message_ids in ports.items():
+            if port_number(port) is not None and port_number(port) not in closed[group_id]:
+                failed |= message_ids
+
+    if alerts:
+        for alert in alerts.values():
+            digest = alert['digest']
+            group_id, port = alert['group_id'], port_number(digest.get('port_attacked'))
+            digest['actions_taken'] = {
+                'waf_blocked': blocklist.is_blocked(digest.get('ip_address')),
+                'port_closed': bool(group_id) and (port in closed.get(group_id, ()) or port_is_closed(group_id, port))
+            }
+        with metrics.stage('SNS'):
+            failed_alerts = publish_alert_digests(sns_client, list(alerts.values()))
+        for alert in failed_alerts:
+            failed |= alert['message_ids']
+
+    metrics.add('FailedIntents', len(failed))
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed)]}
+
+
+def _merge_alert(alerts, intent, message_id):
+    """Fold a digest into any other digest for the same attack group"""
+    digest = intent.get('digest') or {}
+    key = (digest.get('ip_address'), digest.get('port_attacked'), digest.get('logtype'))
+    alert = alerts.get(key)
+    if alert is None:
+        alerts[key] = {'digest': dict(digest), 'group_id': intent.get('group_id'), 'message_ids': {message_id}}
+        return
+    merged = alert['digest']
+    merged['count'] = merged.get('count', 0) + digest.get('count', 0)
+    merged['first_seen'] = min(merged['first_seen'], digest['first_seen'])
+    merged['last_seen'] = max(merged['last_seen'], digest['last_seen'])
+    scores = [s for s in (merged.get('threat_score'), digest.get('threat_score')) if s is not None and not math.isnan(s)]
+    merged['threat_score'] = max(scores) if scores else None
+    alert['message_ids'].add(message_id)
+
+
+def get_security_group_permissions(security_group_id, max_age=SG_SNAPSHOT_TTL):
+    """Return the SG IpPermissions, reusing the warm snapshot while it is fresh"""
+    if (_sg_snapshot['group_id'] == security_group_id and
+            _sg_snapshot['permissions'] is not None and
+            time.time() - _sg_snapshot['fetched_at'] < max_age):
+        return _sg_snapshot['permissions']
+
+    response = ec2_client.describe_security_groups(GroupIds=[security_group_id])
+    _sg_snapshot['group_id'] = security_group_id
+    _sg_snapshot['permissions'] = response['SecurityGroups'][0]['IpPermissions']
+    _sg_snapshot['fetched_at'] = time.time()
+    return _sg_snapshot['permissions']
+
+
+def _port_rules(permissions, ports):
+    """The single-port tcp ingress rules for any of ports"""
+    return [
+        perm for perm in permissions
+        if perm.get('IpProtocol') == 'tcp' and perm.get('FromPort') in ports and perm.get('FromPort') == perm.get('ToPort')
+    ]
+
+
+def port_is_closed(security_group_id, port):
+    """True if the SG snapshot has no tcp ingress rule left for port"""
+    if port is None:
+        return False
+    try:
+        return not _port_rules(get_security_group_permissions(security_group_id), {port})
+    except Exception as e:
+        print(f"Error reading security group {security_group_id}: {str(e)}")
+        return False
+
+
+def close_ports_in_security_group(security_group_id, ports):
+    """Revoke the tcp ingress rules for every port in one call.
+
+    Returns the set of ports that are closed afterwards, including ports that
+    had no matching rule to begin with.
+    """
+    ports = {p for p in map(port_number, ports) if p is not None}
+    if not ports:
+        return set()
+
+    try:
+        permissions = get_security_group_permissions(security_group_id)
+
+        # Save the full permissions to revoke them properly
+        revoke_permissions = _port_rules(permissions, ports)
+        if not revoke_permissions:
+            return ports
+
+        ec2_client.revoke_security_group_ingress(
+            GroupId=security_group_id,
+            IpPermissions=revoke_permissions
+        )
+
+        # Keep the snapshot in step so repeat hits cost no API calls
+        _sg_snapshot['permissions'] = [p for p in permissions if p not in revoke_permissions]
+        revoked = sorted(p['FromPort'] for p in revoke_permissions)
+        print(f"Successfully closed ports {revoked} in security group {security_group_id}")
+        return ports
+
+    except Exception as e:
+        # The snapshot may be stale, refetch on the next batch
+        _sg_snapshot['permissions'] = None
+        print(f"Error closing ports {sorted(ports)}: {str(e)}")
+        return set()
+
+
+def publish_alert_digests(sns_client, alerts):
+    """Publish digests to SNS in publish_batch calls of up to 10 entries.
+
+    Returns the alerts that could not be published.
+    """
+    published = 0
+    failed_alerts = []
+    for i in range(0, len(alerts), SNS_BATCH_SIZE):
+        chunk = alerts[i:i + SNS_BATCH_SIZE]
+        entries = [{
+            'Id': str(n),
+            'Subject': 'Security Alert - Attack Detected',
+            'Message': json.dumps(alert['digest'], indent=2)
+        } for n, alert in enumerate(chunk)]
+
+        try:
+            response = sns_client.publish_batch(
+                TopicArn=os.environ['SNS_TOPIC_ARN'],
+                PublishBatchRequestEntries=entries
+            )
+            failed = [int(f['Id']) for f in response.get('Failed', [])]
+        except Exception as e:
+            print(f"Error publishing to SNS: {str(e)}")
+            failed = list(range(len(chunk)))
+
+        failed_alerts.extend(chunk[n] for n in failed)
+        published += len(chunk) - len(failed)
+
+    if published:
+        print(f"Successfully published {published} SNS alert digests")
+    return failed_alerts
@@ -1,68 +1,132 @@
 import json
-import boto3
+import math
 import os
+import time
 from datetime import datetime
-import base64
-import gzip
-import ipaddress
+from functools import partial
+from awslogs_decoder import iter_honeypot_events
+from ip_classifier import IPClassifier, KNOWN_BAD, SKIP_REMEDIATION
+from metrics import Metrics
+from rate_detector import RateDetector
+from remediation_queue import (ALERT, REMEDIATION_QUEUE_URL, LocalQueue, SQSQueue,
+                               alert_intent, block_intents, close_port_intents)
+from threat_model import ThreatModel
 
-# Initialize AWS clients
-waf_client = boto3.client('wafv2')
-sns_client = boto3.client('sns')
-ec2_client = boto3.client('ec2')
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics('ThreatAnalyzer')
 
+# Private ranges, allowlisted lab/VPC hosts and known-bad feeds, built once
+ip_index = IPClassifier.from_env()
+
+# Sliding-window counts per source and (source, port); only sources that
+# cross a rate or distinct-port threshold are remediated
+rate_detector = RateDetector.from_env()
+
+# train.py's model.onnx, scored in-process; None remediates every event
+threat_model = ThreatModel.from_env()
+THREAT_THRESHOLD = float(os.environ.get('THREAT_THRESHOLD', '0.8'))
+
+# WAF, EC2 and SNS calls are made by lambda_remediation_worker from the
+# intents queued here, so a slow or throttled API never holds up ingest.
+# Without a queue the worker runs in-process, its timings in this record.
+if REMEDIATION_QUEUE_URL:
+    remediation_queue = SQSQueue(REMEDIATION_QUEUE_URL)
+else:
+    from lambda_remediation_worker import process_batch
+    remediation_queue = LocalQueue(partial(process_batch, metrics=metrics))
+
+# Findings for the same (src_host, dst_port, logtype) inside this window are
+# folded into one digest
+ALERT_WINDOW_SECONDS = int(os.environ.get('ALERT_WINDOW_SECONDS', '300'))
+
+# Warm-container alert state keyed by (src_host, dst_port, logtype)
+_alert_groups = {}
+
+@metrics.handler
 def handler(event, context):
     try:
+        processed_ips = []
         if 'awslogs' in event:
-            compressed_payload = base64.b64decode(event['awslogs']['data'])
-            uncompressed_payload = gzip.decompress(compressed_payload)
-            log_data = json.loads(uncompressed_payload)
-            
-            for log_event in log_data['logEvents']:
-                try:
-                    honeypot_data = json.loads(log_event['message'])
+            # Decode the whole batch first so remediation is queued once per invocation.
+            # The decoder streams the gzip and keeps only the fields we use.
+            attacks = []
+            metrics.add('Bytes', len(event['awslogs']['data']), 'Bytes')
+            with metrics.stage('Decode'):
+                for seen_at, honeypot_data in iter_honeypot_events(event['awslogs']['data']):
+                    attacks.append((seen_at, honeypot_data))
                     src_host = honeypot_data.get('src_host')
-                    dst_port = honeypot_data.get('dst_port')
-                    
-                    ip_set_update_success = update_ip_set(waf_client, src_host, os.environ.get('IP_SET_ID'))
-
-                    print(f"Processing attack from {src_host} on port {dst_port}")
-                    
-                    # Get security group ID from environment
-                    security_group_id = os.environ.get('SECURITY_GROUP_ID')
-                    if not security_group_id:
-                        print("WARNING: No security group ID provided in environment variables")
-                    
-                    # Close port if specified
-                    port_closed = False
-                    if dst_port and security_group_id:
-                        print(f"Attempting to close port {dst_port}")
-                        port_closed = close_port_in_security_group(security_group_id, dst_port)
-                    
-                        
-                        # Prepare notification data
-                        message_data = {
-                            'timestamp': datetime.utcnow().isoformat(),
-                            'ip_address': src_host,
-                            'port_attacked': dst_port,
-                            'attack_details': honeypot_data,
-                            'actions_taken': {
-                                'waf_blocked': ip_set_update_success,
-                                'port_closed': bool(dst_port and port_closed)
-                            }
-                        }
-                        
-                        # Send notification
-                        publish_to_sns(sns_client, message_data)
-                        
-                        # Log the details
-                        print(f"Attack Details:")
-                        print(f"Source IP: {src_host}")
-                        print(f"Target Port: {dst_port}")
-                        
-                except json.JSONDecodeError:
-                    continue
-        
+                    if src_host and src_host not in processed_ips:
+                        processed_ips.append(src_host)
+            metrics.add('Events', len(attacks))
+
+            # Drop internal, allowlisted and unparseable sources before any remediation
+            with metrics.stage('Classify'):
+                labels = dict(zip(processed_ips, ip_index.classify_many(processed_ips)))
+            skipped_ips = [ip for ip in processed_ips if labels[ip] in SKIP_REMEDIATION]
+            if skipped_ips:
+                print(f"Skipping remediation for {len(skipped_ips)} internal or allowlisted sources")
+                processed_ips = [ip for ip in processed_ips if labels[ip] not in SKIP_REMEDIATION]
+                attacks = [a for a in attacks if labels.get(a[1].get('src_host')) not in SKIP_REMEDIATION]
+
+            # Count every event that could be acted on, before the model narrows them
+            with metrics.stage('Rate'):
+                hot_sources, hot_pairs = rate_detector.observe(attacks)
+
+            # Score the whole batch in one onnxruntime call and only act on
+            # events at or above THREAT_THRESHOLD (NaN, i.e. unscorable, still acts)
+            with metrics.stage('Score'):
+                scores = threat_model.score(attacks) if threat_model is not None else None
+            if scores is None:
+                scores = [None] * len(attacks)
+            else:
+                scored = [(a, s) for a, s in zip(attacks, scores) if not s < THREAT_THRESHOLD]
+                print(f"{len(scored)} of {len(attacks)} events scored at or above {THREAT_THRESHOLD}")
+                attacks = [a for a, _ in scored]
+                scores = [float(s) for _, s in scored]
+                threat_ips = {a.get('src_host') for _, a in attacks}
+                processed_ips = [ip for ip in processed_ips if ip in threat_ips]
+
+            # A single stray connection is not worth a WAF or EC2 call; only
+            # sources over the rate thresholds are remediated, known-bad ones at once
+            acted = [
+                i for i, (_, a) in enumerate(attacks)
+                if labels.get(a.get('src_host')) == KNOWN_BAD
+                or a.get('src_host') in hot_sources
+                or (a.get('src_host'), a.get('dst_port')) in hot_pairs
+            ]
+            if len(acted) < len(attacks):
+                print(f"{len(acted)} of {len(attacks)} events crossed the rate thresholds")
+            attacks = [attacks[i] for i in acted]
+            scores = [scores[i] for i in acted]
+            acted_ips = {a.get('src_host') for _, a in attacks}
+            processed_ips = [ip for ip in processed_ips if ip in acted_ips]
+
+            intents = block_intents(processed_ips)
+
+            # Get security group ID from environment
+            security_group_id = os.environ.get('SECURITY_GROUP_ID')
+            if not security_group_id:
+                print("WARNING: No security group ID provided in environment variables")
+
+            # Every attacked port, closed by the worker with a single revoke call
+            if security_group_id:
+                attacked_ports = {a.get('dst_port') for _, a in attacks if a.get('dst_port')}
+                intents += close_port_intents(security_group_id, attacked_ports)
+
+                for (seen_at, honeypot_data), score in zip(attacks, scores):
+                    if honeypot_data.get('dst_port'):
+                        record_alert(honeypot_data, seen_at, score)
+
+            # One digest per attack group instead of one email per event
+            intents += [alert_intent(digest, security_group_id) for _, digest in flush_alerts()]
+
+            with metrics.stage('Queue'):
+                unsent = remediation_queue.send(intents)
+            metrics.add('RemediationIntents', len(intents))
+            if unsent:
+                metrics.add('QueueErrors', len(unsent))
+                requeue_alerts([intent['digest'] for intent in unsent if intent['action'] == ALERT])
+
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -73,6 +137,7 @@ def handler(event, context):
             
     except Exception as e:
         print(f"Error in handler: {str(e)}")
+        metrics.add('Errors')
         return {
             'statusCode': 500,
             'body': json.dumps({
@@ -80,88 +145,67 @@ def handler(event, context):
             })
         }
 
-def update_ip_set(waf_client, ip_address, ip_set_id, scope='REGIONAL'):
-    """Update WAF IP set with new malicious IP"""
-    try:
-        # Get current IP set - Update this name to match your Terraform
-        response = waf_client.get_ip_set(
-            Name=f"{os.environ.get('PROJECT_NAME', 'darktracer')}-blocked-ip-set-{os.environ.get('ENV', 'dev')}", # Match your Terraform name
-            Scope=scope,
-            Id=ip_set_id
-        )
-        
-        # Add new IP if not already present
-        addresses = response['IPSet']['Addresses']
-        new_ip = f"{ip_address}/32"
-        if new_ip not in addresses:
-            addresses.append(new_ip)
-            
-            # Update IP set - Use same name here
-            waf_client.update_ip_set(
-                Name=f"{os.environ.get('PROJECT_NAME', 'darktracer')}-blocked-ip-set-{os.environ.get('ENV', 'dev')}", # Match your Terraform name
-                Scope=scope,
-                Id=ip_set_id,
-                Addresses=addresses,
-                LockToken=response['LockToken']
-            )
-            print(f"Successfully added IP {ip_address} to WAF blocklist")
-            return True
-        return False
-    except Exception as e:
-        print(f"Error updating WAF IP set: {str(e)}")
-        return False
-
+def record_alert(honeypot_data, seen_at, score=None):
+    """Fold a finding into the (src_host, dst_port, logtype) alert group"""
+    key = (honeypot_data.get('src_host'), honeypot_data.get('dst_port'), honeypot_data.get('logtype'))
+    seen_at = seen_at / 1000.0 if seen_at else time.time()
 
-def close_port_in_security_group(security_group_id, port):
-    try:
-        response = ec2_client.describe_security_groups(GroupIds=[security_group_id])
-        permissions = response['SecurityGroups'][0]['IpPermissions']
-
-        revoke_permissions = []
-        for perm in permissions:
-            if (perm.get('FromPort') == int(port) and 
-                perm.get('ToPort') == int(port) and 
-                perm.get('IpProtocol') == 'tcp'):
-
-                # Save the full permission to revoke it properly
-                revoke_permissions.append(perm)
+    group = _alert_groups.get(key)
+    if group is None:
+        group = _alert_groups[key] = {
+            'pending': 0,
+            'first_seen': seen_at,
+            'last_seen': seen_at,
+            'notified_at': None,
+            'threat_score': None
+        }
+    if group['pending'] == 0:
+        group['first_seen'] = seen_at
+        group['threat_score'] = None
+    group['pending'] += 1
+    group['first_seen'] = min(group['first_seen'], seen_at)
+    group['last_seen'] = max(group['last_seen'], seen_at)
+    if score is not None and not math.isnan(score):
+        group['threat_score'] = max(score, group['threat_score'] or 0.0)
 
-        if not revoke_permissions:
-            print(f"No matching rule found for port {port} in security group {security_group_id}")
-            return True
 
-        ec2_client.revoke_security_group_ingress(
-            GroupId=security_group_id,
-            IpPermissions=revoke_permissions
-        )
-        print(f"Successfully closed port {port} in security group {security_group_id}")
-        return True
+def flush_alerts(now=None):
+    """Return digests for groups whose window allows another notification.
 
-    except Exception as e:
-        print(f"Error closing port {port}: {str(e)}")
-        return False
+    Findings arriving within ALERT_WINDOW_SECONDS of the last digest for a
+    group stay pending and are reported, with their count, in the next one.
+    """
+    now = now or time.time()
+    digests = []
+    for key, group in list(_alert_groups.items()):
+        window_open = group['notified_at'] is None or now - group['notified_at'] >= ALERT_WINDOW_SECONDS
+        if group['pending'] and window_open:
+            src_host, dst_port, logtype = key
+            digests.append((key, {
+                'timestamp': datetime.utcnow().isoformat(),
+                'ip_address': src_host,
+                'port_attacked': dst_port,
+                'logtype': logtype,
+                'count': group['pending'],
+                'first_seen': datetime.utcfromtimestamp(group['first_seen']).isoformat(),
+                'last_seen': datetime.utcfromtimestamp(group['last_seen']).isoformat(),
+                'threat_score': group['threat_score']
+            }))
+            group['notified_at'] = now
+            group['pending'] = 0
+        elif not group['pending'] and now - group['notified_at'] >= ALERT_WINDOW_SECONDS:
+            # Quiet group, drop it so the warm state stays bounded. Judged by
+            # when we notified, not by event time, so delayed or replayed
+            # logs cannot end a group's throttle window early
+            del _alert_groups[key]
+    return digests
 
 
-
-def publish_to_sns(sns_client, message_data):
-    """Publish threat notification to SNS"""
-    try:
-        sns_client.publish(
-            TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Subject='Security Alert - Attack Detected',
-            Message=json.dumps(message_data, indent=2)
-        )
-        print("Successfully published SNS notification")
-        return True
-    except Exception as e:
-        print(f"Error publishing to SNS: {str(e)}")
-        return False
-# New Code V3
-def is_internal_ip(ip):
-    """Check if IP is internal"""
-    ip_obj = ipaddress.ip_address(ip)
-    return any([
-        ip_obj in ipaddress.ip_network('10.0.0.0/8'),
-        ip_obj in ipaddress.ip_network('172.16.0.0/12'),
-        ip_obj in ipaddress.ip_network('192.168.0.0/16')
-    ])
+def requeue_alerts(digests):
+    """Put digests that never reached the queue back so the next invocation retries them"""
+    for digest in digests:
+        key = (digest['ip_address'], digest['port_attacked'], digest['logtype'])
+        group = _alert_groups.get(key)
+        if group is not None:
+            group['pending'] += digest['count']
+            group['notified_at'] = None
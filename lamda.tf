@@ -92,6 +92,19 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "${aws_s3_bucket.log_archive.arn}/*"
         ]
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:BatchWriteItem"
+        ],
+        Resource = aws_dynamodb_table.honeypot_events.arn
+      },
+      {
+        # Scoring model for the S3 ingest stage
+        Effect   = "Allow",
+        Action   = ["s3:GetObject"],
+        Resource = "arn:aws:s3:::${var.model_bucket}/${var.model_key}"
+      },
       {
         Effect = "Allow",
         Action = [
@@ -103,6 +116,49 @@ resource "aws_iam_role_policy" "lambda_policy" {
   })
 }
 
+# Scored events written by lambda_function.py; event_id is
+# "<bucket>/<key>#<line>" so reprocessing an object overwrites its items
+resource "aws_dynamodb_table" "honeypot_events" {
+  name         = "${var.project_name}-honeypot-events-${terraform.workspace}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "event_id"
+
+  attribute {
+    name = "event_id"
+    type = "S"
+  }
+}
+
+# ----------------------------------------------------------
+#            S3 Ingest Configuration
+# ----------------------------------------------------------
+# Purpose: Parse, score and store every .gz object that lands
+# in the log archive (trigger in s3_event.tf)
+# ----------------------------------------------------------
+
+resource "aws_lambda_function" "s3_ingest" {
+  filename      = "lambda_function.zip"
+  function_name = "${var.project_name}-s3-ingest-${terraform.workspace}"
+  role          = aws_iam_role.lambda_exec_role.arn
+  handler       = "lambda_function.lambda_handler"
+  runtime       = "python3.12"
+  timeout       = 300
+  memory_size   = 1024
+
+  # numpy, pandas and onnxruntime for in-process model scoring
+  layers = var.threat_analyzer_layers
+
+  environment {
+    variables = {
+      RESULTS_TABLE = aws_dynamodb_table.honeypot_events.name
+      MODEL_BUCKET  = var.model_bucket
+      MODEL_KEY     = var.model_key
+      MAX_WORKERS   = "4"
+      BATCH_ROWS    = "500"
+    }
+  }
+}
+
 
 
 # ----------------------------------------------------------
@@ -123,19 +179,108 @@ resource "aws_lambda_function" "lambda_threat_analyzer" {
   timeout       = 30
   memory_size   = 512
 
+  # numpy, pandas and onnxruntime for in-process model scoring
+  layers = var.threat_analyzer_layers
+
   environment {
     variables = {
       PROJECT_NAME            = var.project_name
       ENV                     = terraform.workspace
-      WAF_IP_SET_ID           = aws_wafv2_ip_set.blocked_ips.id
-      SNS_TOPIC_ARN           = aws_sns_topic.threat_alerts.id
+      REMEDIATION_QUEUE_URL   = aws_sqs_queue.remediation.url
       SECURITY_GROUP_ID       = aws_security_group.honeypot_sg.id
       THREAT_THRESHOLD        = "0.8"
-      SAGEMAKER_ENDPOINT_NAME = "darktracer-threat-endpoint"
+      MODEL_BUCKET            = var.model_bucket
+      MODEL_KEY               = var.model_key
+      ALERT_WINDOW_SECONDS    = "300"
+      ALLOWLIST_CIDRS         = join(",", [aws_vpc.main.cidr_block, "${aws_instance.kali.public_ip}/32"])
+      RATE_STATE_TABLE        = aws_dynamodb_table.rate_state.name
+      RATE_WINDOW_SECONDS     = "60"
+      SOURCE_RATE_THRESHOLD   = "20"
+      PORT_RATE_THRESHOLD     = "10"
+      DISTINCT_PORT_THRESHOLD = "5"
+    }
+  }
+}
+
+# Sliding-window sketch slots shared by every analyzer container; one
+# item per window slot, expired by DynamoDB once it leaves the window
+resource "aws_dynamodb_table" "rate_state" {
+  name         = "${var.project_name}-rate-state-${terraform.workspace}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "slot"
+
+  attribute {
+    name = "slot"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# ----------------------------------------------------------
+#            Remediation Worker Configuration
+# ----------------------------------------------------------
+# Purpose: Apply the analyzer's WAF, security group and SNS
+# intents off the ingest path, retrying only failed items
+# ----------------------------------------------------------
+
+resource "aws_sqs_queue" "remediation_dlq" {
+  name                      = "${var.project_name}-remediation-dlq-${terraform.workspace}"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "remediation" {
+  name                       = "${var.project_name}-remediation-${terraform.workspace}"
+  visibility_timeout_seconds = 360 # 6x the worker timeout, as Lambda recommends
+  message_retention_seconds  = 86400
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.remediation_dlq.arn
+    maxReceiveCount     = 5
+  })
+}
+
+resource "aws_lambda_function" "remediation_worker" {
+  filename      = "lambda_threat_analyzer.zip" # Same package as the analyzer
+  function_name = "${var.project_name}-remediation-worker-${terraform.workspace}"
+  role          = aws_iam_role.lambda_role.arn
+  handler       = "lambda_remediation_worker.handler"
+  runtime       = "python3.12"
+  timeout       = 60
+  memory_size   = 256
+
+  environment {
+    variables = {
+      PROJECT_NAME         = var.project_name
+      ENV                  = terraform.workspace
+      WAF_IP_SET_IDS       = join(",", concat([aws_wafv2_ip_set.blocked_ips.id], aws_wafv2_ip_set.blocked_ips_overflow[*].id))
+      WAF_IP_SET_NAMES     = join(",", concat([aws_wafv2_ip_set.blocked_ips.name], aws_wafv2_ip_set.blocked_ips_overflow[*].name))
+      BLOCKLIST_TABLE      = aws_dynamodb_table.waf_blocklist.name
+      BLOCK_TTL_SECONDS    = "604800"
+      SNS_TOPIC_ARN        = aws_sns_topic.threat_alerts.id
+      WAF_CALLS_PER_SECOND = "5"
+      EC2_CALLS_PER_SECOND = "10"
+      SNS_CALLS_PER_SECOND = "10"
     }
   }
 }
 
+resource "aws_lambda_event_source_mapping" "remediation_worker" {
+  event_source_arn                   = aws_sqs_queue.remediation.arn
+  function_name                      = aws_lambda_function.remediation_worker.arn
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 5
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  # Two pollers at most, so IP set LockToken races and API throttling stay rare
+  scaling_config {
+    maximum_concurrency = 2
+  }
+}
+
 
 # ----------------------------------------------------------
 #            Lambda Permissions Configuration
@@ -194,16 +339,55 @@ resource "aws_lambda_function" "summarize_logs" {
   #----------------------------------------------------------
   # Environment Variables
   # - TRAINING_LOG_BUCKET: References existing S3 bucket from s3.tf
+  # - CLEAN_LOG_BUCKET / LOG_KEY: The log the chatbot answers from
   # - MODEL_ID: Bedrock model identifier for text processing
+  # - CONTEXT_TOKEN_BUDGET: Cap on index slices inlined per question
+  # - ANSWER_CACHE_TABLE: Shared answer memoization table
   #----------------------------------------------------------
   environment {
     variables = {
-      TRAINING_LOG_BUCKET = aws_s3_bucket.training_bucket.id # Reference to existing training bucket
-      MODEL_ID            = "anthropic.claude-v2"            # Bedrock model identifier
+      TRAINING_LOG_BUCKET  = aws_s3_bucket.training_bucket.id # Reference to existing training bucket
+      CLEAN_LOG_BUCKET     = aws_s3_bucket.cleaned_logs.bucket
+      LOG_KEY              = var.chatbot_log_key
+      MODEL_ID             = "anthropic.claude-v2"            # Bedrock model identifier
+      CONTEXT_TOKEN_BUDGET = "3000"                           # Log context per prompt, in estimated tokens
+      ANSWER_CACHE_TABLE   = aws_dynamodb_table.chatbot_answers.name
+      ANSWER_CACHE_TTL     = "3600"
     }
   }
 }
 
+# Rebuilds index/<LOG_KEY>.json.gz whenever the chatbot's log is rewritten,
+# so questions are answered from a fresh index instead of a rebuild on the
+# first request after each upload
+resource "aws_lambda_function" "log_indexer" {
+  function_name = "${var.project_name}-log-indexer-${terraform.workspace}"
+  role          = aws_iam_role.bedrock_lambda_role.arn
+  handler       = "log_index.lambda_handler"
+  filename      = "chatbot_lambda.zip"
+  runtime       = "python3.12"
+  timeout       = 300
+  memory_size   = 512
+}
+
+# Answers shared by every chatbot container, keyed on the normalized
+# question plus the log ETag; DynamoDB expires them via expires_at
+resource "aws_dynamodb_table" "chatbot_answers" {
+  name         = "${var.project_name}-chatbot-answers-${terraform.workspace}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "cache_key"
+
+  attribute {
+    name = "cache_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
 # ===========================================================
 #                     Athena Unload Lambda Function
 # Purpose: Unloads Athena query results to S3 training bucket
@@ -222,9 +406,11 @@ resource "aws_lambda_function" "athena_unload" {
 
   environment {
     variables = {
-      PROJECT_NAME = var.project_name
-      ENVIRONMENT  = terraform.workspace
-      ATHENA_TABLE = "honeypot_logs"
+      PROJECT_NAME           = var.project_name
+      ENVIRONMENT            = terraform.workspace
+      ATHENA_TABLE           = "honeypot_logs"
+      UNLOAD_MODE            = "incremental"
+      MAX_CONCURRENT_QUERIES = "5"
     }
   }
 }
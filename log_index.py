@@ -0,0 +1,255 @@
+import gzip
+import heapq
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import unquote_plus
+
+from aws_clients import client
+from awslogs_decoder import iter_export_events
+from metrics import Metrics
+from s3_stream import text_lines
+
+# Indexes live next to the logs they describe: index/<log key>.json.gz
+INDEX_PREFIX = os.environ.get('INDEX_PREFIX', 'index/')
+
+# Fields with a posting list; each term keeps counts of the others as context
+INDEXED_FIELDS = ('src_host', 'dst_port', 'logtype', 'username')
+
+# Entries kept in every top-N list of the index
+TOP_N = 10
+
+# Stage timings and counts, one EMF record per invocation
+metrics = Metrics('LogIndex')
+
+_WORD = re.compile(r"[\w.@:-]+")
+_DATE_HOUR = re.compile(r"\b(\d{4}-\d{2}-\d{2})(?:(?:[ T]|\s+at\s+)(\d{2})(?::\d{2})?)?\b")
+
+
+def index_key(log_key):
+    return f"{INDEX_PREFIX}{log_key}.json.gz"
+
+
+def _hour_of(utc_time):
+    """'2025-04-01 13' from an OpenCanary utc_time, or None"""
+    if not utc_time or len(utc_time) < 13:
+        return None
+    return utc_time[:13].replace('T', ' ')
+
+
+def _top(counter, n=TOP_N):
+    return [[value, count] for value, count in counter.most_common(n)]
+
+
+class IndexBuilder:
+    """Single pass over log events into per-hour aggregates and posting lists"""
+
+    def __init__(self):
+        self.events = 0
+        self.hours = defaultdict(lambda: {'events': 0, **{field: Counter() for field in INDEXED_FIELDS}})
+        self.terms = {field: {} for field in INDEXED_FIELDS}
+
+    def add(self, event):
+        self.events += 1
+        utc_time = event.get('utc_time')
+        hour = _hour_of(utc_time) or 'unknown'
+        values = {}
+        for field in INDEXED_FIELDS:
+            value = event.get(field)
+            if value is not None and value != '':
+                values[field] = str(value)
+
+        aggregate = self.hours[hour]
+        aggregate['events'] += 1
+        for field, value in values.items():
+            aggregate[field][value] += 1
+
+            term = self.terms[field].get(value)
+            if term is None:
+                term = self.terms[field][value] = {
+                    'count': 0,
+                    'first_seen': utc_time,
+                    'last_seen': utc_time,
+                    'hours': Counter(),
+                    'related': {other: Counter() for other in INDEXED_FIELDS if other != field}
+                }
+            term['count'] += 1
+            term['hours'][hour] += 1
+            if utc_time:
+                term['first_seen'] = min(term['first_seen'] or utc_time, utc_time)
+                term['last_seen'] = max(term['last_seen'] or utc_time, utc_time)
+            for other, counter in term['related'].items():
+                if other in values:
+                    counter[values[other]] += 1
+
+    def finish(self, source):
+        """JSON-ready index; every list is trimmed to TOP_N"""
+        return {
+            'source': source,
+            'built_at': datetime.utcnow().isoformat(),
+            'events': self.events,
+            'distinct': {field: len(terms) for field, terms in self.terms.items()},
+            'top': {
+                field: [[value, term['count']] for value, term in heapq.nlargest(TOP_N, terms.items(), key=lambda t: t[1]['count'])]
+                for field, terms in self.terms.items()
+            },
+            'hours': {
+                hour: {
+                    'events': aggregate['events'],
+                    'sources': len(aggregate['src_host']),
+                    **{field: _top(aggregate[field]) for field in INDEXED_FIELDS}
+                }
+                for hour, aggregate in sorted(self.hours.items())
+            },
+            'terms': {
+                field: {
+                    value: {
+                        'count': term['count'],
+                        'first_seen': term['first_seen'],
+                        'last_seen': term['last_seen'],
+                        'hours': _top(term['hours']),
+                        'related': {other: _top(counter) for other, counter in term['related'].items()}
+                    }
+                    for value, term in terms.items()
+                }
+                for field, terms in self.terms.items()
+            }
+        }
+
+
+def build_index(s3_client, bucket, key, response=None):
+    """Stream a log object into an index tagged with the object's ETag.
+
+    response may be a get_object response the caller already holds (e.g.
+    from a conditional GET), so the log is not downloaded twice.
+    """
+    if response is None:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    builder = IndexBuilder()
+    with text_lines(response['Body'], key) as lines:
+        for _, event in iter_export_events(lines, key):
+            builder.add(event)
+    return builder.finish({'bucket': bucket, 'key': key, 'etag': response['ETag']})
+
+
+def save_index(s3_client, bucket, index):
+    body = gzip.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=index_key(index['source']['key']),
+        Body=body,
+        ContentType='application/json',
+        ContentEncoding='gzip',
+        Metadata={'source-etag': index['source']['etag']}
+    )
+
+
+def load_index(s3_client, bucket, key):
+    """The stored index for a log key, or None"""
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=index_key(key))['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(gzip.decompress(body))
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+def _pairs(pairs):
+    return ', '.join(f"{value} ({count})" for value, count in pairs) or 'none'
+
+
+def _overview(index):
+    source = index['source']
+    hours = [h for h in index['hours'] if h != 'unknown']
+    span = f"{hours[0]}:00 to {hours[-1]}:59 UTC" if hours else "an unknown time range"
+    lines = [f"Log s3://{source['bucket']}/{source['key']}: {index['events']} events from "
+             f"{index['distinct']['src_host']} sources over {span}."]
+    for field in INDEXED_FIELDS:
+        lines.append(f"Top {field}: {_pairs(index['top'][field])}")
+    return '\n'.join(lines)
+
+
+def _term_section(field, value, term):
+    lines = [f"{field} {value}: {term['count']} events, first {term['first_seen']}, last {term['last_seen']}."]
+    for other, pairs in term['related'].items():
+        lines.append(f"  {other}: {_pairs(pairs)}")
+    lines.append(f"  busiest hours: {_pairs(term['hours'])}")
+    return '\n'.join(lines)
+
+
+def _hour_section(hour, aggregate):
+    lines = [f"Hour {hour}:00 UTC: {aggregate['events']} events from {aggregate['sources']} sources."]
+    for field in INDEXED_FIELDS:
+        lines.append(f"  {field}: {_pairs(aggregate[field])}")
+    return '\n'.join(lines)
+
+
+def match_question(index, question):
+    """Indexed terms and hours the question mentions"""
+    words = [w.strip('.:-') for w in _WORD.findall(question)]
+    tokens = set(words) | {w.lower() for w in words}
+    terms = [
+        (field, token)
+        for field in INDEXED_FIELDS
+        for token in sorted(tokens)
+        if token in index['terms'][field]
+    ]
+
+    hours = []
+    for date, hour in _DATE_HOUR.findall(question):
+        prefix = f"{date} {hour}" if hour else date
+        hours.extend(h for h in index['hours'] if h.startswith(prefix) and h not in hours)
+    return terms, hours
+
+
+def build_context(index, question, token_budget):
+    """The overview plus the slices relevant to the question, within token_budget.
+
+    Sections are added in priority order (overview, mentioned terms,
+    mentioned hours, then the most recent hours) and any section that
+    would overflow the budget is skipped. Returns (context, tokens used).
+    """
+    terms, hours = match_question(index, question)
+    if not hours:
+        # Nothing time-specific asked: the latest activity is most relevant
+        hours = [h for h in reversed(list(index['hours'])) if h != 'unknown']
+
+    sections = [_overview(index)]
+    sections += [_term_section(field, value, index['terms'][field][value]) for field, value in terms]
+    sections += [_hour_section(hour, index['hours'][hour]) for hour in hours]
+
+    chosen, used = [], 0
+    for section in sections:
+        cost = estimate_tokens(section)
+        if used + cost > token_budget:
+            continue
+        chosen.append(section)
+        used += cost
+    return '\n\n'.join(chosen), used
+
+
+# S3 ObjectCreated handler: rebuild the index whenever a log object lands
+@metrics.handler
+def lambda_handler(event, context):
+    s3 = client('s3')
+    indexed = []
+    for record in event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key'])
+        if key.startswith(INDEX_PREFIX):
+            continue
+        with metrics.stage('Index'):
+            index = build_index(s3, bucket, key)
+        with metrics.stage('Write'):
+            save_index(s3, bucket, index)
+        metrics.add('Events', index['events'])
+        metrics.add('Bytes', record['s3']['object'].get('size', 0), 'Bytes')
+        print(f"Indexed {index['events']} events from s3://{bucket}/{key}")
+        indexed.append(key)
+    return {'statusCode': 200, 'body': json.dumps({'indexed': indexed})}
@@ -0,0 +1,169 @@
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'DarkTracer')
+
+# Opt-in profiling without a debug build: "cpu", "memory" or "cpu,memory"
+PROFILE = {mode.strip() for mode in os.environ.get('PROFILE', '').lower().split(',') if mode.strip()}
+
+# Local directory, or s3://bucket/prefix so profiles outlive the container
+PROFILE_OUTPUT = os.environ.get('PROFILE_OUTPUT', '/tmp/profiles')
+
+# Rows kept in the text summaries next to each profile
+PROFILE_TOP = 40
+
+
+class Metrics:
+    """Stage timings and counters for one invocation, flushed as a single
+    CloudWatch Embedded Metric Format record.
+
+    Timings from worker threads add up, so a stage run on four threads at
+    once reports the total time spent in it, not the wall-clock time.
+    """
+
+    def __init__(self, service, namespace=METRICS_NAMESPACE):
+        self.service = service
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.cold_start = True
+        self.reset()
+
+    def reset(self):
+        self.values = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, value=1, unit='Count'):
+        with self.lock:
+            total, _ = self.values.get(name, (0, unit))
+            self.values[name] = (total + value, unit)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the block as <name>Time, in milliseconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Time", (time.perf_counter() - start) * 1000, 'Milliseconds')
+
+    def record(self):
+        """The EMF document for everything recorded since the last reset"""
+        elapsed = time.perf_counter() - self.started
+        values = dict(self.values)
+        values['InvocationTime'] = (elapsed * 1000, 'Milliseconds')
+        if 'Events' in values and elapsed > 0:
+            values['EventsPerSecond'] = (values['Events'][0] / elapsed, 'Count/Second')
+        if self.cold_start:
+            values['ColdStart'] = (1, 'Count')
+
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in sorted(values.items())]
+                }]
+            },
+            'Service': self.service,
+            **{name: round(value, 3) for name, (value, _) in values.items()}
+        }
+
+    def flush(self):
+        # CloudWatch Logs turns this one line into metrics; no PutMetricData call
+        print(json.dumps(self.record(), separators=(',', ':')))
+        self.cold_start = False
+        self.reset()
+
+    def handler(self, func):
+        """Decorate a Lambda handler: reset on entry, profile if enabled, flush on exit"""
+        @wraps(func)
+        def wrapper(event, context):
+            self.reset()
+            try:
+                with Profiler(self.service):
+                    return func(event, context)
+            finally:
+                self.flush()
+        return wrapper
+
+
+class Profiler:
+    """cProfile and/or tracemalloc around one invocation, when PROFILE asks for it.
+
+    cProfile only sees the invoking thread; work done in a thread pool
+    shows up as time waiting on the pool.
+    """
+
+    def __init__(self, name, modes=None, output=None):
+        self.name = name
+        self.modes = PROFILE if modes is None else modes
+        self.output = output or PROFILE_OUTPUT
+        self.profile = None
+
+    def __enter__(self):
+        if 'memory' in self.modes:
+            tracemalloc.start()
+        if 'cpu' in self.modes:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.modes:
+            return False
+        if self.profile is not None:
+            self.profile.disable()
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        files = {}
+        # Snapshot before building the CPU report so it does not show up in it
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            snapshot = snapshot.filter_traces([tracemalloc.Filter(False, cProfile.__file__)])
+            lines = [f"current {current} bytes, peak {peak} bytes"]
+            lines += [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP]]
+            files[f"{self.name}-{stamp}-memory.txt"] = '\n'.join(lines).encode('utf-8')
+        if self.profile is not None:
+            summary = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=summary)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            files[f"{self.name}-{stamp}.prof"] = _marshal_stats(stats)
+            files[f"{self.name}-{stamp}-cpu.txt"] = summary.getvalue().encode('utf-8')
+
+        try:
+            write_profiles(self.output, files)
+        except Exception as e:
+            # A profiler must never fail the invocation it is watching
+            print(f"Error writing profiles to {self.output}: {str(e)}")
+        return False
+
+
+def _marshal_stats(stats):
+    """pstats.Stats.dump_stats output as bytes, loadable with pstats or snakeviz"""
+    return marshal.dumps(stats.stats)
+
+
+def write_profiles(output, files):
+    if output.startswith('s3://'):
+        from aws_clients import client
+        bucket, _, prefix = output[len('s3://'):].partition('/')
+        prefix = f"{prefix.rstrip('/')}/" if prefix else ''
+        for name, body in files.items():
+            client('s3').put_object(Bucket=bucket, Key=f"{prefix}{name}", Body=body)
+    else:
+        os.makedirs(output, exist_ok=True)
+        for name, body in files.items():
+            with open(os.path.join(output, name), 'wb') as f:
+                f.write(body)
+    print(f"Wrote {len(files)} profiles to {output}")
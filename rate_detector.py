@@ -0,0 +1,320 @@
+import hashlib
+import math
+import os
+import sys
+import time
+import zlib
+from array import array
+
+from aws_clients import lazy
+from botocore.exceptions import ClientError
+
+# Sliding window split into slots; a slot expires as a whole
+RATE_WINDOW_SECONDS = int(os.environ.get('RATE_WINDOW_SECONDS', '60'))
+RATE_WINDOW_SLOTS = int(os.environ.get('RATE_WINDOW_SLOTS', '6'))
+
+# Count-min sketch shape. Memory is fixed at 3 * depth * width * 4 bytes
+# per slot however many sources are spoofed; accuracy degrades once window
+# events reach a few times width * the thresholds
+SKETCH_WIDTH = int(os.environ.get('SKETCH_WIDTH', '2048'))
+SKETCH_DEPTH = int(os.environ.get('SKETCH_DEPTH', '4'))
+
+# Remediate a source once it crosses either threshold inside the window;
+# a (source, port) pair over PORT_RATE_THRESHOLD closes that port.
+# SOURCE_RATE_THRESHOLD=1 restores acting on the first event
+SOURCE_RATE_THRESHOLD = int(os.environ.get('SOURCE_RATE_THRESHOLD', '20'))
+PORT_RATE_THRESHOLD = int(os.environ.get('PORT_RATE_THRESHOLD', '10'))
+DISTINCT_PORT_THRESHOLD = int(os.environ.get('DISTINCT_PORT_THRESHOLD', '5'))
+
+# Counts must clear a threshold by this many standard deviations of hash
+# collision noise, so a flood that saturates the sketch remediates less, not more
+NOISE_MARGIN = float(os.environ.get('RATE_NOISE_MARGIN', '3'))
+
+# Optional DynamoDB table (hash key slot, TTL on expires_at) shared by
+# every container; without it each warm container counts on its own
+RATE_STATE_TABLE = os.environ.get('RATE_STATE_TABLE')
+RATE_STATE_MAX_ATTEMPTS = 5
+
+# Tables inside each slot
+SOURCES = 0
+PAIRS = 1
+PORTS = 2
+TABLES = 3
+
+
+class SlidingSketch:
+    """Count-min sketches over a sliding window of fixed time slots.
+
+    Three tables share each slot: events per source, events per
+    (source, port) pair, and distinct ports per source, followed by one
+    running total per table. A port counts as distinct the first time its
+    pair is seen in the window.
+
+    Counts are read with the count-mean-min estimator: each row's cell is
+    reduced by the noise expected from other keys hashed into it, and the
+    median row is taken, capped by the plain count-min. Under a spoofed
+    flood the plain minimum grows by about events / width for every key,
+    which would mark every source hot; the debiased estimate does not.
+
+    The clock follows the newest event time observed, so replayed or late
+    batches are counted where they belong, not at the wall-clock time.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH,
+                 window_seconds=RATE_WINDOW_SECONDS, slots=RATE_WINDOW_SLOTS, shared=False):
+        self.width = width
+        self.depth = depth
+        self.slot_seconds = window_seconds / slots
+        self.slot_count = slots
+        self.slots = {}
+        # Increments not yet merged into the shared store, by slot epoch
+        self.shared = shared
+        self.pending = {}
+        self.clock = 0.0
+        self.live = []
+
+    def epoch(self, ts):
+        return int(ts // self.slot_seconds)
+
+    def live_epochs(self):
+        current = self.epoch(self.clock)
+        return range(current - self.slot_count + 1, current + 1)
+
+    def empty_slot(self):
+        return array('I', bytes(4 * (TABLES * self.depth * self.width + TABLES)))
+
+    def _total(self, table):
+        return TABLES * self.depth * self.width + table
+
+    def set_slot(self, epoch, slot):
+        self.slots[epoch] = slot
+        self.live = [self.slots[e] for e in self.live_epochs() if e in self.slots]
+
+    def advance(self, ts):
+        """Move the clock forward and drop slots that left the window"""
+        if ts <= self.clock:
+            return
+        self.clock = ts
+        oldest = self.epoch(self.clock) - self.slot_count + 1
+        for epoch in [e for e in self.slots if e < oldest]:
+            del self.slots[epoch]
+            self.pending.pop(epoch, None)
+        self.live = [self.slots[e] for e in self.live_epochs() if e in self.slots]
+
+    def _cells(self, table, key):
+        # Stable across processes (unlike hash()), so containers' sketches merge
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        base = table * self.depth * self.width
+        return [base + row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def _add(self, epoch, table, cells):
+        slot = self.slots.get(epoch)
+        if slot is None:
+            slot = self.empty_slot()
+            self.set_slot(epoch, slot)
+        cells = cells + [self._total(table)]
+        for cell in cells:
+            slot[cell] += 1
+        if self.shared:
+            pending = self.pending.setdefault(epoch, {})
+            for cell in cells:
+                pending[cell] = pending.get(cell, 0) + 1
+
+    def _estimate(self, table, cells, margin=0.0):
+        """Debiased count, less margin standard deviations of collision noise"""
+        sums = [sum(slot[cell] for slot in self.live) for cell in cells]
+        minimum = min(sums)
+        if self.width < 2 or minimum == 0:
+            return minimum
+        total = sum(slot[self._total(table)] for slot in self.live)
+        debiased = sorted(c - (total - c) / (self.width - 1) for c in sums)
+        middle = len(debiased) // 2
+        median = debiased[middle] if len(debiased) % 2 else (debiased[middle - 1] + debiased[middle]) / 2
+        estimate = max(0.0, min(minimum, median))
+        if margin:
+            # Other keys land in a cell roughly as a Poisson process; the
+            # median of depth rows narrows its spread by about sqrt(depth)
+            estimate -= margin * math.sqrt((total - minimum) / (self.width - 1) / self.depth)
+            # Margins are only asked for keys the caller has just counted, so
+            # the noise allowance never takes one below its first event; a
+            # threshold of 1 then still acts on every event
+            estimate = max(estimate, 1.0)
+        return round(estimate)
+
+    def observe(self, src_host, dst_port, ts):
+        """Count one event; events older than the window are ignored"""
+        self.advance(ts)
+        epoch = self.epoch(ts)
+        if epoch < self.epoch(self.clock) - self.slot_count + 1:
+            return
+        self._add(epoch, SOURCES, self._cells(SOURCES, src_host))
+        if dst_port is not None:
+            pair = self._cells(PAIRS, f"{src_host}|{dst_port}")
+            if self._estimate(PAIRS, pair) < 0.5:
+                self._add(epoch, PORTS, self._cells(PORTS, src_host))
+            self._add(epoch, PAIRS, pair)
+
+    def source_count(self, src_host, margin=0.0):
+        return self._estimate(SOURCES, self._cells(SOURCES, src_host), margin)
+
+    def pair_count(self, src_host, dst_port, margin=0.0):
+        return self._estimate(PAIRS, self._cells(PAIRS, f"{src_host}|{dst_port}"), margin)
+
+    def distinct_ports(self, src_host, margin=0.0):
+        return self._estimate(PORTS, self._cells(PORTS, src_host), margin)
+
+
+def _encode(slot):
+    if sys.byteorder != 'little':
+        slot = array('I', slot)
+        slot.byteswap()
+    # Mostly zeros, so a full slot compresses to a few KiB
+    return zlib.compress(slot.tobytes(), 1)
+
+
+def _decode(data):
+    slot = array('I')
+    slot.frombytes(zlib.decompress(data))
+    if sys.byteorder != 'little':
+        slot.byteswap()
+    return slot
+
+
+class SketchStore:
+    """Shares sketch slots between containers through DynamoDB.
+
+    Each slot is one item holding the compressed counters and a version.
+    A container adds only its own pending increments, with a conditional
+    put on the version it read; on a lost race it rereads and adds again,
+    so concurrent invocations never overwrite each other's counts.
+    """
+
+    def __init__(self, table, dynamodb_client=None, name='honeypot'):
+        self.table = table
+        self.dynamodb = dynamodb_client or lazy('dynamodb')
+        self.name = name
+        # Version of each slot as last read, for the first conditional put
+        self.versions = {}
+
+    def _key(self, epoch):
+        return {'slot': {'S': f"{self.name}#{epoch}"}}
+
+    def _get(self, epoch):
+        item = self.dynamodb.get_item(TableName=self.table, Key=self._key(epoch), ConsistentRead=True).get('Item')
+        if item is None:
+            return None, 0
+        return _decode(item['counts']['B']), int(item['version']['N'])
+
+    def load(self, sketch):
+        """Replace the local view of every live slot with the shared one"""
+        epochs = list(sketch.live_epochs())
+        keys = {f"{self.name}#{e}": e for e in epochs}
+        request = {self.table: {'Keys': [self._key(e) for e in epochs], 'ConsistentRead': True}}
+        while request:
+            response = self.dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(self.table, []):
+                epoch = keys[item['slot']['S']]
+                if epoch not in sketch.pending:
+                    sketch.set_slot(epoch, _decode(item['counts']['B']))
+                    self.versions[epoch] = int(item['version']['N'])
+            request = response.get('UnprocessedKeys') or None
+
+    def save(self, sketch):
+        """Merge pending increments into the shared slots.
+
+        The first attempt trusts the version load() saw, so an uncontended
+        slot costs a single write; only a lost race rereads it.
+        """
+        expires_at = int(time.time() + 2 * sketch.slot_seconds * sketch.slot_count)
+        live = set(sketch.live_epochs())
+        for epoch in [e for e in self.versions if e not in live]:
+            del self.versions[epoch]
+        for epoch, pending in list(sketch.pending.items()):
+            merged, version = sketch.slots[epoch], self.versions.get(epoch, 0)
+            for attempt in range(RATE_STATE_MAX_ATTEMPTS):
+                if attempt:
+                    shared, version = self._get(epoch)
+                    merged = shared if shared is not None else sketch.empty_slot()
+                    for cell, count in pending.items():
+                        merged[cell] += count
+                if version == 0:
+                    condition = {'ConditionExpression': 'attribute_not_exists(#slot)',
+                                 'ExpressionAttributeNames': {'#slot': 'slot'}}
+                else:
+                    condition = {'ConditionExpression': '#version = :v',
+                                 'ExpressionAttributeNames': {'#version': 'version'},
+                                 'ExpressionAttributeValues': {':v': {'N': str(version)}}}
+                try:
+                    self.dynamodb.put_item(TableName=self.table, Item={
+                        **self._key(epoch),
+                        'counts': {'B': _encode(merged)},
+                        'version': {'N': str(version + 1)},
+                        'expires_at': {'N': str(expires_at)}
+                    }, **condition)
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    continue
+                sketch.set_slot(epoch, merged)
+                self.versions[epoch] = version + 1
+                del sketch.pending[epoch]
+                break
+            else:
+                print(f"Giving up merging rate slot {epoch} after {RATE_STATE_MAX_ATTEMPTS} attempts")
+
+
+class RateDetector:
+    """Decides which honeypot sources and ports have earned remediation"""
+
+    def __init__(self, sketch=None, store=None, source_threshold=SOURCE_RATE_THRESHOLD,
+                 port_threshold=PORT_RATE_THRESHOLD, distinct_port_threshold=DISTINCT_PORT_THRESHOLD):
+        self.sketch = sketch or SlidingSketch(shared=store is not None)
+        self.store = store
+        self.source_threshold = source_threshold
+        self.port_threshold = port_threshold
+        self.distinct_port_threshold = distinct_port_threshold
+
+    @classmethod
+    def from_env(cls):
+        """Thresholds from the environment, shared through RATE_STATE_TABLE when set"""
+        return cls(store=SketchStore(RATE_STATE_TABLE) if RATE_STATE_TABLE else None)
+
+    def observe(self, attacks, now=None):
+        """Count a batch of (timestamp ms, event) and return (hot sources, hot pairs).
+
+        A source is hot once its events or distinct ports in the window
+        cross a threshold; a (source, port) pair once its own events do.
+        Shared state is read in one batch before counting and written once
+        afterwards, one conditional put per slot the batch touched.
+        """
+        now = now or time.time()
+        if self.store is not None:
+            self.sketch.advance(now)
+            try:
+                self.store.load(self.sketch)
+            except Exception as e:
+                print(f"Error loading shared rate state: {str(e)}")
+
+        for seen_at, event in attacks:
+            src_host = event.get('src_host')
+            if src_host:
+                self.sketch.observe(src_host, event.get('dst_port'), seen_at / 1000 if seen_at else now)
+
+        if self.store is not None:
+            try:
+                self.store.save(self.sketch)
+            except Exception as e:
+                print(f"Error saving shared rate state: {str(e)}")
+
+        sources = {event.get('src_host') for _, event in attacks if event.get('src_host')}
+        hot_sources = {
+            src for src in sources
+            if self.sketch.source_count(src, NOISE_MARGIN) >= self.source_threshold
+            or self.sketch.distinct_ports(src, NOISE_MARGIN) >= self.distinct_port_threshold
+        }
+        pairs = {(event.get('src_host'), event.get('dst_port')) for _, event in attacks
+                 if event.get('src_host') and event.get('dst_port') is not None}
+        hot_pairs = {pair for pair in pairs if self.sketch.pair_count(*pair, margin=NOISE_MARGIN) >= self.port_threshold}
+        return hot_sources, hot_pairs
@@ -0,0 +1,156 @@
+import json
+import os
+import random
+import time
+import uuid
+
+from aws_clients import lazy
+
+# SQS queue the threat analyzer hands remediation to; without it intents are
+# applied in-process through a LocalQueue, as before the queue existed
+REMEDIATION_QUEUE_URL = os.environ.get('REMEDIATION_QUEUE_URL')
+
+# Messages per batch handed to the worker; matches the event source mapping
+REMEDIATION_BATCH_SIZE = int(os.environ.get('REMEDIATION_BATCH_SIZE', '100'))
+
+# Deliveries before a message is given up on, like the queue's redrive policy
+MAX_RECEIVES = int(os.environ.get('REMEDIATION_MAX_RECEIVES', '5'))
+
+# SendMessageBatch takes at most 10 entries
+SQS_BATCH_SIZE = 10
+
+# IPs or ports per intent; 10 full intents stay well under the 256 KB batch limit
+INTENT_CHUNK = 500
+
+SEND_MAX_ATTEMPTS = 3
+SEND_BACKOFF_BASE = 0.1
+
+BLOCK = 'block'
+CLOSE_PORTS = 'close_ports'
+ALERT = 'alert'
+
+
+def port_number(port):
+    """Return the port as an int, or None for values like '' or -1"""
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        return None
+    return port if 0 <= port <= 65535 else None
+
+
+def block_intents(ips):
+    ips = sorted({ip for ip in ips if ip})
+    return [{'action': BLOCK, 'ips': ips[i:i + INTENT_CHUNK]} for i in range(0, len(ips), INTENT_CHUNK)]
+
+
+def close_port_intents(group_id, ports):
+    ports = sorted({p for p in map(port_number, ports) if p is not None})
+    return [{'action': CLOSE_PORTS, 'group_id': group_id, 'ports': ports[i:i + INTENT_CHUNK]}
+            for i in range(0, len(ports), INTENT_CHUNK)]
+
+
+def alert_intent(digest, group_id=None):
+    """One alert digest; the worker fills in actions_taken when it publishes"""
+    return {'action': ALERT, 'group_id': group_id, 'digest': digest}
+
+
+def parse_records(event):
+    """SQS event -> ([(message_id, intent)], {message ids whose body is unreadable})"""
+    intents, failed = [], set()
+    for record in event.get('Records', []):
+        try:
+            intents.append((record['messageId'], json.loads(record['body'])))
+        except (KeyError, ValueError) as e:
+            print(f"Unreadable remediation message {record.get('messageId')}: {str(e)}")
+            if 'messageId' in record:
+                failed.add(record['messageId'])
+    return intents, failed
+
+
+class SQSQueue:
+    """Remediation intents sent to SQS, ten per SendMessageBatch call"""
+
+    def __init__(self, url, sqs_client=None):
+        self.url = url
+        self.sqs = sqs_client or lazy('sqs')
+
+    def send(self, intents):
+        """Queue intents; returns the ones that could not be sent"""
+        unsent = []
+        for i in range(0, len(intents), SQS_BATCH_SIZE):
+            chunk = intents[i:i + SQS_BATCH_SIZE]
+            pending = {str(n): intent for n, intent in enumerate(chunk)}
+            for attempt in range(SEND_MAX_ATTEMPTS):
+                entries = [{'Id': n, 'MessageBody': json.dumps(intent, separators=(',', ':'))}
+                           for n, intent in pending.items()]
+                try:
+                    response = self.sqs.send_message_batch(QueueUrl=self.url, Entries=entries)
+                    failed = {f['Id'] for f in response.get('Failed', [])}
+                except Exception as e:
+                    print(f"Error sending remediation intents: {str(e)}")
+                    failed = set(pending)
+                pending = {n: intent for n, intent in pending.items() if n in failed}
+                if not pending:
+                    break
+                time.sleep(SEND_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5))
+            unsent.extend(pending.values())
+        return unsent
+
+
+class LocalQueue:
+    """In-process stand-in for SQS.
+
+    Sent intents are handed to consumer as SQS events of up to batch_size
+    records, and the consumer's batchItemFailures stay queued for the next
+    send, up to max_receives deliveries. Without a consumer messages only
+    accumulate until drain() is called with one.
+    """
+
+    def __init__(self, consumer=None, batch_size=REMEDIATION_BATCH_SIZE, max_receives=MAX_RECEIVES):
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.max_receives = max_receives
+        self.messages = []
+        self.dead = []
+
+    def send(self, intents):
+        for intent in intents:
+            self.messages.append({
+                'messageId': str(uuid.uuid4()),
+                'body': json.dumps(intent, separators=(',', ':')),
+                'attributes': {'ApproximateReceiveCount': '0'},
+                'eventSource': 'aws:sqs'
+            })
+        if self.consumer is not None:
+            self.drain()
+        return []
+
+    def drain(self, consumer=None):
+        """Deliver every queued message once; returns how many failed"""
+        consumer = consumer or self.consumer
+        queued, self.messages = self.messages, []
+        failures = 0
+        for i in range(0, len(queued), self.batch_size):
+            batch = queued[i:i + self.batch_size]
+            for message in batch:
+                attributes = message['attributes']
+                attributes['ApproximateReceiveCount'] = str(int(attributes['ApproximateReceiveCount']) + 1)
+            try:
+                response = consumer({'Records': batch}) or {}
+                failed = {f['itemIdentifier'] for f in response.get('batchItemFailures', [])}
+            except Exception as e:
+                # A failed invocation retries the whole batch, as Lambda does
+                print(f"Error applying remediation batch: {str(e)}")
+                failed = {message['messageId'] for message in batch}
+
+            for message in batch:
+                if message['messageId'] not in failed:
+                    continue
+                failures += 1
+                if int(message['attributes']['ApproximateReceiveCount']) >= self.max_receives:
+                    print(f"Dropping remediation message after {self.max_receives} attempts: {message['body'][:200]}")
+                    self.dead.append(message)
+                else:
+                    self.messages.append(message)
+        return failures
@@ -1,14 +1,22 @@
-#resource "aws_s3_bucket_notification" "log_archive_notification" {
-#  count  = 0
-#  bucket = aws_s3_bucket.log_archive.id
-#  lambda_function {
-#    lambda_function_arn = aws_lambda_function.log_processor.arn
-#    events              = ["s3:ObjectCreated:*"]
-#    filter_suffix       = ".gz"
-#  }
+# Every .gz object landing in the log archive goes through the S3 ingest stage
+resource "aws_s3_bucket_notification" "log_archive_notification" {
+  bucket = aws_s3_bucket.log_archive.id
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.s3_ingest.arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_suffix       = ".gz"
+  }
 
-#  depends_on = [aws_lambda_permission.allow_s3_invoke]
-#}
+  depends_on = [aws_lambda_permission.allow_s3_ingest]
+}
+
+resource "aws_lambda_permission" "allow_s3_ingest" {
+  statement_id  = "AllowS3Invoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.s3_ingest.function_name
+  principal     = "s3.amazonaws.com"
+  source_arn    = aws_s3_bucket.log_archive.arn
+}
 
 
 # Remove the old permissions that reference non-existent functions
@@ -27,3 +35,24 @@
 #   principal     = "s3.amazonaws.com"
 #   source_arn    = aws_s3_bucket.log_archive.arn
 # }
+
+# Writes to the chatbot's log re-run the indexer. The prefix filter matches
+# only that log, so the indexer's own index/ writes never trigger it again.
+resource "aws_s3_bucket_notification" "cleaned_logs_notification" {
+  bucket = aws_s3_bucket.cleaned_logs.id
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.log_indexer.arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = var.chatbot_log_key
+  }
+
+  depends_on = [aws_lambda_permission.allow_s3_log_indexer]
+}
+
+resource "aws_lambda_permission" "allow_s3_log_indexer" {
+  statement_id  = "AllowS3Invoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.log_indexer.function_name
+  principal     = "s3.amazonaws.com"
+  source_arn    = aws_s3_bucket.cleaned_logs.arn
+}
@@ -0,0 +1,135 @@
+import csv
+import gzip
+import io
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3MultipartWriter:
+    """Write-only file object that streams into an S3 multipart upload.
+
+    At most one part is buffered at a time, so memory stays flat however
+    much is written. Objects smaller than one part fall back to a single
+    put_object call.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=DEFAULT_PART_SIZE, **extra_args):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.extra_args = extra_args
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.bytes_written = 0
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self.upload_id = response['UploadId']
+
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+
+    def close(self):
+        """Upload whatever is buffered and complete the object"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.extra_args)
+        else:
+            if self.buffer:
+                self._upload_part()
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        """Discard the upload so no orphaned parts are left behind"""
+        self.closed = True
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_csv_gz(s3_client, bucket, key, header, rows, part_size=DEFAULT_PART_SIZE, compresslevel=6):
+    """Stream rows from any iterable into a gzip'd CSV object; returns the row count"""
+    count = 0
+    with S3MultipartWriter(s3_client, bucket, key, part_size=part_size) as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=compresslevel) as gz:
+            text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+            text.flush()
+            text.detach()
+    return count
+
+
+def copy_stream(chunks, writer):
+    """Pipe an iterable of byte chunks (e.g. StreamingBody.iter_chunks()) into writer"""
+    for chunk in chunks:
+        writer.write(chunk)
+
+
+def text_lines(body, key):
+    """Text line stream over a get_object Body, gunzipping on the fly for .gz keys"""
+    raw = gzip.GzipFile(fileobj=body, mode='rb') if key.endswith('.gz') else body
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace', newline='')
+
+
+def open_decompressed(s3_client, bucket, key):
+    """Binary stream over an object, gunzipped for .gz keys and again when
+    the content is itself gzip (Firehose compressing gzip'd CloudWatch
+    Logs records). Supports peek() so callers can sniff the format."""
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    raw = gzip.GzipFile(fileobj=body, mode='rb') if key.endswith('.gz') else io.BufferedReader(body)
+    if raw.peek(2)[:2] == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+    return raw
+
+
+def open_text_lines(s3_client, bucket, key):
+    """Stream an object's text lines, gunzipping on the fly for .gz keys"""
+    return text_lines(s3_client.get_object(Bucket=bucket, Key=key)['Body'], key)
@@ -51,10 +51,27 @@ resource "aws_iam_role_policy" "lambda_permissions" {
       {
         Effect = "Allow",
         Action = [
+          "s3:GetObject",
           "s3:PutObject",
-          "s3:PutObjectAcl"
+          "s3:PutObjectAcl",
+          # Compaction expires hourly exports and replaced generations
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ],
         Resource = "${aws_s3_bucket.logs.arn}/*"
+      },
+      {
+        # Lets a missing export checkpoint or Glue manifest surface as
+        # NoSuchKey, and lets compaction list the hourly exports
+        Effect   = "Allow",
+        Action   = ["s3:ListBucket"],
+        Resource = [aws_s3_bucket.logs.arn, aws_s3_bucket.cleaned_logs.arn]
+      },
+      {
+        # Compaction only expires exports the clean_vpc_logs job has read
+        Effect   = "Allow",
+        Action   = ["s3:GetObject"],
+        Resource = "${aws_s3_bucket.cleaned_logs.arn}/manifests/clean_vpc_logs.json"
       }
     ]
   })
@@ -71,12 +88,19 @@ resource "aws_lambda_function" "log_exporter" {
   role             = aws_iam_role.lambda_role.arn
   handler          = "lambda_honeypot_to_csv.lambda_handler"
   runtime          = "python3.10"
+  timeout          = 300
   source_code_hash = filebase64sha256("lambda_honeypot_to_csv_v3.zip")
 
   environment {
     variables = {
-      BUCKET_NAME   = aws_s3_bucket.logs.bucket
-      BUCKET_PREFIX = "honeypot"
+      BUCKET_NAME    = aws_s3_bucket.logs.bucket
+      BUCKET_PREFIX  = "honeypot"
+      CHECKPOINT_KEY = "checkpoints/honeypot-to-csv.json"
+      MAX_WORKERS    = "4"
+      PREFETCH_PAGES = "2"
+      # "parquet" needs pyarrow in the package or a layer
+      OUTPUT_FORMAT  = "csv"
+      PARQUET_PREFIX = "honeypot_parquet"
     }
   }
 }
@@ -106,6 +130,63 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   source_arn    = aws_cloudwatch_event_rule.schedule.arn
 }
 
+#----------------------------------------------------------
+# Compaction Configuration
+# - Daily merge of completed days of hourly exports into
+#   Parquet files of roughly 128-512 MB under honeypot_compacted/
+# - Swapped in through per-day symlink manifests (see glue_setup.tf)
+#----------------------------------------------------------
+resource "aws_lambda_function" "log_compactor" {
+  # lambda_compact_honeypot.py with lambda_honeypot_to_csv.py, aws_clients.py,
+  # metrics.py and s3_stream.py
+  filename      = "lambda_compact_honeypot.zip"
+  function_name = "${var.project_name}-honeypot-log-compaction-${terraform.workspace}"
+  role          = aws_iam_role.lambda_role.arn
+  handler       = "lambda_compact_honeypot.lambda_handler"
+  runtime       = "python3.10"
+  timeout       = 900
+  memory_size   = 3008
+
+  # pyarrow, e.g. the AWS SDK for pandas layer
+  layers = var.honeypot_compaction_layers
+
+  # One run at a time, so two never swap the same day
+  reserved_concurrent_executions = 1
+
+  environment {
+    variables = {
+      BUCKET_NAME           = aws_s3_bucket.logs.bucket
+      BUCKET_PREFIX         = "honeypot"
+      COMPACTED_PREFIX      = "honeypot_compacted"
+      CHECKPOINT_KEY        = "checkpoints/honeypot-to-csv.json"
+      TARGET_FILE_MB        = "256"
+      MAX_DAYS_PER_RUN      = "7"
+      SOURCE_RETENTION_DAYS = "2"
+      GLUE_MANIFEST_PATH    = "s3://${aws_s3_bucket.cleaned_logs.bucket}/manifests/clean_vpc_logs.json"
+    }
+  }
+}
+
+resource "aws_cloudwatch_event_rule" "compaction_schedule" {
+  name = "${var.project_name}-log-compaction-schedule-${terraform.workspace}"
+  # After the first hourly export of the day has closed out yesterday
+  schedule_expression = "cron(30 1 * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "compaction_target" {
+  rule      = aws_cloudwatch_event_rule.compaction_schedule.name
+  target_id = "HoneypotLogCompaction"
+  arn       = aws_lambda_function.log_compactor.arn
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_compaction" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.log_compactor.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.compaction_schedule.arn
+}
+
 resource "aws_iam_policy" "lambda_ec2_permissions" {
   name        = "${var.project_name}-lambda-ec2-access-${terraform.workspace}"
   description = "Allow Lambda to describe and modify security group rules"
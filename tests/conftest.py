@@ -0,0 +1,30 @@
+"""Handler tests against moto's in-process AWS.
+
+Usage: python -m pytest tests (needs moto; the compaction tests also need pyarrow)
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# moto answers every call; these only keep botocore from looking for real credentials
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+os.environ.pop('AWS_PROFILE', None)
+
+
+@pytest.fixture
+def aws():
+    """moto's in-process AWS, with the handlers' cached clients rebuilt against it"""
+    from moto import mock_aws
+
+    import aws_clients
+
+    with mock_aws():
+        aws_clients._clients.clear()
+        yield
+    aws_clients._clients.clear()
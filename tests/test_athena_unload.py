@@ -0,0 +1,152 @@
+import re
+
+import boto3
+import pytest
+
+import lambda_athena_unload as unload
+
+BUCKET = unload.TRAINING_BUCKET
+HEADER = unload.HEADER_LINE
+MIB = 1024 * 1024
+
+
+class Athena:
+    """Just enough of Athena for UNLOAD; moto cannot run UNLOAD.
+
+    Each query writes one part file to its TO target and succeeds on the
+    first poll, unless its target contains a hung partition.
+    """
+
+    def __init__(self, hung=()):
+        self.manifests = {}
+        self.hung = set(hung)
+        self.queries = {}
+        self.stopped = []
+
+    def start_query_execution(self, QueryString, **kwargs):
+        execution_id = f'q{len(self.queries)}'
+        target = re.search(r"TO '([^']+)'", QueryString).group(1)
+        self.queries[execution_id] = target
+        if not any(partition in target for partition in self.hung):
+            bucket, prefix = target[len('s3://'):].split('/', 1)
+            boto3.client('s3').put_object(Bucket=bucket, Key=f'{prefix}{execution_id}_00000',
+                                          Body=f'{target}\n'.encode())
+        return {'QueryExecutionId': execution_id}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        return {'QueryExecutions': [{
+            'QueryExecutionId': execution_id,
+            'Status': {'State': 'RUNNING' if any(p in self.queries[execution_id] for p in self.hung) else 'SUCCEEDED'},
+            'Statistics': {'DataScannedInBytes': 10},
+        } for execution_id in QueryExecutionIds]}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+    def get_query_execution(self, QueryExecutionId):
+        statistics = {}
+        if QueryExecutionId in self.manifests:
+            statistics['DataManifestLocation'] = self.manifests[QueryExecutionId]
+        return {'QueryExecution': {'QueryExecutionId': QueryExecutionId, 'Statistics': statistics}}
+
+
+@pytest.fixture
+def s3(aws, monkeypatch):
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket=BUCKET)
+    monkeypatch.setattr(unload, 'athena', Athena())
+    monkeypatch.setattr(unload, 'POLL_INITIAL_DELAY', 0)
+    return s3
+
+
+def put_parts(s3, prefix, execution_id, sizes):
+    """UNLOAD-style part files, each a distinct byte pattern of the given size"""
+    keys, body = [], b''
+    for n, size in enumerate(sizes):
+        key = f'{prefix}{execution_id}_{n:05d}'
+        data = (f'{n},'.encode() * size)[:size]
+        s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+        keys.append(key)
+        body += data
+    return keys, body
+
+
+def get(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+def listed(s3, prefix):
+    return {obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix).get('Contents', [])}
+
+
+@pytest.mark.parametrize('sizes', [
+    [100, 200],                             # header and small parts: one put_object
+    [6 * MIB, 10, 7 * MIB],                 # large parts copied, small one padded into the next
+    [3 * MIB, 3 * MIB, 1 * MIB, 6 * MIB],   # small parts combined until they fill a part
+    [5 * MIB],
+])
+def test_merge_concatenates_header_and_every_part(s3, sizes):
+    _, body = put_parts(s3, 'input/', 'q1', sizes)
+    files = unload.merge_unload_parts(BUCKET, 'input/', HEADER, 'q1')
+
+    assert files == len(sizes)
+    assert get(s3, 'input/final_output.csv') == HEADER.encode() + body
+    # The parts are gone, so the prefix holds every row exactly once
+    assert listed(s3, 'input/') == {'input/final_output.csv'}
+
+
+def test_parts_come_from_the_data_manifest(s3):
+    keys, body = put_parts(s3, 'input/event_date=2025-04-25/', 'q2', [300, 400])
+    # Another query's leftover under the same prefix is not part of this one
+    s3.put_object(Bucket=BUCKET, Key='input/event_date=2025-04-25/other', Body=b'stale')
+    s3.put_object(Bucket=BUCKET, Key='athena-results/q2-manifest.csv',
+                  Body=''.join(f's3://{BUCKET}/{key}\n' for key in keys).encode())
+    unload.athena.manifests['q2'] = f's3://{BUCKET}/athena-results/q2-manifest.csv'
+
+    unload.merge_unload_parts(BUCKET, 'input/event_date=2025-04-25/', HEADER, 'q2', output_filename='day.csv')
+    assert get(s3, 'input/event_date=2025-04-25/day.csv') == HEADER.encode() + body
+    assert listed(s3, 'input/event_date=2025-04-25/') == {
+        'input/event_date=2025-04-25/day.csv', 'input/event_date=2025-04-25/other'
+    }
+
+
+def test_without_a_manifest_parts_are_found_by_query_id(s3):
+    _, body = put_parts(s3, 'input/', 'q3', [50, 60])
+    s3.put_object(Bucket=BUCKET, Key='input/q9_00000', Body=b'other query')
+    unload.merge_unload_parts(BUCKET, 'input/', HEADER, 'q3')
+    assert get(s3, 'input/final_output.csv') == HEADER.encode() + body
+    assert 'input/q9_00000' in listed(s3, 'input/')
+
+
+def test_empty_manifest_means_the_query_wrote_nothing(s3):
+    s3.put_object(Bucket=BUCKET, Key='athena-results/q4-manifest.csv', Body=b'')
+    unload.athena.manifests['q4'] = f's3://{BUCKET}/athena-results/q4-manifest.csv'
+    assert unload.merge_unload_parts(BUCKET, 'input/', HEADER, 'q4', allow_empty=True) == 0
+    with pytest.raises(Exception, match='No data files'):
+        unload.merge_unload_parts(BUCKET, 'input/', HEADER, 'q4')
+    assert listed(s3, 'input/') == set()
+
+
+@pytest.mark.parametrize('hung, checkpoint', [
+    ([], '2025-04-27'),
+    (['2025-04-26'], '2025-04-25'),
+    (['2025-04-25'], None),
+])
+def test_timeout_keeps_the_partitions_that_finished(s3, monkeypatch, hung, checkpoint):
+    days = ['2025-04-25', '2025-04-26', '2025-04-27']
+    monkeypatch.setattr(unload, 'athena', Athena(hung))
+    monkeypatch.setattr(unload, 'list_new_partitions', lambda last: days)
+    monkeypatch.setattr(unload, 'QUERY_TIMEOUT_SECONDS', 0.05)
+
+    response = unload.lambda_handler({}, None)
+
+    assert response['statusCode'] == (207 if hung else 200)
+    assert response['lastPartition'] == checkpoint
+    assert unload.load_checkpoint() == checkpoint
+    for day in days:
+        merged = f'input/event_date={day}/honeypot-{day}.csv' in listed(s3, f'input/event_date={day}/')
+        assert merged == (day not in hung)
+    # The hung query is stopped rather than left to run up the bill
+    assert [unload.athena.queries[q] for q in unload.athena.stopped] == [
+        f's3://{BUCKET}/input/event_date={day}/' for day in hung
+    ]
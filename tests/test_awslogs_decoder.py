@@ -0,0 +1,109 @@
+import base64
+import gzip
+import io
+import json
+
+import pytest
+
+from awslogs_decoder import is_envelope, iter_envelope_events, iter_honeypot_events, iter_log_events
+from awslogs_decoder import project_message
+
+# Chunk sizes that split keys, numbers, escapes and multi-byte characters
+CHUNK_SIZES = [1, 2, 3, 5, 7, 13, 64, 4096]
+
+
+def payload(document):
+    return base64.b64encode(gzip.compress(document.encode('utf-8')))
+
+
+def log_events(count):
+    events = []
+    for n in range(count):
+        message = {
+            'src_host': f'203.0.113.{n % 250}',
+            'dst_port': 22,
+            'logtype': 4002,
+            'utc_time': f'2025-04-25 10:00:{n % 60:02d}.000001',
+            'logdata': {'USERNAME': f'rööt-☃-{n}', 'PASSWORD': 'quote"and\\slash'}
+        }
+        events.append({'id': str(10 ** 20 + n), 'timestamp': 1745575200000 + n, 'message': json.dumps(message)})
+    return events
+
+
+def envelope(events, indent=None):
+    return json.dumps({
+        'messageType': 'DATA_MESSAGE',
+        'owner': '123456789012',
+        'logGroup': '/honeypot/opencanary',
+        'logStream': 'i-0abc',
+        'subscriptionFilters': ['honeypot'],
+        'logEvents': events,
+        'policyLevel': 'ACCOUNT_LEVEL_POLICY'
+    }, indent=indent)
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('indent', [None, 2])
+def test_events_match_json_loads_at_any_chunk_size(chunk_size, indent):
+    events = log_events(40)
+    assert list(iter_log_events(payload(envelope(events, indent)), chunk_size)) == events
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_number_ending_on_chunk_edge_is_not_truncated(chunk_size):
+    # Bare numbers as values: a buffer ending mid-number must not decode its prefix
+    document = '{"logEvents":[1745575200123456,{"timestamp":1745575200123456}],"n":12}'
+    assert list(iter_log_events(payload(document), chunk_size)) == [1745575200123456, {'timestamp': 1745575200123456}]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_empty_envelopes(chunk_size):
+    assert list(iter_log_events(payload('{}'), chunk_size)) == []
+    assert list(iter_log_events(payload('{"logEvents": [ ]}'), chunk_size)) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_truncated_payload_raises(chunk_size):
+    document = envelope(log_events(5))
+    with pytest.raises(ValueError):
+        list(iter_log_events(payload(document[:len(document) // 2]), chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4096])
+def test_honeypot_events_project_and_skip_unparseable(chunk_size):
+    events = log_events(3)
+    events.insert(1, {'id': 'x', 'timestamp': 1, 'message': 'not json'})
+    projected = list(iter_honeypot_events(payload(envelope(events)), chunk_size))
+    assert [ts for ts, _ in projected] == [1745575200000, 1745575200001, 1745575200002]
+    assert projected[2][1] == {
+        'src_host': '203.0.113.2',
+        'dst_port': 22,
+        'logtype': 4002,
+        'utc_time': '2025-04-25 10:00:02.000001',
+        'username': 'rööt-☃-2'
+    }
+
+
+CONTROL = json.dumps({
+    'messageType': 'CONTROL_MESSAGE',
+    'logEvents': [{'id': '', 'timestamp': 1, 'message': 'CWL CONTROL MESSAGE: Checking health of destination Firehose.'}]
+})
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+@pytest.mark.parametrize('separator', ['', '\n'])
+def test_back_to_back_envelopes(chunk_size, separator):
+    events = log_events(12)
+    document = separator.join([CONTROL, envelope(events[:5]), envelope([]), envelope(events[5:], indent=2)])
+    assert is_envelope(document.encode()[:64])
+
+    projected = list(iter_envelope_events(io.BytesIO(document.encode('utf-8')), chunk_size))
+    # Numbered across the object, counting the control message's event
+    assert [n for n, _ in projected] == list(range(2, 14))
+    assert [data for _, data in projected] == [project_message(e['message']) for e in events]
+
+
+def test_opencanary_lines_are_not_envelopes():
+    assert not is_envelope(log_events(1)[0]['message'].encode())
+    assert not is_envelope(b'utc_time,src_host,dst_port')
+    assert is_envelope(b' \n{ "messageType": "DATA_MESSAGE"')
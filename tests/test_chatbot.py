@@ -0,0 +1,185 @@
+import json
+
+import boto3
+import pytest
+
+import chatbot_lambda as chatbot
+import log_index
+
+BUCKET = 'cleaned-logs'
+LOG_KEY = 'chatbot/honeypot.json'
+
+
+class Recording:
+    """boto3 client that records the operations called through it"""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls.append((name, kwargs.get('Key'), 'IfNoneMatch' in kwargs))
+            return attr(*args, **kwargs)
+        return call
+
+
+class Bedrock:
+    """invoke_model stand-in that answers with the prompt's length"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)['prompt']
+        self.prompts.append(prompt)
+        completion = json.dumps({'completion': f'{len(prompt)} characters of context'})
+        return {'body': Body(completion.encode())}
+
+
+class Body:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def log_lines(hosts):
+    return '\n'.join(json.dumps({
+        'src_host': host, 'dst_port': 22, 'logtype': 4002, 'utc_time': f'2025-04-25 10:00:{n:02d}.000001',
+        'logdata': {'USERNAME': 'root'}
+    }) for n, host in enumerate(hosts)).encode()
+
+
+@pytest.fixture
+def s3(aws, monkeypatch):
+    client = boto3.client('s3')
+    client.create_bucket(Bucket=BUCKET)
+    client.put_object(Bucket=BUCKET, Key=LOG_KEY, Body=log_lines(['203.0.113.5'] * 3))
+    recording = Recording(client)
+    monkeypatch.setattr(chatbot, 's3', recording)
+    monkeypatch.setattr(chatbot, 'bedrock', Bedrock())
+    monkeypatch.setattr(chatbot, '_log_cache', {'key': None, 'etag': None, 'index': None, 'checked_at': 0.0})
+    monkeypatch.setattr(chatbot, '_answer_cache', type(chatbot._answer_cache)())
+    monkeypatch.setattr(chatbot, 'ANSWER_CACHE_TABLE', None)
+    monkeypatch.setenv('CLEAN_LOG_BUCKET', BUCKET)
+    monkeypatch.setenv('LOG_KEY', LOG_KEY)
+    monkeypatch.setenv('MODEL_ID', 'anthropic.claude-v2')
+    return recording
+
+
+def log_gets(s3):
+    return [(key, conditional) for name, key, conditional in s3.calls if name == 'get_object' and key == LOG_KEY]
+
+
+def test_index_is_built_once_and_revalidated_with_if_none_match(s3):
+    index, etag = chatbot.get_index(BUCKET, LOG_KEY, now=1000.0)
+    assert index['source']['etag'] == etag
+    assert index['terms']['src_host']['203.0.113.5']['count'] == 3
+    # The index is stored for the other containers and the indexer
+    assert log_index.load_index(s3.client, BUCKET, LOG_KEY) == index
+
+    # Inside LOG_REVALIDATE_SECONDS no request at all
+    assert chatbot.get_index(BUCKET, LOG_KEY, now=1000.0 + chatbot.LOG_REVALIDATE_SECONDS - 1) == (index, etag)
+    assert log_gets(s3) == [(LOG_KEY, False)]
+
+    # After it, a conditional GET that comes back 304
+    assert chatbot.get_index(BUCKET, LOG_KEY, now=1000.0 + chatbot.LOG_REVALIDATE_SECONDS + 1) == (index, etag)
+    assert log_gets(s3) == [(LOG_KEY, False), (LOG_KEY, True)]
+    # 304 has no body, so the stored index is not even looked at
+    assert [key for name, key, _ in s3.calls if name == 'get_object'] == [
+        LOG_KEY, log_index.index_key(LOG_KEY), LOG_KEY
+    ]
+    assert [name for name, _, _ in s3.calls].count('put_object') == 1
+
+
+def test_changed_log_is_reindexed(s3):
+    chatbot.get_index(BUCKET, LOG_KEY, now=1000.0)
+    s3.client.put_object(Bucket=BUCKET, Key=LOG_KEY, Body=log_lines(['198.51.100.1'] * 2))
+
+    index, etag = chatbot.get_index(BUCKET, LOG_KEY, now=2000.0)
+    assert etag == s3.client.head_object(Bucket=BUCKET, Key=LOG_KEY)['ETag']
+    assert index['source']['etag'] == etag
+    assert list(index['terms']['src_host']) == ['198.51.100.1']
+
+
+def test_index_written_by_the_indexer_is_reused(s3):
+    stored = log_index.build_index(s3.client, BUCKET, LOG_KEY)
+    log_index.save_index(s3.client, BUCKET, stored)
+
+    index, _ = chatbot.get_index(BUCKET, LOG_KEY, now=1000.0)
+    assert index == stored
+    assert 'put_object' not in [name for name, _, _ in s3.calls]
+
+
+def test_handler_answers_with_one_invoke_model_call(s3):
+    response = chatbot.lambda_handler({'question': 'What did 203.0.113.5 do?'}, None)
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert body['cached'] is False
+    assert body['answer'] == f'{len(chatbot.bedrock.prompts[0])} characters of context'
+    assert '203.0.113.5' in chatbot.bedrock.prompts[0]
+
+
+def ask(question):
+    response = chatbot.lambda_handler({'body': json.dumps({'question': question})}, None)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+
+def test_same_question_is_answered_from_the_cache(s3):
+    first = ask('What did 203.0.113.5 do?')
+    again = ask('  what did 203.0.113.5   DO ')
+    assert again == {'answer': first['answer'], 'cached': True}
+    assert len(chatbot.bedrock.prompts) == 1
+
+    # A rewritten log changes the ETag, and with it every cache key
+    s3.client.put_object(Bucket=BUCKET, Key=LOG_KEY, Body=log_lines(['203.0.113.5'] * 4))
+    chatbot._log_cache['checked_at'] = 0.0
+    assert ask('What did 203.0.113.5 do?')['cached'] is False
+    assert len(chatbot.bedrock.prompts) == 2
+
+
+def test_answers_expire_and_the_cache_stays_bounded(s3, monkeypatch):
+    monkeypatch.setattr(chatbot, 'ANSWER_CACHE_SIZE', 2)
+    chatbot.remember_answer('a', 'answer a', expires_at=100.0)
+    chatbot.remember_answer('b', 'answer b', expires_at=200.0)
+    assert chatbot.get_cached_answer('a', now=50.0) == 'answer a'
+    # 'a' was used last, so 'b' is the one evicted
+    chatbot.remember_answer('c', 'answer c', expires_at=200.0)
+    assert list(chatbot._answer_cache) == ['a', 'c']
+
+    assert chatbot.get_cached_answer('a', now=150.0) is None
+    assert 'a' not in chatbot._answer_cache
+
+
+def test_shared_cache_serves_other_containers(s3, monkeypatch):
+    dynamodb = boto3.client('dynamodb')
+    dynamodb.create_table(
+        TableName='chatbot-answers', BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'cache_key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'cache_key', 'AttributeType': 'S'}]
+    )
+    monkeypatch.setattr(chatbot, 'ANSWER_CACHE_TABLE', 'chatbot-answers')
+    chatbot.remember_answer('k', 'shared answer', expires_at=1000.0)
+    chatbot.remember_answer('old', 'stale answer', expires_at=10.0)
+
+    # A cold container: nothing in memory, the table answers and warms it
+    chatbot._answer_cache.clear()
+    assert chatbot.get_cached_answer('k', now=500.0) == 'shared answer'
+    assert 'k' in chatbot._answer_cache
+    # TTL deletion is lazy, so an expired item still in the table is ignored
+    assert chatbot.get_cached_answer('old', now=500.0) is None
+    assert chatbot.get_cached_answer('missing', now=500.0) is None
+
+
+def test_shared_cache_errors_fall_back_to_the_model(s3, monkeypatch):
+    # The table does not exist: reads and writes log and carry on
+    monkeypatch.setattr(chatbot, 'ANSWER_CACHE_TABLE', 'no-such-table')
+    assert ask('What did 203.0.113.5 do?')['cached'] is False
+    assert ask('What did 203.0.113.5 do?')['cached'] is True
@@ -0,0 +1,156 @@
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime, timezone
+
+import boto3
+import pytest
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+import lambda_compact_honeypot as compact
+from lambda_honeypot_to_csv import CSV_HEADER
+
+BUCKET = compact.BUCKET
+GLUE_MANIFEST = 'manifests/clean_vpc_logs.json'
+
+
+def row(utc_time, src_host, dst_port='22'):
+    return [utc_time, src_host, '40000', '10.0.0.5', dst_port, '4002', 'opencanary-1', 'root', 'hunter2']
+
+
+def checkpoint_at(when):
+    return {'timestamp': int(when.replace(tzinfo=timezone.utc).timestamp() * 1000), 'event_ids': {}}
+
+
+@pytest.fixture
+def bucket(aws, monkeypatch):
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket=BUCKET)
+    # moto stamps every object with today's date; an export's last day is
+    # the day it was written, so pin it to the day the test writes it for
+    written = {}
+    list_sources = compact.list_sources
+
+    def sources():
+        listed = list_sources()
+        for source in listed:
+            source['last_day'] = written[source['key']]
+        return listed
+
+    monkeypatch.setattr(compact, 'list_sources', sources)
+
+    def put_export(key, rows, last_day):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+            text = io.TextIOWrapper(gz, newline='')
+            writer = csv.writer(text)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(rows)
+            text.flush()
+            text.detach()
+        s3.put_object(Bucket=BUCKET, Key=key, Body=buf.getvalue())
+        written[key] = last_day
+
+    def put_json(key, value):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(value).encode('utf-8'))
+
+    def get_json(key):
+        return json.loads(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())
+
+    def read_day(day):
+        symlink = s3.get_object(Bucket=BUCKET, Key=f'{compact.COMPACTED_PREFIX}/_symlink/event_date={day}/symlink.txt')
+        rows = []
+        for uri in symlink['Body'].read().decode('utf-8').split():
+            body = s3.get_object(Bucket=BUCKET, Key=uri[len(f's3://{BUCKET}/'):])['Body'].read()
+            rows.extend(pq.read_table(io.BytesIO(body)).to_pylist())
+        return rows
+
+    def keys(prefix=''):
+        return set(compact.list_keys(prefix))
+
+    # 25 Apr: a.csv.gz and b.csv.gz overlap (the exporter's late-arrival
+    # re-read), and b runs past midnight into the next day
+    put_export('honeypot/2025/04/25/10/a.csv.gz', [
+        row('2025-04-25 10:00:00.000001', '203.0.113.1'),
+        row('2025-04-25 10:59:59.000001', '203.0.113.2'),
+    ], date(2025, 4, 25))
+    put_export('honeypot/2025/04/25/11/b.csv.gz', [
+        row('2025-04-25 10:59:59.000001', '203.0.113.2'),
+        row('2025-04-25 10:59:59.000001', '203.0.113.2', dst_port='23'),
+        row('2025-04-25 23:59:59.000001', '203.0.113.3'),
+        row('2025-04-26 00:00:01.000001', '203.0.113.4'),
+    ], date(2025, 4, 26))
+    put_json(compact.CHECKPOINT_KEY, checkpoint_at(datetime(2025, 4, 26, 0, 5)))
+
+    return {'s3': s3, 'put_export': put_export, 'put_json': put_json, 'get_json': get_json,
+            'read_day': read_day, 'keys': keys}
+
+
+def test_day_keeps_one_copy_of_each_event(bucket):
+    compact.lambda_handler({}, None)
+
+    rows = bucket['read_day']('2025-04-25')
+    assert [(r['src_host'], r['dst_port']) for r in rows] == [
+        ('203.0.113.1', 22), ('203.0.113.2', 22), ('203.0.113.2', 23), ('203.0.113.3', 22)
+    ]
+    manifest = bucket['get_json'](compact.MANIFEST_KEY)
+    assert list(manifest['days']) == ['2025-04-25']
+    assert manifest['days']['2025-04-25']['rows'] == 4
+    assert manifest['days']['2025-04-25']['sources'] == [
+        'honeypot/2025/04/25/10/a.csv.gz', 'honeypot/2025/04/25/11/b.csv.gz'
+    ]
+
+
+def test_day_still_receiving_late_events_is_not_compacted(bucket):
+    # Within LATE_ARRIVAL_SECONDS of midnight, 25 Apr can still gain events
+    bucket['put_json'](compact.CHECKPOINT_KEY, checkpoint_at(datetime(2025, 4, 26, 0, 1)))
+    compact.lambda_handler({}, None)
+    assert not bucket['keys'](f'{compact.COMPACTED_PREFIX}/data/')
+
+
+def test_exports_are_kept_without_the_glue_manifest(bucket, monkeypatch):
+    monkeypatch.setattr(compact, 'SOURCE_RETENTION_DAYS', 0)
+    monkeypatch.setattr(compact, 'GLUE_MANIFEST_PATH', None)
+    compact.lambda_handler({}, None)
+    assert bucket['keys']('honeypot/') == {'honeypot/2025/04/25/10/a.csv.gz', 'honeypot/2025/04/25/11/b.csv.gz'}
+
+
+def test_only_compacted_exports_the_glue_job_read_expire(bucket, monkeypatch):
+    monkeypatch.setattr(compact, 'SOURCE_RETENTION_DAYS', 0)
+    monkeypatch.setattr(compact, 'GLUE_MANIFEST_PATH', f's3://{BUCKET}/{GLUE_MANIFEST}')
+    compact.lambda_handler({}, None)
+    assert len(bucket['keys']('honeypot/')) == 2
+
+    bucket['put_json'](GLUE_MANIFEST, {'processed_files': [
+        f's3://{BUCKET}/honeypot/2025/04/25/10/a.csv.gz',
+        f's3://{BUCKET}/honeypot/2025/04/25/11/b.csv.gz'
+    ]})
+    compact.lambda_handler({}, None)
+    # b also holds 26 Apr, which is not compacted yet
+    assert bucket['keys']('honeypot/') == {'honeypot/2025/04/25/11/b.csv.gz'}
+
+    bucket['put_json'](compact.CHECKPOINT_KEY, checkpoint_at(datetime(2025, 4, 27, 0, 5)))
+    compact.lambda_handler({}, None)
+    assert bucket['keys']('honeypot/') == set()
+    assert [r['src_host'] for r in bucket['read_day']('2025-04-26')] == ['203.0.113.4']
+
+
+def test_recompaction_retires_the_previous_generation(bucket, monkeypatch):
+    compact.lambda_handler({}, None)
+    first = bucket['keys'](f'{compact.COMPACTED_PREFIX}/data/')
+
+    compact.lambda_handler({'days': ['2025-04-25']}, None)
+    manifest = bucket['get_json'](compact.MANIFEST_KEY)
+    assert {r['key'] for r in manifest['retired']} == first
+    # Retired files stay readable through the grace period
+    assert first < bucket['keys'](f'{compact.COMPACTED_PREFIX}/data/')
+    assert len(bucket['read_day']('2025-04-25')) == 4
+
+    monkeypatch.setattr(compact, 'RETIRED_GRACE_SECONDS', 0)
+    compact.lambda_handler({}, None)
+    current = {f['key'] for f in bucket['get_json'](compact.MANIFEST_KEY)['days']['2025-04-25']['files']}
+    assert bucket['keys'](f'{compact.COMPACTED_PREFIX}/data/') == current
+    assert not current & first
+    assert bucket['get_json'](compact.MANIFEST_KEY)['retired'] == []
@@ -0,0 +1,75 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+
+from Docker.Sagemaker.features import FEATURE_COLUMNS, HISTORY_MS, MISSING, WINDOW_MS, build_features  # noqa: E402
+
+START = np.datetime64('2025-04-25T00:00:00', 'ms')
+
+
+def synthetic_frame(rows, hours, seed=3):
+    rng = np.random.default_rng(seed)
+    hosts = ['203.0.113.5', '203.0.113.9', '198.51.100.1', 'honeypot-a', '2001:db8::1']
+    return pd.DataFrame({
+        'utc_time': START + np.sort(rng.integers(0, hours * 3_600_000, rows)).astype('timedelta64[ms]'),
+        'src_host': rng.choice(hosts, rows, p=[0.5, 0.2, 0.15, 0.1, 0.05]),
+        'dst_port': rng.choice([21, 22, 23, 80], rows),
+        'logtype': rng.choice([2000, 3000, 4002], rows),
+        'username': rng.choice(['root', 'admin', 'pi', None], rows)
+    })
+
+
+def expected(frame, i):
+    """Windowed features of row i, straight from their definition"""
+    row = frame.loc[i]
+    t = row['utc_time']
+    source = frame[frame['src_host'] == row['src_host']]
+    window = source[(source['utc_time'] >= t - np.timedelta64(HISTORY_MS, 'ms')) & (source['utc_time'] <= t)]
+    times = np.sort(window['utc_time'].to_numpy().astype('datetime64[ms]').astype(np.int64))
+    gaps = np.diff(times) / 1000.0
+    earlier = source[source['utc_time'] < t]['utc_time']
+    gap_prev = (t - earlier.max()) / np.timedelta64(1, 's') if len(earlier) else np.nan
+    same_time = ((source['utc_time'] == t) & (source.index < i)).any()
+    return {
+        'attempts_1m': int((window['utc_time'] >= t - np.timedelta64(WINDOW_MS, 'ms')).sum()),
+        'src_events': len(window),
+        'attempts_per_minute': len(window) / max((times[-1] - times[0]) / 60_000, 1.0),
+        'distinct_ports': window['dst_port'].nunique(),
+        'distinct_usernames': window['username'].nunique(),
+        'gap_prev': 0.0 if same_time else (gap_prev if gap_prev * 1000 <= HISTORY_MS else MISSING),
+        'interarrival_mean': gaps.mean() if len(gaps) else MISSING,
+        'interarrival_std': gaps.std() if len(gaps) else MISSING,
+        'interarrival_min': gaps.min() if len(gaps) else MISSING
+    }
+
+
+def test_windowed_features_match_their_definition():
+    frame = synthetic_frame(600, hours=3)
+    features = build_features(frame)
+    assert list(features.columns) == FEATURE_COLUMNS
+    for i in frame.index[::7]:
+        for column, value in expected(frame, i).items():
+            assert features.at[i, column] == pytest.approx(value, abs=1e-6), (i, column)
+
+
+def test_features_do_not_depend_on_how_much_history_the_frame_holds():
+    day = synthetic_frame(20_000, hours=24)
+    # The analyzer's view: the last few minutes plus HISTORY_MS before them
+    cutoff = day['utc_time'].iloc[-1] - np.timedelta64(5 * 60_000, 'ms')
+    recent = day[day['utc_time'] >= cutoff - np.timedelta64(HISTORY_MS, 'ms')]
+    scored = day.index[day['utc_time'] >= cutoff]
+
+    training = build_features(day).loc[scored]
+    serving = build_features(recent).loc[scored]
+    pd.testing.assert_frame_equal(training, serving, check_exact=True)
+
+
+def test_rows_without_time_or_source_are_dropped():
+    frame = synthetic_frame(10, hours=1)
+    frame.loc[2, 'src_host'] = None
+    frame['utc_time'] = frame['utc_time'].astype(object)
+    frame.loc[5, 'utc_time'] = None
+    features = build_features(frame)
+    assert list(features.index) == [0, 1, 3, 4, 6, 7, 8, 9]
+    assert build_features(frame.iloc[[2, 5]]).empty
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+
+import boto3
+import pytest
+
+import lambda_honeypot_to_csv as export
+from lambda_honeypot_to_csv import ExportProgress
+
+START = 1_745_575_200_000
+
+# CloudWatch Logs rejects events more than 14 days old
+RECENT = int(time.time() * 1000) - 3_600_000
+
+
+def event(n, timestamp):
+    return {'eventId': f'e{n}', 'timestamp': timestamp, 'message': json.dumps({'n': n})}
+
+
+@pytest.fixture
+def log_group(aws):
+    logs = boto3.client('logs')
+    logs.create_log_group(logGroupName=export.LOG_GROUP)
+
+    def put(stream, messages):
+        logs.create_log_stream(logGroupName=export.LOG_GROUP, logStreamName=stream)
+        logs.put_log_events(logGroupName=export.LOG_GROUP, logStreamName=stream, logEvents=[
+            {'timestamp': timestamp, 'message': json.dumps({'stream': stream, 'n': n})}
+            for n, timestamp in enumerate(messages)
+        ])
+
+    return put
+
+
+def test_progress_checkpoint_keeps_only_ids_in_the_late_window():
+    progress = ExportProgress({'timestamp': START, 'event_ids': {'old': START - export.LATE_ARRIVAL_MS - 1}})
+    events = [event(n, START + n * 1000) for n in range(300)]
+    assert list(progress.track(iter(events))) == events
+
+    checkpoint = progress.checkpoint()
+    assert checkpoint['timestamp'] == START + 299_000
+    floor = checkpoint['timestamp'] - export.LATE_ARRIVAL_MS
+    assert checkpoint['event_ids'] == {e['eventId']: e['timestamp'] for e in events if e['timestamp'] >= floor}
+    assert progress.events == 300
+    assert progress.bytes == sum(len(e['message']) for e in events)
+
+
+def test_progress_prunes_while_tracking():
+    progress = ExportProgress({'timestamp': START, 'event_ids': {}})
+    # Ten events a second: the late window holds a few thousand IDs at most
+    largest = 0
+    for _ in progress.track(event(n, START + n * 100) for n in range(100_000)):
+        largest = max(largest, len(progress.event_ids))
+    assert largest < 30_000
+    assert len(progress.checkpoint()['event_ids']) == export.LATE_ARRIVAL_MS // 100 + 1
+
+
+def test_progress_high_water_never_moves_back():
+    progress = ExportProgress({'timestamp': START + 10_000, 'event_ids': {}})
+    list(progress.track(iter([event(1, START)])))
+    assert progress.checkpoint()['timestamp'] == START + 10_000
+
+
+def test_every_stream_is_read_with_at_most_max_workers_threads(log_group):
+    for s in range(7):
+        log_group(f'i-{s}', [RECENT + s + 10 * n for n in range(50)])
+
+    baseline = threading.active_count()
+    peak = 0
+    exported = []
+    for e in export.fetch_new_events(RECENT, RECENT + 10_000, {}, max_workers=3):
+        peak = max(peak, threading.active_count() - baseline)
+        exported.append(e)
+
+    assert peak <= 3
+    assert len(exported) == 350
+    assert len({e['eventId'] for e in exported}) == 350
+    # Each group of streams comes out in timestamp order
+    groups = [exported[:150], exported[150:300], exported[300:]]
+    for group in groups:
+        assert [e['timestamp'] for e in group] == sorted(e['timestamp'] for e in group)
+
+
+def test_events_already_exported_are_skipped(log_group):
+    log_group('i-0', [RECENT + n for n in range(10)])
+    first = list(export.fetch_new_events(RECENT, RECENT + 10_000, {}))
+    assert len(first) == 10
+    seen = {e['eventId']: e['timestamp'] for e in first[:4]}
+    again = list(export.fetch_new_events(RECENT, RECENT + 10_000, seen))
+    assert again == first[4:]
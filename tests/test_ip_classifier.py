@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+import ip_classifier
+from ip_classifier import ALLOWLISTED, INVALID, KNOWN_BAD, PRIVATE, IPClassifier, load_cidr_feed
+
+
+@pytest.fixture
+def classifier():
+    return IPClassifier(
+        allowlist=['10.0.5.0/24', '198.51.100.7'],
+        known_bad=['203.0.113.0/25', '203.0.113.128/25', '10.0.0.0/16', '2001:db8:bad::/48', 'not-a-cidr', '1.2.3.0/33']
+    )
+
+
+CASES = [
+    ('10.0.5.9', ALLOWLISTED),      # allowlist wins over private and known bad
+    ('10.0.6.1', PRIVATE),          # private wins over known bad
+    ('198.51.100.7', ALLOWLISTED),
+    ('198.51.100.8', None),
+    ('203.0.113.0', KNOWN_BAD),     # adjacent /25s merged into one range
+    ('203.0.113.255', KNOWN_BAD),
+    ('203.0.114.0', None),
+    ('0.0.0.0', None),
+    ('255.255.255.255', None),
+    ('fe80::1', PRIVATE),
+    ('2001:db8:bad::1', KNOWN_BAD),
+    ('2001:db8:600d::1', None),
+    ('not an ip', INVALID),
+    ('', INVALID),
+    (None, INVALID),
+]
+
+
+@pytest.mark.parametrize('ip, label', CASES)
+def test_classify(classifier, ip, label):
+    assert classifier.classify(ip) == label
+
+
+def test_classify_many_matches_classify(classifier):
+    rnd = random.Random(5)
+    ips = [ip for ip, _ in CASES] + [
+        f"{rnd.choice([10, 198, 203, 8])}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}"
+        for _ in range(2000)
+    ]
+    assert classifier.classify_many(ips) == [classifier.classify(ip) for ip in ips]
+
+
+def test_classify_many_without_numpy(classifier, monkeypatch):
+    monkeypatch.setattr(ip_classifier, 'np', None)
+    assert classifier.classify_many(ip for ip, _ in CASES) == [label for _, label in CASES]
+
+
+def test_empty_tables():
+    classifier = IPClassifier(private=[])
+    assert classifier.classify_many(['10.0.0.1', '::1', 'x']) == [None, None, INVALID]
+
+
+def test_feed_skips_comments_and_blank_lines(tmp_path, monkeypatch):
+    feed = tmp_path / 'bad.txt'
+    feed.write_text('# drop list\n203.0.113.0/24  # scanners\n\n192.0.2.1\n')
+    assert load_cidr_feed(str(feed)) == ['203.0.113.0/24', '192.0.2.1']
+
+    monkeypatch.setenv('KNOWN_BAD_FEED', str(feed))
+    monkeypatch.setenv('KNOWN_BAD_CIDRS', '198.51.100.0/24')
+    monkeypatch.setenv('ALLOWLIST_CIDRS', ' 192.0.2.1 , ')
+    classifier = IPClassifier.from_env()
+    assert classifier.classify_many(['203.0.113.9', '198.51.100.1', '192.0.2.1']) == [KNOWN_BAD, KNOWN_BAD, ALLOWLISTED]
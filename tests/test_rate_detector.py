@@ -0,0 +1,135 @@
+import boto3
+import pytest
+
+import rate_detector
+from rate_detector import RateDetector, SketchStore, SlidingSketch
+
+T0 = 1_745_575_200.0
+TABLE = 'rate-state'
+
+
+def attacks(src_host, count, start=T0, ports=(22,)):
+    return [(int((start + n * 0.01) * 1000), {'src_host': src_host, 'dst_port': ports[n % len(ports)]})
+            for n in range(count)]
+
+
+def test_counts_are_exact_without_collisions():
+    sketch = SlidingSketch(width=4096)
+    for n in range(30):
+        sketch.observe('203.0.113.5', [22, 23, 80][n % 3], T0 + n)
+    sketch.observe('198.51.100.1', None, T0 + 30)
+
+    assert sketch.source_count('203.0.113.5') == 30
+    assert sketch.pair_count('203.0.113.5', 23) == 10
+    assert sketch.distinct_ports('203.0.113.5') == 3
+    assert sketch.source_count('198.51.100.1') == 1
+    assert sketch.distinct_ports('198.51.100.1') == 0
+    assert sketch.source_count('192.0.2.1') == 0
+
+
+def test_window_slides_with_event_time():
+    sketch = SlidingSketch(width=4096, window_seconds=60, slots=6)
+    for n in range(10):
+        sketch.observe('203.0.113.5', 22, T0 + n)
+    # A late event still inside the window counts; one behind it does not
+    sketch.observe('203.0.113.5', 22, T0 + 70)
+    sketch.observe('203.0.113.5', 22, T0 + 25)
+    sketch.observe('203.0.113.5', 22, T0 + 15)
+    # The first ten events' slot has left the window too
+    assert sketch.source_count('203.0.113.5') == 2
+
+    # Whole slots expire once the newest event is a window past them
+    sketch.observe('198.51.100.1', 22, T0 + 200)
+    assert sketch.source_count('203.0.113.5') == 0
+    assert list(sketch.slots) == [sketch.epoch(T0 + 200)]
+
+
+def test_spoofed_flood_does_not_make_every_source_hot():
+    detector = RateDetector(sketch=SlidingSketch(width=2048), source_threshold=20, port_threshold=10)
+    flood = [(int(T0 * 1000), {'src_host': f'10.{n // 65536}.{n // 256 % 256}.{n % 256}', 'dst_port': 22})
+             for n in range(60_000)]
+    hot_sources, hot_pairs = detector.observe(flood + attacks('203.0.113.5', 200), now=T0)
+
+    # A handful of collision-heavy cells out of 60000 sources
+    assert '203.0.113.5' in hot_sources and len(hot_sources) < 10
+    assert ('203.0.113.5', 22) in hot_pairs and len(hot_pairs) < 10
+    # Plain count-min puts every flood source near 60000 / 2048, over the threshold
+    cells = detector.sketch._cells(rate_detector.SOURCES, '10.0.0.1')
+    assert min(detector.sketch.live[0][cell] for cell in cells) >= 20
+    assert detector.sketch.source_count('10.0.0.1') < 5
+
+
+def test_noise_margin_never_takes_a_counted_source_below_one():
+    sketch = SlidingSketch(width=64)
+    for n in range(5000):
+        sketch.observe(f'10.0.{n // 256}.{n % 256}', None, T0)
+    assert sketch.source_count('10.0.0.1', margin=rate_detector.NOISE_MARGIN) == 1
+
+    # With a threshold of 1 every event acts again, however noisy the sketch
+    detector = RateDetector(sketch=sketch, source_threshold=1)
+    hot_sources, _ = detector.observe([(int(T0 * 1000), {'src_host': '10.0.0.7', 'dst_port': None})], now=T0)
+    assert hot_sources == {'10.0.0.7'}
+
+
+def test_thresholds():
+    detector = RateDetector(sketch=SlidingSketch(width=4096), source_threshold=20, port_threshold=10,
+                            distinct_port_threshold=5)
+    hot_sources, hot_pairs = detector.observe(
+        attacks('203.0.113.5', 19) + attacks('198.51.100.1', 6, ports=(21, 22, 23, 25, 80, 443))
+        + attacks('192.0.2.1', 10, ports=(22,)),
+        now=T0
+    )
+    assert hot_sources == {'198.51.100.1'}
+    assert hot_pairs == {('203.0.113.5', 22), ('192.0.2.1', 22)}
+
+
+@pytest.fixture
+def table(aws):
+    dynamodb = boto3.client('dynamodb')
+    dynamodb.create_table(
+        TableName=TABLE, BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'slot', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'slot', 'AttributeType': 'S'}]
+    )
+    return dynamodb
+
+
+def container(dynamodb):
+    store = SketchStore(TABLE, dynamodb)
+    return RateDetector(sketch=SlidingSketch(width=1024, shared=True), store=store, source_threshold=20)
+
+
+def test_containers_share_counts(table):
+    first, second = container(table), container(table)
+    assert first.observe(attacks('203.0.113.5', 12), now=T0)[0] == set()
+    # The second container sees the first one's 12 events plus its own 12
+    hot_sources, _ = second.observe(attacks('203.0.113.5', 12, start=T0 + 1), now=T0 + 1)
+    assert hot_sources == {'203.0.113.5'}
+    assert first.sketch.pending == second.sketch.pending == {}
+
+
+def test_lost_race_rereads_and_adds_instead_of_overwriting(table):
+    first, second = container(table), container(table)
+    # Both read the empty slot before either writes
+    for detector in (first, second):
+        detector.sketch.advance(T0)
+        detector.store.load(detector.sketch)
+    for detector, host in ((first, '203.0.113.5'), (second, '198.51.100.1')):
+        for seen_at, event in attacks(host, 7):
+            detector.sketch.observe(event['src_host'], event['dst_port'], seen_at / 1000)
+        detector.store.save(detector.sketch)
+
+    third = container(table)
+    third.sketch.advance(T0)
+    third.store.load(third.sketch)
+    assert third.sketch.source_count('203.0.113.5') == 7
+    assert third.sketch.source_count('198.51.100.1') == 7
+    epoch = third.sketch.epoch(T0)
+    assert third.store.versions == {epoch: 2}
+
+
+def test_slot_encoding_round_trips():
+    sketch = SlidingSketch(width=16, depth=2)
+    slot = sketch.empty_slot()
+    slot[0], slot[-1] = 1, 2 ** 32 - 1
+    assert rate_detector._decode(rate_detector._encode(slot)) == slot
@@ -0,0 +1,117 @@
+import json
+
+import boto3
+import pytest
+
+import lambda_remediation_worker as worker
+from metrics import Metrics
+from remediation_queue import alert_intent, block_intents, close_port_intents
+from waf_blocklist import Blocklist, IPSetShard
+
+
+@pytest.fixture
+def resources(aws, monkeypatch):
+    waf = boto3.client('wafv2')
+    ec2 = boto3.client('ec2')
+    sns = boto3.client('sns')
+
+    summary = waf.create_ip_set(Name='blocked', Scope='REGIONAL', IPAddressVersion='IPV4', Addresses=[])['Summary']
+    monkeypatch.setattr(worker, 'blocklist', Blocklist([IPSetShard('blocked', summary['Id'])], worker.waf_client))
+
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    group_id = ec2.create_security_group(GroupName='honeypot', Description='honeypot', VpcId=vpc_id)['GroupId']
+    ec2.authorize_security_group_ingress(GroupId=group_id, IpPermissions=[
+        {'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}
+        for port in (22, 23)
+    ])
+    monkeypatch.setitem(worker._sg_snapshot, 'group_id', None)
+
+    monkeypatch.setenv('SNS_TOPIC_ARN', sns.create_topic(Name='alerts')['TopicArn'])
+    return {'waf': waf, 'ec2': ec2, 'group_id': group_id, 'ip_set_id': summary['Id']}
+
+
+def sqs_event(*bodies):
+    """SQS records m0, m1, ... with the given bodies (dicts are JSON-encoded)"""
+    return {'Records': [
+        {'messageId': f'm{n}', 'body': body if isinstance(body, str) else json.dumps(body)}
+        for n, body in enumerate(bodies)
+    ]}
+
+
+def digest(ip, port=22, count=1):
+    return {'ip_address': ip, 'port_attacked': port, 'logtype': 4002, 'count': count,
+            'first_seen': '2025-04-25 10:00:00', 'last_seen': '2025-04-25 10:05:00', 'threat_score': 0.9}
+
+
+def failures(response):
+    return {failure['itemIdentifier'] for failure in response['batchItemFailures']}
+
+
+def open_ports(ec2, group_id):
+    group = ec2.describe_security_groups(GroupIds=[group_id])['SecurityGroups'][0]
+    return {permission['FromPort'] for permission in group['IpPermissions']}
+
+
+def test_only_messages_whose_work_failed_are_retried(resources):
+    event = sqs_event(
+        block_intents(['203.0.113.5'])[0],
+        'not json',
+        close_port_intents(resources['group_id'], [22])[0],
+        close_port_intents('sg-0123456789abcdef0', [23])[0],
+        {'action': 'reboot'},
+        block_intents(['2001:db8::1'])[0]
+    )
+    response = worker.process_batch(event, metrics=Metrics('Test'))
+
+    # Unreadable bodies and work that failed come back; an unknown action
+    # or an address WAF can never hold would fail forever, so they do not
+    assert failures(response) == {'m1', 'm3'}
+    assert worker.blocklist.is_blocked('203.0.113.5')
+    assert open_ports(resources['ec2'], resources['group_id']) == {23}
+
+
+def test_failed_waf_update_fails_every_message_with_a_block(resources, monkeypatch):
+    monkeypatch.setattr(worker, 'blocklist', Blocklist([IPSetShard('blocked', 'missing-id')], worker.waf_client))
+    event = sqs_event(
+        block_intents(['203.0.113.5'])[0],
+        block_intents(['203.0.113.5', '198.51.100.7'])[0],
+        close_port_intents(resources['group_id'], [23])[0]
+    )
+    response = worker.process_batch(event, metrics=Metrics('Test'))
+
+    assert failures(response) == {'m0', 'm1'}
+    assert open_ports(resources['ec2'], resources['group_id']) == {22}
+
+
+def test_unpublished_alerts_fail_every_message_merged_into_them(resources, monkeypatch):
+    monkeypatch.setenv('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:missing')
+    event = sqs_event(
+        alert_intent(digest('203.0.113.5', count=3), resources['group_id']),
+        block_intents(['203.0.113.5'])[0],
+        alert_intent(digest('203.0.113.5', count=4), resources['group_id'])
+    )
+    response = worker.process_batch(event, metrics=Metrics('Test'))
+
+    # Both digests were coalesced into one alert, so both are redelivered
+    assert failures(response) == {'m0', 'm2'}
+    assert worker.blocklist.is_blocked('203.0.113.5')
+
+
+def test_published_alert_reports_actions_taken(resources, monkeypatch):
+    published = []
+    original = worker.publish_alert_digests
+
+    def capture(sns_client, alerts):
+        published.extend(alert['digest'] for alert in alerts)
+        return original(sns_client, alerts)
+
+    monkeypatch.setattr(worker, 'publish_alert_digests', capture)
+    event = sqs_event(
+        block_intents(['203.0.113.5'])[0],
+        close_port_intents(resources['group_id'], [22])[0],
+        alert_intent(digest('203.0.113.5'), resources['group_id'])
+    )
+    response = worker.process_batch(event, metrics=Metrics('Test'))
+
+    assert failures(response) == set()
+    assert published[0]['actions_taken'] == {'waf_blocked': True, 'port_closed': True}
@@ -0,0 +1,71 @@
+import gzip
+import json
+
+import boto3
+import pytest
+
+import lambda_function
+from tests.test_awslogs_decoder import CONTROL, envelope, log_events
+
+TABLE = 'honeypot-results'
+BUCKET = 'log-archive'
+
+
+@pytest.fixture
+def ingest(aws, monkeypatch):
+    """Run the S3 ingest handler on one object; returns the stored items by event_id"""
+    s3 = boto3.client('s3')
+    dynamodb = boto3.client('dynamodb')
+    s3.create_bucket(Bucket=BUCKET)
+    dynamodb.create_table(
+        TableName=TABLE, BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'event_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'event_id', 'AttributeType': 'S'}]
+    )
+    monkeypatch.setattr(lambda_function, 'RESULTS_TABLE', TABLE)
+    monkeypatch.setattr(lambda_function, 'threat_model', None)
+
+    def run(key, body):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        response = lambda_function.lambda_handler({'Records': [
+            {'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key, 'size': len(body)}}}
+        ]}, None)
+        assert response['statusCode'] == 200, response
+        items = dynamodb.scan(TableName=TABLE)['Items']
+        return {item['event_id']['S']: item for item in items}
+
+    return run
+
+
+def firehose_object(events, compress):
+    """Firehose's S3 object for a CloudWatch Logs subscription: every record
+    is a gzip'd envelope, written back to back"""
+    records = [CONTROL] + [envelope(events[i:i + 4]) for i in range(0, len(events), 4)]
+    body = b''.join(gzip.compress(record.encode('utf-8')) for record in records)
+    return gzip.compress(body) if compress else body
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_firehose_envelopes_are_unpacked(ingest, compress):
+    events = log_events(10)
+    items = ingest('firehose/2025/04/25/10/honeypot-1.gz', firehose_object(events, compress))
+
+    assert len(items) == 10
+    item = items[f'{BUCKET}/firehose/2025/04/25/10/honeypot-1.gz#4']
+    assert item['src_host'] == {'S': '203.0.113.2'}
+    assert item['dst_port'] == {'N': '22'}
+    assert item['utc_time'] == {'S': '2025-04-25 10:00:02.000001'}
+    assert item['username'] == {'S': 'rööt-☃-2'}
+
+
+def test_opencanary_lines_still_ingest(ingest):
+    lines = '\n'.join(event['message'] for event in log_events(3)).encode('utf-8')
+    items = ingest('export/honeypot.json.gz', gzip.compress(lines))
+    assert sorted(items) == [f'{BUCKET}/export/honeypot.json.gz#{n}' for n in (1, 2, 3)]
+
+
+def test_exporter_csv_still_ingests(ingest):
+    body = 'utc_time,src_host,dst_port,logtype,username\n2025-04-25 10:00:00.000001,203.0.113.9,21,2000,\n'
+    items = ingest('input/honeypot.csv.gz', gzip.compress(body.encode('utf-8')))
+    assert items[f'{BUCKET}/input/honeypot.csv.gz#2']['dst_port'] == {'N': '21'}
+    assert 'username' not in items[f'{BUCKET}/input/honeypot.csv.gz#2']
@@ -0,0 +1,62 @@
+import pytest
+
+import lambda_threat_analyzer as analyzer
+
+WINDOW = analyzer.ALERT_WINDOW_SECONDS
+NOW = 1_745_575_200.0
+
+
+@pytest.fixture(autouse=True)
+def alert_groups(monkeypatch):
+    groups = {}
+    monkeypatch.setattr(analyzer, '_alert_groups', groups)
+    return groups
+
+
+def finding(src_host='203.0.113.5', dst_port=22):
+    return {'src_host': src_host, 'dst_port': dst_port, 'logtype': 4002}
+
+
+def test_findings_inside_the_window_fold_into_the_next_digest():
+    analyzer.record_alert(finding(), NOW * 1000, 0.9)
+    [(_, first)] = analyzer.flush_alerts(now=NOW)
+    assert first['count'] == 1
+
+    for n in range(3):
+        analyzer.record_alert(finding(), (NOW + 10 + n) * 1000, 0.5)
+    assert analyzer.flush_alerts(now=NOW + 60) == []
+
+    [(_, second)] = analyzer.flush_alerts(now=NOW + WINDOW)
+    assert second['count'] == 3
+    assert second['threat_score'] == 0.5
+
+
+def test_replayed_findings_are_still_throttled():
+    # Events an hour old: their timestamps are far outside the window, but
+    # the group was only just notified, so it must stay throttled
+    replayed = NOW - 3600
+    analyzer.record_alert(finding(), replayed * 1000)
+    assert len(analyzer.flush_alerts(now=NOW)) == 1
+    assert analyzer.flush_alerts(now=NOW + 1) == []
+
+    analyzer.record_alert(finding(), (replayed + 1) * 1000)
+    assert analyzer.flush_alerts(now=NOW + 2) == []
+    [(_, digest)] = analyzer.flush_alerts(now=NOW + WINDOW)
+    assert digest['count'] == 1
+
+
+def test_quiet_groups_are_dropped_a_window_after_their_digest(alert_groups):
+    analyzer.record_alert(finding(), NOW * 1000)
+    analyzer.flush_alerts(now=NOW)
+    analyzer.flush_alerts(now=NOW + WINDOW - 1)
+    assert alert_groups
+    analyzer.flush_alerts(now=NOW + WINDOW)
+    assert alert_groups == {}
+
+
+def test_requeued_digest_is_sent_again_at_once():
+    analyzer.record_alert(finding(), NOW * 1000)
+    [(_, digest)] = analyzer.flush_alerts(now=NOW)
+    analyzer.requeue_alerts([digest])
+    [(_, again)] = analyzer.flush_alerts(now=NOW + 1)
+    assert again['count'] == 1
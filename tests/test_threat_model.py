@@ -0,0 +1,138 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import boto3
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+
+import lambda_function  # noqa: E402
+import threat_model  # noqa: E402
+from Docker.Sagemaker.features import FEATURE_COLUMNS, HISTORY_MS, UTC_TIME_FORMAT  # noqa: E402
+from threat_model import ThreatModel, trailing_history  # noqa: E402
+
+START = datetime(2025, 4, 25, 12, 0, 0)
+SRC_EVENTS = FEATURE_COLUMNS.index('src_events')
+
+
+class Session:
+    """onnxruntime stand-in: records each input and scores src_events / 1000"""
+
+    def __init__(self):
+        self.inputs = []
+
+    def run(self, outputs, feeds):
+        matrix = feeds['input']
+        self.inputs.append(matrix)
+        threat = matrix[:, SRC_EVENTS] / 1000.0
+        return [np.column_stack([1 - threat, threat])]
+
+
+def honeypot_event(seconds, src_host='203.0.113.5', dst_port=22):
+    utc_time = (START + timedelta(seconds=seconds)).strftime(UTC_TIME_FORMAT)
+    return None, {'utc_time': utc_time, 'src_host': src_host, 'dst_port': dst_port, 'logtype': 4002, 'username': 'root'}
+
+
+@pytest.fixture
+def model(tmp_path):
+    model = ThreatModel('models', 'model.onnx', cache_path=str(tmp_path / 'model.onnx'), s3_client=object())
+    model.session, model.input_name, model.output_name = Session(), 'input', 'output_probability'
+    model.checked_at = time.time()
+    return model
+
+
+def test_batches_are_scored_against_the_warm_history(model):
+    first = [honeypot_event(s) for s in range(0, 300, 10)]
+    second = [honeypot_event(s) for s in range(300, 330, 10)] + [honeypot_event(305, src_host='198.51.100.1')]
+
+    model.score(first)
+    scores = model.score(second)
+
+    # 30 earlier events plus the batch's own, as if scored in one frame
+    assert list(scores) == pytest.approx([0.031, 0.032, 0.033, 0.001])
+    # The other source's history is left out of the frame
+    assert len(model.session.inputs[-1]) == 4
+    assert len(model.history) == 34
+
+
+def test_history_argument_leaves_the_warm_history_alone(model):
+    model.score([honeypot_event(0)])
+    scores = model.score([honeypot_event(20)], history=[honeypot_event(s) for s in (5, 10, 15)])
+    assert list(scores) == pytest.approx([0.004])
+    assert len(model.history) == 1
+
+
+def test_trailing_history_keeps_the_training_window():
+    events = [honeypot_event(s) for s in range(0, 3600, 60)] + [(None, {'utc_time': 'garbage'})]
+    # Newest event at 3540s, so the window starts at 3540s - HISTORY_MS
+    window = HISTORY_MS // 60_000 + 1
+    assert trailing_history(events) == events[-1 - window:-1]
+    assert trailing_history([(None, {'utc_time': None})]) == []
+
+
+def test_ingest_batches_score_like_one_frame(aws, model):
+    s3 = boto3.client('s3')
+    dynamodb = boto3.client('dynamodb')
+    s3.create_bucket(Bucket='honeypot-logs')
+    dynamodb.create_table(
+        TableName='results', BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'event_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'event_id', 'AttributeType': 'S'}]
+    )
+    events = [honeypot_event(s, src_host=f'203.0.113.{s % 3}') for s in range(0, 1800, 15)]
+    s3.put_object(Bucket='honeypot-logs', Key='honeypot.json', Body='\n'.join(json.dumps(data) for _, data in events).encode())
+
+    def stored_scores(batch_rows):
+        lambda_function.process_object(s3, dynamodb, 'honeypot-logs', 'honeypot.json', 'results', model, batch_rows=batch_rows)
+        items = dynamodb.scan(TableName='results')['Items']
+        return {item['event_id']['S']: item['threat_score']['N'] for item in items}
+
+    batched = stored_scores(7)
+    assert len(batched) == len(events)
+    assert batched == stored_scores(len(events))
+
+
+def test_refresh_revalidates_by_etag(aws, tmp_path, monkeypatch):
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='models')
+    s3.put_object(Bucket='models', Key='model.onnx', Body=b'first model')
+    loads = []
+    monkeypatch.setattr(ThreatModel, '_load', lambda self: (loads.append(open(self.cache_path, 'rb').read()),
+                                                             setattr(self, 'session', object())))
+    cache_path = str(tmp_path / 'model.onnx')
+
+    model = ThreatModel('models', 'model.onnx', cache_path=cache_path, s3_client=s3)
+    assert model.refresh(now=1000.0)
+    assert loads == [b'first model']
+    first_etag = model.etag
+
+    # Within MODEL_REFRESH_SECONDS nothing is fetched; after it the
+    # conditional GET comes back 304 and the session is kept
+    s3.put_object(Bucket='models', Key='model.onnx', Body=b'second model')
+    assert model.refresh(now=1000.0 + threat_model.MODEL_REFRESH_SECONDS - 1)
+    assert loads == [b'first model']
+    s3.put_object(Bucket='models', Key='model.onnx', Body=b'first model')
+    assert model.refresh(now=1000.0 + threat_model.MODEL_REFRESH_SECONDS + 1)
+    assert loads == [b'first model'] and model.etag == first_etag
+
+    # A new training run is picked up on the next check
+    s3.put_object(Bucket='models', Key='model.onnx', Body=b'second model')
+    assert model.refresh(now=2000.0 + threat_model.MODEL_REFRESH_SECONDS)
+    assert loads == [b'first model', b'second model']
+
+    # A new container reuses the cached file when its ETag still matches
+    cold = ThreatModel('models', 'model.onnx', cache_path=cache_path, s3_client=s3)
+    assert cold.refresh(now=3000.0)
+    assert cold.etag == model.etag and loads[-1] == b'second model' and len(loads) == 3
+
+
+def test_refresh_keeps_the_current_model_when_s3_fails(aws, model):
+    model.s3 = boto3.client('s3')
+    model.checked_at = 0.0
+    session = model.session
+    assert model.refresh(now=10_000.0)
+    assert model.session is session
+    model.session = None
+    assert not model.refresh(now=20_000.0)
@@ -0,0 +1,112 @@
+import random
+
+import boto3
+import pytest
+
+import waf_blocklist
+from waf_blocklist import Blocklist, IPSetShard, host_network
+
+# DynamoDB rejects larger items; moto enforces the same limit
+DYNAMODB_ITEM_LIMIT = 400 * 1024
+
+NOW = 1_745_575_200
+
+
+def random_ips(count, seed):
+    rnd = random.Random(seed)
+    return list({f"{rnd.randrange(1, 223)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}"
+                 for _ in range(count)})
+
+
+@pytest.fixture
+def setup(aws):
+    waf = boto3.client('wafv2')
+    dynamodb = boto3.client('dynamodb')
+    dynamodb.create_table(
+        TableName='blocklist',
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    ids = []
+    for n in range(2):
+        summary = waf.create_ip_set(Name=f'blocked-{n}', Scope='REGIONAL', IPAddressVersion='IPV4', Addresses=[])
+        ids.append(summary['Summary']['Id'])
+
+    def blocklist(shards=2, **kwargs):
+        return Blocklist([IPSetShard(f'blocked-{n}', ids[n]) for n in range(shards)], waf,
+                         table='blocklist', dynamodb_client=dynamodb, **kwargs)
+
+    def item_sizes():
+        items = dynamodb.scan(TableName='blocklist')['Items']
+        return {item['name']['S']: len(item['entries']['B']) for item in items}
+
+    return blocklist, item_sizes
+
+
+def test_default_item_cap_is_under_the_dynamodb_limit():
+    assert waf_blocklist.MAX_ITEM_BYTES < DYNAMODB_ITEM_LIMIT
+
+
+def test_index_past_the_item_limit_evicts_the_oldest_blocks(setup):
+    blocklist, item_sizes = setup
+    # WAF capacity is not the limit here, the index item is
+    bl = blocklist(shards=1, capacity=10 ** 6)
+    old = random_ips(10_000, seed=1)
+    bl.block(old, now=NOW)
+
+    # Enough new sources that the index, unbounded, would not fit in an item
+    new = list(set(random_ips(65_000, seed=2)) - set(old))
+    blocked = bl.block(new, now=NOW + 3600)
+
+    sizes = item_sizes()
+    assert 0 < sizes['honeypot#0'] <= waf_blocklist.MAX_ITEM_BYTES
+    assert blocked == set(new)
+    assert all(bl.is_blocked(ip) for ip in new)
+    evicted = [ip for ip in old if not bl.is_blocked(ip)]
+    assert evicted
+
+    # Another container reads back exactly what was kept (stored collapsed)
+    other = blocklist(shards=1, capacity=10 ** 6)
+    other.block([], now=NOW + 3600)
+    assert all(other.is_blocked(ip) for ip in new)
+    assert [ip for ip in old if not other.is_blocked(ip)] == evicted
+
+
+def test_full_item_sends_new_blocks_to_the_next_shard(setup, monkeypatch):
+    blocklist, item_sizes = setup
+    monkeypatch.setattr(waf_blocklist, 'MAX_ITEM_BYTES', 20_000)
+    bl = blocklist()
+    ips = random_ips(5_000, seed=3)
+    for n in range(0, len(ips), 1_000):
+        bl.block(ips[n:n + 1_000], now=NOW + n)
+
+    sizes = item_sizes()
+    assert set(sizes) == {'honeypot#0', 'honeypot#1'}
+    assert all(size <= 20_000 for size in sizes.values())
+    # The second shard took the overflow, so nothing had to be evicted
+    assert all(bl.is_blocked(ip) for ip in ips)
+    assert sum(len(bl.collapsed(n)) for n in range(2)) == len(ips)
+
+
+def test_adjacent_sources_are_stored_collapsed(setup):
+    blocklist, item_sizes = setup
+    bl = blocklist()
+    sweep = [f"198.51.{n // 256}.{n % 256}" for n in range(4096)]
+    assert bl.block(sweep, now=NOW) == set(sweep)
+    assert bl.collapsed(0) == ['198.51.0.0/20']
+    assert item_sizes()['honeypot#0'] < 200
+
+    other = blocklist()
+    other.block(['8.8.8.8'], now=NOW + 60)
+    assert other.is_blocked('198.51.3.7')
+    assert not other.is_blocked('198.51.16.1')
+
+
+def test_expired_blocks_leave_the_index_and_waf(setup):
+    blocklist, _ = setup
+    bl = blocklist(ttl=600)
+    bl.block(['203.0.113.5', '203.0.113.77'], now=NOW)
+    bl.block(['192.0.2.1'], now=NOW + 600)
+    assert set(bl.entries) == {host_network('192.0.2.1')}
+    assert bl.collapsed(0) == ['192.0.2.1/32']
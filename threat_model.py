@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+from aws_clients import client
+from botocore.exceptions import ClientError
+
+# numpy, pandas and onnxruntime come from a Lambda layer; without them the
+# analyzer still runs and remediates every event as before. The feature
+# code is the training image's, so the Lambda package carries the Docker
+# package as is
+try:
+    import numpy as np
+    import pandas as pd
+    from Docker.Sagemaker.features import HISTORY_MS, UTC_TIME_FORMAT, build_features, events_frame, feature_matrix
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+MODEL_CACHE_PATH = '/tmp/model.onnx'
+
+# Seconds a warm container trusts its model before a conditional GET
+MODEL_REFRESH_SECONDS = int(os.environ.get('MODEL_REFRESH_SECONDS', '300'))
+
+# Bound on the events kept as history; the time bound is the training
+# window, HISTORY_MS, so per-source features see what they saw in training
+FEATURE_HISTORY_MAX_EVENTS = 50000
+
+
+def trailing_history(events):
+    """The (seen_at, honeypot_data) events within HISTORY_MS of the newest utc_time.
+
+    Events without a parseable utc_time are dropped; build_features would
+    drop them anyway.
+    """
+    times = pd.to_datetime(pd.Series([data.get('utc_time') for _, data in events], dtype=object),
+                           format=UTC_TIME_FORMAT, errors='coerce')
+    if times.isna().all():
+        return []
+    keep = (times >= times.max() - pd.Timedelta(milliseconds=HISTORY_MS)).to_numpy()
+    return [event for event, kept in zip(events, keep) if kept][-FEATURE_HISTORY_MAX_EVENTS:]
+
+
+class ThreatModel:
+    """The train.py model.onnx, scored in-process with onnxruntime.
+
+    The model is downloaded once per container into /tmp and revalidated by
+    ETag at most every MODEL_REFRESH_SECONDS, so a warm invocation costs no
+    S3 call and a new training run is picked up without a redeploy.
+    """
+
+    def __init__(self, bucket, key, cache_path=MODEL_CACHE_PATH, s3_client=None):
+        self.bucket = bucket
+        self.key = key
+        self.cache_path = cache_path
+        self.s3 = s3_client or client('s3')
+        self.session = None
+        self.etag = None
+        self.checked_at = 0.0
+        self.history = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Model from MODEL_BUCKET/MODEL_KEY, or None when scoring is not configured"""
+        bucket, key = os.environ.get('MODEL_BUCKET'), os.environ.get('MODEL_KEY')
+        if not bucket or not key:
+            print("MODEL_BUCKET/MODEL_KEY not set; events will not be scored")
+            return None
+        if onnxruntime is None:
+            print("onnxruntime, numpy or pandas is not installed; events will not be scored")
+            return None
+        return cls(bucket, key)
+
+    def refresh(self, now=None):
+        """Load or revalidate the model; returns False if none is available"""
+        now = now or time.time()
+        if self.session is not None and now - self.checked_at < MODEL_REFRESH_SECONDS:
+            return True
+        self.checked_at = now
+
+        etag_path = f"{self.cache_path}.etag"
+        if self.etag is None and os.path.exists(self.cache_path) and os.path.exists(etag_path):
+            with open(etag_path) as f:
+                self.etag = f.read().strip()
+
+        try:
+            kwargs = {'IfNoneMatch': self.etag} if self.etag else {}
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                if self.session is None:
+                    self._load()
+                return True
+            print(f"Error fetching model s3://{self.bucket}/{self.key}: {str(e)}")
+            # Keep scoring with whatever model we already have
+            return self.session is not None
+
+        with open(self.cache_path, 'wb') as f:
+            for chunk in response['Body'].iter_chunks(1024 * 1024):
+                f.write(chunk)
+        self.etag = response['ETag']
+        with open(etag_path, 'w') as f:
+            f.write(self.etag)
+        self._load()
+        print(f"Loaded model s3://{self.bucket}/{self.key} ({self.etag})")
+        return True
+
+    def _load(self):
+        self.session = onnxruntime.InferenceSession(self.cache_path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        outputs = [o.name for o in self.session.get_outputs()]
+        self.output_name = 'output_probability' if 'output_probability' in outputs else outputs[-1]
+
+    def score(self, events, history=None):
+        """Threat probability per (seen_at, honeypot_data) event, in one onnxruntime call.
+
+        Returns None when no model is available. Events the features cannot
+        describe (no time or source) score NaN. By default the batch is
+        scored against the warm history and then joins it. Passing history
+        (earlier events, e.g. from trailing_history) scores against that
+        instead and leaves the warm history alone, which lets several
+        threads score unrelated streams at once.
+        """
+        if not events:
+            return None
+        with self.lock:
+            if not self.refresh():
+                return None
+            session, input_name, output_name = self.session, self.input_name, self.output_name
+            # Features are computed over recent history plus the batch, then
+            # the batch rows are sliced back out
+            context = history
+            if context is None:
+                context = self.history
+                self.history = trailing_history(self.history + list(events))
+        # Only a source's own events feed its features
+        sources = {data.get('src_host') for _, data in events}
+        context = [event for event in context if event[1].get('src_host') in sources]
+
+        frame = events_frame([data for _, data in context] + [data for _, data in events])
+        features = build_features(frame)
+        batch = features.index >= len(context)
+        rows = features.index[batch] - len(context)
+
+        scores = np.full(len(events), np.nan)
+        if not len(rows):
+            return scores
+
+        probabilities = session.run([output_name], {input_name: feature_matrix(features[batch])})[0]
+        if isinstance(probabilities, list):
+            # Models exported with a ZipMap output: one {class: probability} dict per row
+            probabilities = np.array([[p.get(0, 0.0), p.get(1, 0.0)] for p in probabilities])
+        # A model fitted on a single class has no threat column
+        scores[rows] = probabilities[:, 1] if probabilities.shape[1] > 1 else 0.0
+        return scores
@@ -50,3 +50,39 @@ variable "model_key" {
   description = "S3 key (path) to the ONNX model file"
   type        = string
 }
+
+variable "waf_ip_set_shards" {
+  description = "Number of WAF IP sets the threat analyzer spreads blocks over (10,000 CIDRs each)"
+  type        = number
+  default     = 2
+
+  validation {
+    condition     = var.waf_ip_set_shards >= 1
+    error_message = "At least one WAF IP set is required."
+  }
+}
+
+variable "threat_analyzer_layers" {
+  description = "Lambda layer ARNs providing numpy, pandas and onnxruntime to the threat analyzer"
+  type        = list(string)
+  default     = []
+}
+
+variable "honeypot_compaction_layers" {
+  description = "Lambda layer ARNs providing pyarrow to the honeypot log compaction function"
+  type        = list(string)
+  default     = []
+}
+
+# Required, with no default: it is also the log indexer's notification
+# filter_prefix, and an empty prefix would fire the indexer on its own
+# index/ writes
+variable "chatbot_log_key" {
+  description = "Key in the cleaned logs bucket the chatbot answers questions about (required); the log indexer runs on every write to it"
+  type        = string
+
+  validation {
+    condition     = length(var.chatbot_log_key) > 0 && !startswith(var.chatbot_log_key, "index/")
+    error_message = "chatbot_log_key must name the chatbot's log, outside index/."
+  }
+}
@@ -33,10 +33,36 @@ resource "aws_wafv2_web_acl" "threat_acl" {
     }
   }
 
-  # Rule 2: AWS Managed Rules - Common Rule Set
+  # Rules 2..N: overflow IP sets, filled once the first one is full
+  dynamic "rule" {
+    for_each = aws_wafv2_ip_set.blocked_ips_overflow
+
+    content {
+      name     = "BlockBadIPs-${rule.key + 2}"
+      priority = rule.key + 2
+
+      action {
+        block {}
+      }
+
+      statement {
+        ip_set_reference_statement {
+          arn = rule.value.arn
+        }
+      }
+
+      visibility_config {
+        cloudwatch_metrics_enabled = true
+        metric_name                = "BlockedHoneypotIPs${rule.key + 2}"
+        sampled_requests_enabled   = true
+      }
+    }
+  }
+
+  # AWS Managed Rules - Common Rule Set, after every blocklist shard
   rule {
     name     = "AWSManagedRulesCommonRuleSet"
-    priority = 2
+    priority = 100
 
     override_action {
       none {}
@@ -79,6 +105,11 @@ resource "aws_wafv2_ip_set" "blocked_ips" {
   ip_address_version = "IPV4"
   addresses          = [] # Initially empty
 
+  # The threat analyzer owns the contents; apply must not wipe them
+  lifecycle {
+    ignore_changes = [addresses]
+  }
+
   tags = {
     Name        = "${var.project_name}-blocked-ips"
     Environment = terraform.workspace
@@ -87,6 +118,40 @@ resource "aws_wafv2_ip_set" "blocked_ips" {
   }
 }
 
+# Further shards of the blocklist, used once the first set holds 10,000 CIDRs
+resource "aws_wafv2_ip_set" "blocked_ips_overflow" {
+  count              = var.waf_ip_set_shards - 1
+  name               = "${var.project_name}-blocked-ip-set-${count.index + 2}-${terraform.workspace}"
+  description        = "Overflow IP set ${count.index + 2} for threats detected by honeypot"
+  scope              = "REGIONAL"
+  ip_address_version = "IPV4"
+  addresses          = []
+
+  lifecycle {
+    ignore_changes = [addresses]
+  }
+
+  tags = {
+    Name        = "${var.project_name}-blocked-ips-${count.index + 2}"
+    Environment = terraform.workspace
+    Project     = var.project_name
+    Terraform   = "true"
+  }
+}
+
+# Expiry times and shard of every blocked network, shared by all analyzer
+# containers; the IP sets are rebuilt from it
+resource "aws_dynamodb_table" "waf_blocklist" {
+  name         = "${var.project_name}-waf-blocklist-${terraform.workspace}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "name"
+
+  attribute {
+    name = "name"
+    type = "S"
+  }
+}
+
 # CloudWatch Log Group for WAF Logs
 resource "aws_cloudwatch_log_group" "waf_logs" {
   name              = "/aws/waf/${var.project_name}-${terraform.workspace}"
@@ -105,3 +170,8 @@ output "waf_ip_set_id" {
   value       = aws_wafv2_ip_set.blocked_ips.id
   description = "The ID of the WAF IP set for blocking threats"
 }
+
+output "waf_ip_set_ids" {
+  value       = concat([aws_wafv2_ip_set.blocked_ips.id], aws_wafv2_ip_set.blocked_ips_overflow[*].id)
+  description = "The IDs of every WAF IP set the blocklist is sharded over"
+}
@@ -0,0 +1,442 @@
+import bisect
+import heapq
+import ipaddress
+import json
+import os
+import random
+import socket
+import time
+import zlib
+
+from aws_clients import lazy
+from botocore.exceptions import ClientError
+
+# Seconds a source stays blocked after it was last remediated
+BLOCK_TTL_SECONDS = int(os.environ.get('BLOCK_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# WAF allows 10,000 addresses (CIDRs, after collapsing) per IP set
+IP_SET_CAPACITY = int(os.environ.get('WAF_IP_SET_CAPACITY', '10000'))
+
+# Optional DynamoDB table (hash key name) holding the block index shared by
+# every container, one item per IP set; without it each container keeps its
+# own index, seeded from the IP sets on a cold start
+BLOCKLIST_TABLE = os.environ.get('BLOCKLIST_TABLE')
+BLOCKLIST_NAME = 'honeypot'
+
+# Compressed index bytes per item, leaving headroom under DynamoDB's 400 KB
+# item limit for the key and version attributes
+MAX_ITEM_BYTES = int(os.environ.get('BLOCKLIST_MAX_ITEM_BYTES', str(350 * 1024)))
+
+# Stored expiries are rounded down to this many seconds, so networks blocked
+# together share a group and are stored collapsed
+EXPIRY_GRANULARITY = 60
+
+# Retries for concurrent writers racing on an IP set LockToken or the index version
+WAF_MAX_ATTEMPTS = 5
+WAF_BACKOFF_BASE = 0.2
+
+
+def _backoff(attempt):
+    time.sleep(WAF_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def host_network(ip):
+    """'203.0.113.7' -> '203.0.113.7/32'; None for anything WAF's IPv4 sets cannot hold"""
+    try:
+        network = ipaddress.ip_network(ip)
+    except ValueError:
+        return None
+    return str(network) if network.version == 4 else None
+
+
+def _range(cidr):
+    """'203.0.113.0/30' -> (first, last) address as integers"""
+    address, _, prefix = cidr.partition('/')
+    size = 1 << (32 - int(prefix or 32))
+    start = int.from_bytes(socket.inet_aton(address), 'big') & ~(size - 1)
+    return start, start + size - 1
+
+
+def collapse(cidrs):
+    """The fewest CIDRs covering exactly the same addresses.
+
+    Same result as ipaddress.collapse_addresses, on plain integers; about
+    eight times faster on a full 10,000-entry IP set.
+    """
+    merged = []
+    for start, end in sorted(map(_range, cidrs)):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    out = []
+    for start, end in merged:
+        while start <= end:
+            # Largest aligned block starting here that does not run past end
+            bits = min((start & -start).bit_length() - 1 if start else 32, (end - start + 1).bit_length() - 1)
+            out.append(f"{socket.inet_ntoa(start.to_bytes(4, 'big'))}/{32 - bits}")
+            start += 1 << bits
+    return out
+
+
+class IPSetShard:
+    """One WAF IP set and the addresses and LockToken last seen for it"""
+
+    def __init__(self, name, ip_set_id):
+        self.name = name
+        self.id = ip_set_id
+        self.addresses = None
+        self.lock_token = None
+
+
+def encode_shard(entries, index):
+    """One shard's index entries as zlib'd JSON [[expires_at, [cidr, ...]], ...].
+
+    Networks sharing a (rounded-down) expiry are collapsed, so a burst of
+    adjacent sources is stored as the few supernets WAF holds it as.
+    """
+    groups = {}
+    for cidr, (expires_at, shard) in entries.items():
+        if shard == index:
+            rounded = int(expires_at) // EXPIRY_GRANULARITY * EXPIRY_GRANULARITY
+            groups.setdefault(rounded, []).append(cidr)
+    body = [[expires_at, collapse(cidrs)] for expires_at, cidrs in sorted(groups.items())]
+    return zlib.compress(json.dumps(body, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_shard(body, index):
+    return {cidr: (expires_at, index) for expires_at, cidrs in json.loads(zlib.decompress(body)) for cidr in cidrs}
+
+
+class Blocklist:
+    """Expiring WAF blocklist spread over one or more IP sets.
+
+    The index maps every blocked network to (expires_at, shard) and is the
+    source of truth; each IP set holds its shard's networks collapsed into
+    supernets, so adjacent sources cost one WAF entry. A block only reaches
+    WAF when a shard's collapsed contents actually change, and a repeat
+    offender's block is renewed in the index alone. New networks fill the
+    first shard with room; when every shard is full, or a shard's stored
+    index would outgrow a DynamoDB item, the blocks closest to expiry are
+    dropped so fresh attackers are still blocked.
+    """
+
+    def __init__(self, shards, waf_client=None, table=None, dynamodb_client=None,
+                 ttl=BLOCK_TTL_SECONDS, capacity=IP_SET_CAPACITY, scope='REGIONAL'):
+        self.shards = shards
+        self.waf = waf_client or lazy('wafv2')
+        self.table = table
+        self.dynamodb = dynamodb_client or lazy('dynamodb')
+        self.ttl = ttl
+        self.capacity = capacity
+        self.scope = scope
+        self.entries = None
+        # Version of each shard's index item as last read or written
+        self.versions = [0] * len(shards)
+        # Prefix lengths of indexed networks wider than a /32, e.g. adopted
+        # from an IP set or collapsed by another container's save
+        self.prefixes = set()
+        # Networks this container expired (cidr -> when), so a stale IP set
+        # read during a race does not bring them back
+        self.removed = {}
+        # Shards whose IP set still differs from the index
+        self.dirty = set()
+        # Collapsed contents per shard, dropped whenever the shard's entries change
+        self._collapsed = {}
+        # Encoded index size per shard as last saved; a shard near the item
+        # limit takes no new networks, like one whose IP set is full
+        self._item_bytes = {}
+
+    @classmethod
+    def from_env(cls, waf_client=None):
+        """Shards from WAF_IP_SET_NAMES / WAF_IP_SET_IDS (comma separated, same order)"""
+        names = [n for n in os.environ.get('WAF_IP_SET_NAMES', '').split(',') if n]
+        ids = [i for i in os.environ.get('WAF_IP_SET_IDS', '').split(',') if i]
+        if not ids:
+            # Single-set deployments name the set after the project, as in waf.tf
+            names = [f"{os.environ.get('PROJECT_NAME', 'darktracer')}-blocked-ip-set-{os.environ.get('ENV', 'dev')}"]
+            ids = [os.environ.get('IP_SET_ID') or os.environ.get('WAF_IP_SET_ID')]
+        return cls([IPSetShard(name, ip_set_id) for name, ip_set_id in zip(names, ids)],
+                   waf_client=waf_client, table=BLOCKLIST_TABLE)
+
+    # ---- index ----
+
+    def _key(self, index):
+        return {'name': {'S': f"{BLOCKLIST_NAME}#{index}"}}
+
+    def _load(self, now):
+        self._collapsed = {}
+        self.entries = {}
+        self.versions = [0] * len(self.shards)
+        if self.table:
+            request = {self.table: {'Keys': [self._key(i) for i in range(len(self.shards))], 'ConsistentRead': True}}
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table, []):
+                    index = int(item['name']['S'].rpartition('#')[2])
+                    self.entries.update(decode_shard(item['entries']['B'], index))
+                    self._item_bytes[index] = len(item['entries']['B'])
+                    self.versions[index] = int(item['version']['N'])
+                request = response.get('UnprocessedKeys') or None
+
+        # Shards with no index yet (or none shared): whatever the IP set
+        # holds now is blocked from now on, so existing blocks survive and
+        # expire normally
+        for index, shard in enumerate(self.shards):
+            if not self.versions[index]:
+                self._fetch(shard)
+                self._adopt(index, shard, now)
+        self.prefixes = {int(cidr.rpartition('/')[2]) for cidr in self.entries} - {32}
+
+    def _save(self, shards):
+        """Write the shards' index items if nobody else has since they were read.
+
+        Returns False on a lost race; shards written before it keep their
+        new version and are simply reread.
+        """
+        if not self.table:
+            return True
+        for index in sorted(shards):
+            version = self.versions[index]
+            if version == 0:
+                condition = {'ConditionExpression': 'attribute_not_exists(#name)',
+                             'ExpressionAttributeNames': {'#name': 'name'}}
+            else:
+                condition = {'ConditionExpression': '#version = :v',
+                             'ExpressionAttributeNames': {'#version': 'version'},
+                             'ExpressionAttributeValues': {':v': {'N': str(version)}}}
+            try:
+                self.dynamodb.put_item(TableName=self.table, Item={
+                    **self._key(index),
+                    'entries': {'B': self._fit(index)},
+                    'version': {'N': str(version + 1)}
+                }, **condition)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                return False
+            self.versions[index] = version + 1
+        return True
+
+    def _fit(self, index):
+        """The shard's encoded index, dropping the blocks closest to expiry
+        until it fits in one DynamoDB item"""
+        body = encode_shard(self.entries, index)
+        self._item_bytes[index] = len(body)
+        if len(body) <= MAX_ITEM_BYTES:
+            return body
+        remaining = sorted((expires_at, cidr) for cidr, (expires_at, shard) in self.entries.items() if shard == index)
+        dropped = 0
+        while len(body) > MAX_ITEM_BYTES and remaining:
+            # Size is roughly linear in entries, so one or two passes suffice
+            keep = int(len(remaining) * MAX_ITEM_BYTES * 0.95 / len(body))
+            drop = max(1, len(remaining) - keep)
+            for _, cidr in remaining[:drop]:
+                del self.entries[cidr]
+            remaining = remaining[drop:]
+            dropped += drop
+            body = encode_shard(self.entries, index)
+        self._item_bytes[index] = len(body)
+        self._collapsed.pop(index, None)
+        self.dirty.add(index)
+        print(f"Blocklist index for {self.shards[index].name} over {MAX_ITEM_BYTES} bytes; evicted {dropped} blocks early")
+        return body
+
+    def _covering(self, cidr):
+        """The indexed network containing cidr (a /32), or None"""
+        if cidr in self.entries:
+            return cidr
+        if not self.prefixes:
+            return None
+        start, _ = _range(cidr)
+        for prefix in sorted(self.prefixes, reverse=True):
+            size = 1 << (32 - prefix)
+            network = f"{socket.inet_ntoa((start & ~(size - 1)).to_bytes(4, 'big'))}/{prefix}"
+            if network in self.entries:
+                return network
+        return None
+
+    def _adopt(self, index, shard, now):
+        """Index networks found in an IP set that overlap nothing this container knows about"""
+        ranges = sorted(map(_range, list(self.entries) + list(self.removed)))
+        starts = [start for start, _ in ranges]
+        # Running maximum of range ends, so one bisect answers "overlaps anything?"
+        reach, running = [], -1
+        for _, end in ranges:
+            running = max(running, end)
+            reach.append(running)
+
+        for cidr in shard.addresses:
+            start, end = _range(cidr)
+            i = bisect.bisect_right(starts, end) - 1
+            if i < 0 or reach[i] < start:
+                self.entries[cidr] = (now + self.ttl, index)
+                self.prefixes.add(int(cidr.rpartition('/')[2]))
+        self.prefixes.discard(32)
+        self._collapsed.pop(index, None)
+
+    # ---- WAF ----
+
+    def _fetch(self, shard):
+        response = self.waf.get_ip_set(Name=shard.name, Scope=self.scope, Id=shard.id)
+        shard.addresses = set(response['IPSet']['Addresses'])
+        shard.lock_token = response['LockToken']
+
+    def collapsed(self, index):
+        """The shard's networks as they go to WAF"""
+        if index not in self._collapsed:
+            self._collapsed[index] = collapse(cidr for cidr, (_, shard) in self.entries.items() if shard == index)
+        return self._collapsed[index]
+
+    def _sync(self, index, now):
+        """Make one IP set match the index; True once it does"""
+        shard = self.shards[index]
+        for attempt in range(WAF_MAX_ATTEMPTS):
+            try:
+                if shard.lock_token is None:
+                    self._fetch(shard)
+                desired = self.collapsed(index)
+                if set(desired) == shard.addresses:
+                    return True
+                response = self.waf.update_ip_set(
+                    Name=shard.name,
+                    Scope=self.scope,
+                    Id=shard.id,
+                    Addresses=desired,
+                    LockToken=shard.lock_token
+                )
+                shard.addresses = set(desired)
+                shard.lock_token = response['NextLockToken']
+                return True
+            except self.waf.exceptions.WAFOptimisticLockException:
+                # Another container wrote this set; pick up what it knew first
+                shard.lock_token = None
+                if self.table:
+                    self._load(now)
+                else:
+                    self._fetch(shard)
+                    self._adopt(index, shard, now)
+                print(f"WAF IP set {shard.name} changed concurrently ({attempt + 1}/{WAF_MAX_ATTEMPTS})")
+                _backoff(attempt)
+            except Exception as e:
+                shard.lock_token = None
+                print(f"Error updating WAF IP set {shard.name}: {str(e)}")
+                return False
+        print(f"Giving up on WAF IP set {shard.name} after {WAF_MAX_ATTEMPTS} attempts")
+        return False
+
+    # ---- public ----
+
+    def _apply(self, wanted, now):
+        """Expire, renew and add entries in place; returns the shards whose contents changed"""
+        changed = set()
+        for cidr, (expires_at, shard) in list(self.entries.items()):
+            if expires_at <= now:
+                del self.entries[cidr]
+                self.removed[cidr] = now
+                changed.add(shard)
+                self._collapsed.pop(shard, None)
+        self.removed = {cidr: at for cidr, at in self.removed.items() if at > now - self.ttl}
+
+        sizes = [len(self.collapsed(i)) for i in range(len(self.shards))]
+        # Blocks by expiry, built on the first eviction; entries renewed
+        # since they were pushed are skipped when popped
+        expiring = None
+        evictions = 0
+        for cidr in wanted:
+            self.removed.pop(cidr, None)
+            covering = self._covering(cidr)
+            if covering is not None:
+                self.entries[covering] = (now + self.ttl, self.entries[covering][1])
+                continue
+            shard = next((i for i, size in enumerate(sizes)
+                          if size < self.capacity and self._item_bytes.get(i, 0) < MAX_ITEM_BYTES * 0.9), None)
+            if shard is None:
+                # Every set is full: the block closest to expiry makes room
+                if expiring is None:
+                    expiring = [(expires_at, c) for c, (expires_at, _) in self.entries.items()]
+                    heapq.heapify(expiring)
+                while True:
+                    expires_at, evicted = heapq.heappop(expiring)
+                    if evicted in self.entries and self.entries[evicted][0] == expires_at:
+                        break
+                shard = self.entries.pop(evicted)[1]
+                self._collapsed.pop(shard, None)
+                evictions += 1
+                sizes[shard] -= 1
+            self.entries[cidr] = (now + self.ttl, shard)
+            if expiring is not None:
+                heapq.heappush(expiring, (now + self.ttl, cidr))
+            sizes[shard] += 1
+            changed.add(shard)
+            self._collapsed.pop(shard, None)
+        if evictions:
+            print(f"WAF IP sets full; evicted {evictions} blocks early")
+        return changed
+
+    def is_blocked(self, ip):
+        """True if ip's block is in the index and its IP set is up to date"""
+        cidr = host_network(ip) if ip else None
+        if cidr is None or self.entries is None:
+            return False
+        covering = self._covering(cidr)
+        return covering is not None and self.entries[covering][1] not in self.dirty
+
+    def block(self, ip_addresses, now=None):
+        """Block a batch of source IPs; returns the IPs blocked once WAF is updated.
+
+        Blocks already in the index with more than half their TTL left cost
+        no API calls at all.
+        """
+        now = now or time.time()
+        wanted = {}
+        for ip in ip_addresses:
+            cidr = host_network(ip) if ip else None
+            if cidr:
+                wanted[cidr] = ip
+        if not wanted and self.entries is not None and not self.dirty:
+            if all(expires_at > now for expires_at, _ in self.entries.values()):
+                return set()
+
+        try:
+            if self.entries is None:
+                self._load(now)
+                self.dirty = set(range(len(self.shards)))
+
+            covering = {c: self._covering(c) for c in wanted}
+            due = [c for c, k in covering.items() if k is None or self.entries[k][0] - now < self.ttl / 2]
+            expired = any(expires_at <= now for expires_at, _ in self.entries.values())
+            # Shards just seeded from their IP sets are saved so their TTLs stick
+            seeded = {i for i in range(len(self.shards)) if not self.versions[i] and self.collapsed(i)} if self.table else set()
+            if due or expired or seeded:
+                for attempt in range(WAF_MAX_ATTEMPTS):
+                    renewed = {self.entries[k][1] for k in map(self._covering, due) if k is not None}
+                    changed = self._apply(due, now)
+                    if self._save(changed | renewed | seeded):
+                        self.dirty |= changed
+                        break
+                    self._load(now)
+                    _backoff(attempt)
+                else:
+                    print(f"Giving up on blocklist index update after {WAF_MAX_ATTEMPTS} attempts")
+                    self.entries = None
+                    return set()
+        except Exception as e:
+            self.entries = None
+            print(f"Error loading WAF blocklist: {str(e)}")
+            return set()
+
+        for index in sorted(self.dirty):
+            if self._sync(index, now):
+                self.dirty.discard(index)
+
+        if due:
+            print(f"Blocked {len(due)} sources; {len(self.entries)} networks in "
+                  f"{sum(len(s.addresses or ()) for s in self.shards)} WAF entries")
+        blocked = set()
+        for cidr, ip in wanted.items():
+            covering = self._covering(cidr)
+            if covering is not None and self.entries[covering][1] not in self.dirty:
+                blocked.add(ip)
+        return blocked